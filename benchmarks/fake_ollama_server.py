@@ -0,0 +1,136 @@
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime, timezone
+
+from aiohttp import web
+
+from source.logger import LoggerMixin
+
+
+class FakeOllamaServer(LoggerMixin):
+    """
+    Imitates the chat endpoint of Ollama (`POST /api/chat`) without a model, so the chat pipeline and the chat API can
+    be tested and load-tested without a GPU. Every answer consists of `answer_tokens` tokens, the first one is sent
+    after `time_to_first_token` seconds, the others at `tokens_per_second`. At most `parallel` answers are generated at
+    once like `OLLAMA_NUM_PARALLEL`, further requests wait.
+
+    Point the pipeline at it with `OLLAMA_URL=http://localhost:<port>`.
+
+    :param answer_tokens: The number of tokens of every answer.
+    :param time_to_first_token: The amount of seconds until the first token is sent.
+    :param tokens_per_second: The number of tokens sent per second after the first one.
+    :param parallel: The maximum number of answers generated at once.
+    """
+
+    def __init__(
+        self,
+        answer_tokens: int = 64,
+        time_to_first_token: float = 0.2,
+        tokens_per_second: float = 50,
+        parallel: int = 4,
+    ):
+        super().__init__()
+
+        self.answer_tokens = answer_tokens
+        self.time_to_first_token = time_to_first_token
+        self.tokens_per_second = tokens_per_second
+
+        self._slots = asyncio.Semaphore(parallel)
+        self.requests = 0
+
+    def application(self) -> web.Application:
+        """
+        :return: The aiohttp application serving the chat endpoint.
+        """
+        application = web.Application()
+        application.add_routes([web.post("/api/chat", self.chat)])
+
+        return application
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> web.AppRunner:
+        """
+        Starts the server in the running event loop.
+
+        :param host: The host to listen on.
+        :param port: The port to listen on, 0 picks a free port.
+        :return: The runner of the server, call `cleanup()` on it to stop the server.
+        """
+        runner = web.AppRunner(self.application())
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+
+        return runner
+
+    @staticmethod
+    def _message(model: str, content: str, done: bool) -> dict:
+        return {
+            "model": model,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "message": {"role": "assistant", "content": content},
+            "done": done,
+        }
+
+    async def chat(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        model = body.get("model", "fake")
+        question = body["messages"][-1]["content"]
+        self.requests += 1
+
+        async with self._slots:
+            start = time.perf_counter()
+            await asyncio.sleep(self.time_to_first_token)
+            tokens = [f"token{index} " for index in range(self.answer_tokens)]
+
+            if not body.get("stream"):
+                await asyncio.sleep(len(tokens[1:]) / self.tokens_per_second)
+                return web.json_response(
+                    self._message(model, "".join(tokens), done=True)
+                    | {
+                        "prompt_eval_count": len(question.split()),
+                        "prompt_eval_duration": int(self.time_to_first_token * 1e9),
+                    }
+                )
+
+            response = web.StreamResponse(
+                headers={"Content-Type": "application/x-ndjson"}
+            )
+            await response.prepare(request)
+            for index, token in enumerate(tokens):
+                if index:
+                    await asyncio.sleep(1 / self.tokens_per_second)
+                line = json.dumps(self._message(model, token, done=False))
+                await response.write(f"{line}\n".encode("utf-8"))
+            final = self._message(model, "", done=True) | {
+                "total_duration": int((time.perf_counter() - start) * 1e9),
+                "prompt_eval_count": len(question.split()),
+                "eval_count": len(tokens),
+            }
+            await response.write(f"{json.dumps(final)}\n".encode("utf-8"))
+            await response.write_eof()
+
+        return response
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve a fake Ollama chat endpoint that streams placeholder tokens"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--answer-tokens", type=int, default=64)
+    parser.add_argument("--time-to-first-token", type=float, default=0.2)
+    parser.add_argument("--tokens-per-second", type=float, default=50)
+    parser.add_argument("--parallel", type=int, default=4)
+    arguments = parser.parse_args()
+
+    fake_ollama_server = FakeOllamaServer(
+        answer_tokens=arguments.answer_tokens,
+        time_to_first_token=arguments.time_to_first_token,
+        tokens_per_second=arguments.tokens_per_second,
+        parallel=arguments.parallel,
+    )
+    web.run_app(
+        fake_ollama_server.application(), host=arguments.host, port=arguments.port
+    )
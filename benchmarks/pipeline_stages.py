@@ -0,0 +1,460 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Iterator, Optional
+
+import numpy as np
+from aiohttp import web
+from git import Repo
+from haystack import tracing
+from haystack.tracing import Span, Tracer
+from haystack.tracing.tracer import NullSpan
+from haystack_integrations.document_stores.qdrant import QdrantDocumentStore
+
+from benchmarks.fake_ollama_server import FakeOllamaServer
+from source.corpus_catalog import CorpusCatalog
+from source.git_root_finder import GitRootFinder
+from source.gpn_chat_pipeline import GPNChatPipeline
+from source.indexing_pipeline import IndexingPipeline
+from source.logger import LoggerMixin
+
+WORDS = (
+    "Firmware Bootloader Zigbee Rust Router Protokoll Angriff Signatur Speicher Compiler Kernel Treiber Netzwerk "
+    "Schlüssel Sensor Platine Lötkolben Debugger Emulator Container Datenbank Verschlüsselung Funk Antenne Drohne "
+    "Quellcode Hardware Mikrocontroller Oszilloskop Wireshark Exploit Fuzzing Sandbox Browser Webserver Tastatur"
+).split()
+QUESTION_TEMPLATES = (
+    "Was wurde über {} und {} erzählt?",
+    "Wer hat einen Talk über {} gehalten, in dem auch {} vorkommt?",
+    "Wie hängen {} und {} zusammen?",
+    "Welche Tools werden für {} mit {} empfohlen?",
+)
+
+
+class ComponentTimer(Tracer):
+    """
+    A Haystack tracer that records how long every component of a pipeline run takes. It is enabled globally with
+    `haystack.tracing.enable_tracing()`, so it also times pipelines that run in multiple threads at once.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._durations = {}
+
+    @contextlib.contextmanager
+    def trace(
+        self,
+        operation_name: str,
+        tags: Optional[dict[str, Any]] = None,
+        parent_span: Optional[Span] = None,
+    ) -> Iterator[Span]:
+        start = time.perf_counter()
+        try:
+            yield NullSpan()
+        finally:
+            if operation_name == "haystack.component.run":
+                duration = (time.perf_counter() - start) * 1000
+                with self._lock:
+                    self._durations.setdefault(
+                        tags["haystack.component.name"], []
+                    ).append(duration)
+
+    def current_span(self) -> Optional[Span]:
+        return None
+
+    def take(self) -> dict[str, list[float]]:
+        """
+        :return: The durations in milliseconds per component recorded since the last call.
+        """
+        with self._lock:
+            durations = self._durations
+            self._durations = {}
+
+        return durations
+
+
+def _summarize(values: list[float]) -> dict[str, float]:
+    """
+    :param values: The measured values.
+    :return: The number of values, their mean and their 50th, 95th and 99th percentile.
+    """
+    return {
+        "count": len(values),
+        "mean": statistics.mean(values),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "p99": float(np.percentile(values, 99)),
+    }
+
+
+class PipelineStagesBenchmark(LoggerMixin):
+    """
+    Measures the latency of every component of the `IndexingPipeline` and the `GPNChatPipeline`, so a regression can be
+    attributed to the embedding, the vector backend, the prompt building or the LLM.
+
+    Nothing but the embedding models and the reranker is real: The talks are a synthetic corpus written to a temporary
+    workspace, the vector backend is Qdrant in local mode (or the flat backend) in that workspace and the LLM is a
+    `FakeOllamaServer` that streams tokens at a fixed rate. The corpus is indexed once, then every number of concurrent
+    clients sends its queries to one shared chat pipeline.
+
+    The latencies are reported as p50, p95 and p99 in milliseconds. Every run is appended as one JSON line to the
+    results file together with the commit and the configuration, and the chat latencies are compared with the previous
+    run of the same configuration.
+
+    :param number_of_talks: The number of talks of the synthetic corpus.
+    :param sentences_per_talk: The number of sentences of every talk.
+    :param backend: The vector backend, "qdrant-local" or "flat".
+    :param answer_tokens: The number of tokens of every answer of the fake Ollama.
+    :param time_to_first_token: The amount of seconds until the fake Ollama sends the first token.
+    :param tokens_per_second: The number of tokens the fake Ollama sends per second.
+    :param ollama_parallel: The number of answers the fake Ollama generates at once.
+    """
+
+    def __init__(
+        self,
+        number_of_talks: int,
+        sentences_per_talk: int,
+        backend: str,
+        answer_tokens: int,
+        time_to_first_token: float,
+        tokens_per_second: float,
+        ollama_parallel: int,
+    ):
+        super().__init__()
+
+        self.configuration = {
+            "talks": number_of_talks,
+            "sentences_per_talk": sentences_per_talk,
+            "backend": backend,
+            "answer_tokens": answer_tokens,
+            "time_to_first_token": time_to_first_token,
+            "tokens_per_second": tokens_per_second,
+            "ollama_parallel": ollama_parallel,
+        }
+        self.random = random.Random(0)
+        self.timer = ComponentTimer()
+
+    def _sentence(self) -> str:
+        words = self.random.choices(WORDS, k=self.random.randint(6, 16))
+        return f"{' '.join(words).capitalize()}."
+
+    def _write_corpus(self, data_directory: str) -> None:
+        for directory in ("metadata", "transcriptions"):
+            os.makedirs(os.path.join(data_directory, directory))
+
+        for index in range(self.configuration["talks"]):
+            talk_id = f"talk_{index:05d}"
+            metadata = {
+                "title": f"{' '.join(self.random.sample(WORDS, 3))} {index}",
+                "gpn": f"gpn{18 + index % 5}",
+                "speakers": [f"Speaker {index % 97}"],
+                "date": f"{2018 + index % 5}-06-0{1 + index % 4}",
+                "duration": "45 min",
+            }
+            with open(
+                os.path.join(data_directory, "metadata", f"{talk_id}.json"),
+                mode="w",
+                encoding="utf-8",
+            ) as file:
+                json.dump(metadata, file)
+            with open(
+                os.path.join(data_directory, "transcriptions", f"{talk_id}.txt"),
+                mode="w",
+                encoding="utf-8",
+            ) as file:
+                file.write(
+                    " ".join(
+                        self._sentence()
+                        for _ in range(self.configuration["sentences_per_talk"])
+                    )
+                )
+
+        CorpusCatalog().rebuild()
+
+    @contextlib.contextmanager
+    def _fake_ollama(self) -> Iterator[str]:
+        """
+        Serves a `FakeOllamaServer` from a background thread.
+
+        :return: The URL of the server.
+        """
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+
+        async def start() -> web.AppRunner:
+            # The server is created in its loop, its semaphore binds to the running loop on Python 3.9
+            fake_ollama_server = FakeOllamaServer(
+                answer_tokens=self.configuration["answer_tokens"],
+                time_to_first_token=self.configuration["time_to_first_token"],
+                tokens_per_second=self.configuration["tokens_per_second"],
+                parallel=self.configuration["ollama_parallel"],
+            )
+            return await fake_ollama_server.start()
+
+        runner = asyncio.run_coroutine_threadsafe(start(), loop).result()
+        try:
+            host, port = runner.addresses[0][:2]
+            yield f"http://{host}:{port}"
+        finally:
+            asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+
+    def measure_indexing(self) -> dict:
+        """
+        Indexes the synthetic corpus from scratch.
+
+        :return: The duration and throughput of the indexing and the latencies of its components per batch.
+        """
+        # Built before the timer starts, drawing the pipeline would need mermaid.ink
+        indexing_pipeline = IndexingPipeline(recreate_index=True, draw=False)
+        self.timer.take()
+        start = time.perf_counter()
+        indexing_pipeline.run()
+        duration = time.perf_counter() - start
+
+        document_store = indexing_pipeline.pipeline.get_component(
+            "writer"
+        ).document_store
+        number_of_chunks = document_store.count_documents()
+        if isinstance(document_store, QdrantDocumentStore):
+            # Qdrant in local mode only allows one client per directory
+            document_store.client.close()
+
+        results = {
+            "seconds": duration,
+            "chunks": number_of_chunks,
+            "talks_per_second": self.configuration["talks"] / duration,
+            "chunks_per_second": number_of_chunks / duration,
+            "components": {
+                name: _summarize(durations)
+                for name, durations in self.timer.take().items()
+            },
+        }
+        self.log.info(
+            f"Indexed {self.configuration['talks']} talks into {number_of_chunks} chunks in {duration:.1f}s "
+            f"({results['chunks_per_second']:.1f} chunks/s)"
+        )
+        self._log_components(results["components"])
+
+        return results
+
+    def _question(self) -> str:
+        return self.random.choice(QUESTION_TEMPLATES).format(
+            *self.random.sample(WORDS, 2)
+        )
+
+    def measure_chat(
+        self, chat_pipeline: GPNChatPipeline, clients: int, queries_per_client: int
+    ) -> dict:
+        """
+        :param chat_pipeline: The pipeline shared by all clients.
+        :param clients: The number of clients that send their queries at the same time.
+        :param queries_per_client: The number of queries every client sends one after another.
+        :return: The throughput, the end-to-end latency, the time to the first token and the latencies of the
+        components.
+        """
+        questions = [
+            [self._question() for _ in range(queries_per_client)]
+            for _ in range(clients)
+        ]
+        latencies = []
+        times_to_first_token = []
+        lock = threading.Lock()
+
+        def ask(question: str) -> None:
+            start = time.perf_counter()
+            first_token = []
+
+            def streaming_callback(_: object) -> None:
+                if not first_token:
+                    first_token.append(time.perf_counter())
+
+            chat_pipeline.run(question, streaming_callback=streaming_callback)
+            end = time.perf_counter()
+            with lock:
+                latencies.append((end - start) * 1000)
+                times_to_first_token.append((first_token[0] - start) * 1000)
+
+        def send(client_questions: list[str]) -> None:
+            for question in client_questions:
+                ask(question)
+
+        # Loads the models and fills the caches of the vector backend
+        ask(self._question())
+        self.timer.take()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as executor:
+            list(executor.map(send, questions))
+        duration = time.perf_counter() - start
+
+        results = {
+            "queries_per_second": clients * queries_per_client / duration,
+            "latency": _summarize(latencies),
+            "time_to_first_token": _summarize(times_to_first_token),
+            "components": {
+                name: _summarize(durations)
+                for name, durations in self.timer.take().items()
+            },
+        }
+        self.log.info(
+            f"{clients} clients: {results['queries_per_second']:.2f} queries/s, "
+            f"latency p50 {results['latency']['p50']:.0f}ms, p99 {results['latency']['p99']:.0f}ms, "
+            f"time to first token p50 {results['time_to_first_token']['p50']:.0f}ms"
+        )
+        self._log_components(results["components"])
+
+        return results
+
+    def _log_components(self, components: dict[str, dict[str, float]]) -> None:
+        for name, latencies in components.items():
+            self.log.info(
+                f"{name:>22}: p50 {latencies['p50']:8.2f}ms, p95 {latencies['p95']:8.2f}ms, "
+                f"p99 {latencies['p99']:8.2f}ms"
+            )
+
+    def _compare_with_previous_run(self, results_path: str, results: dict) -> None:
+        """
+        Logs the change of the median chat latencies compared with the last run with the same configuration.
+
+        :param results_path: The file with the results of the previous runs.
+        :param results: The results of this run.
+        :return: None
+        """
+        previous_results = None
+        with open(results_path, mode="r", encoding="utf-8") as file:
+            for line in file:
+                run = json.loads(line)
+                if run["configuration"] == results["configuration"]:
+                    previous_results = run
+        if previous_results is None:
+            return
+
+        self.log.info(
+            f"Compared with {previous_results['commit'][:8]} from {previous_results['timestamp']}:"
+        )
+        for clients, chat in results["chat"].items():
+            previous_chat = previous_results["chat"].get(clients)
+            if previous_chat is None:
+                continue
+            stages = {"end-to-end": (chat["latency"], previous_chat["latency"])}
+            for name, latencies in chat["components"].items():
+                if name in previous_chat["components"]:
+                    stages[name] = (latencies, previous_chat["components"][name])
+            for name, (latencies, previous_latencies) in stages.items():
+                change = latencies["p50"] / previous_latencies["p50"] - 1
+                self.log.info(
+                    f"{clients} clients, {name:>22}: p50 {previous_latencies['p50']:8.2f}ms -> "
+                    f"{latencies['p50']:8.2f}ms ({change:+.0%})"
+                )
+
+    def run(
+        self, client_counts: list[int], queries_per_client: int, results_path: str
+    ) -> dict:
+        """
+        Indexes the synthetic corpus and measures the chat with every number of clients.
+
+        :param client_counts: The numbers of concurrent clients.
+        :param queries_per_client: The number of queries every client sends.
+        :param results_path: The JSON lines file the results are appended to.
+        :return: The results of the run.
+        """
+        results = {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "commit": Repo(GitRootFinder.get()).head.commit.hexsha,
+            "configuration": self.configuration
+            | {"queries_per_client": queries_per_client},
+        }
+
+        working_directory = os.getcwd()
+        environment = dict(os.environ)
+        tracing.enable_tracing(self.timer)
+        try:
+            with tempfile.TemporaryDirectory() as directory, self._fake_ollama() as url:
+                # The pipelines find their data directory through the Git repository they run in
+                Repo.init(directory)
+                os.chdir(directory)
+                os.environ["VECTOR_BACKEND"] = self.configuration["backend"]
+                os.environ["OLLAMA_URL"] = url
+
+                self._write_corpus(os.path.join(directory, "data"))
+                results["indexing"] = self.measure_indexing()
+
+                chat_pipeline = GPNChatPipeline(
+                    query_embedding_cache_size=0, answer_cache=False, draw=False
+                )
+                results["chat"] = {
+                    str(clients): self.measure_chat(
+                        chat_pipeline, clients, queries_per_client
+                    )
+                    for clients in client_counts
+                }
+        finally:
+            tracing.disable_tracing()
+            os.chdir(working_directory)
+            os.environ.clear()
+            os.environ.update(environment)
+
+        os.makedirs(os.path.dirname(results_path), exist_ok=True)
+        if os.path.exists(results_path):
+            self._compare_with_previous_run(results_path, results)
+        with open(results_path, mode="a", encoding="utf-8") as file:
+            file.write(f"{json.dumps(results)}\n")
+        self.log.info(f"Appended the results to {results_path}")
+
+        return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure the latency per component of the indexing and chat pipelines against local stand-ins"
+    )
+    parser.add_argument("--talks", type=int, default=200)
+    parser.add_argument("--sentences-per-talk", type=int, default=150)
+    parser.add_argument(
+        "--backend",
+        choices=["qdrant-local", "flat"],
+        default="qdrant-local",
+        help="The vector backend - Default: %(default)s",
+    )
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--queries", type=int, default=10, help="Queries per client")
+    parser.add_argument("--answer-tokens", type=int, default=64)
+    parser.add_argument("--time-to-first-token", type=float, default=0.2)
+    parser.add_argument("--tokens-per-second", type=float, default=50)
+    parser.add_argument("--ollama-parallel", type=int, default=4)
+    parser.add_argument(
+        "--output",
+        default=os.path.join(
+            GitRootFinder.get(), "data", "benchmarks", "pipeline_stages.jsonl"
+        ),
+        help="The JSON lines file the results are appended to - Default: %(default)s",
+    )
+    arguments = parser.parse_args()
+
+    benchmark = PipelineStagesBenchmark(
+        number_of_talks=arguments.talks,
+        sentences_per_talk=arguments.sentences_per_talk,
+        backend=arguments.backend,
+        answer_tokens=arguments.answer_tokens,
+        time_to_first_token=arguments.time_to_first_token,
+        tokens_per_second=arguments.tokens_per_second,
+        ollama_parallel=arguments.ollama_parallel,
+    )
+    benchmark.run(
+        client_counts=arguments.clients,
+        queries_per_client=arguments.queries,
+        results_path=arguments.output,
+    )
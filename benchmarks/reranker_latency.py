@@ -0,0 +1,233 @@
+import argparse
+import os
+import random
+import time
+
+import numpy as np
+import requests
+from haystack import Document
+from haystack.components.builders import ChatPromptBuilder
+from haystack.components.rankers import TransformersSimilarityRanker
+from haystack.dataclasses import ChatMessage
+
+from source.context_builder import ContextBuilder
+from source.gpn_chat_pipeline import DOCUMENT_PROMPT_TEMPLATE, RERANKER_MODEL
+from source.logger import LoggerMixin
+from source.sparse_document_store import SparseDocumentStore
+
+SAMPLE_QUERIES = [
+    "Wer hält den Talk über Zigbee?",
+    "Wie funktioniert der Angriff auf den Bootloader?",
+    "Welche Tools werden für Reverse Engineering empfohlen?",
+    "Was ist die Gulaschprogrammiernacht?",
+    "Wie kann ich meinen Router mit eigener Firmware flashen?",
+    "Welche Programmiersprache wurde für das Projekt verwendet?",
+]
+SAMPLE_SENTENCES = [
+    "Wir haben die Firmware aus dem Flash-Speicher ausgelesen.",
+    "Der Bootloader prüft die Signatur nicht richtig.",
+    "Mit einem Logic Analyzer sieht man die Kommunikation auf dem Bus.",
+    "Das Projekt ist komplett in Rust geschrieben.",
+    "Danach haben wir das Protokoll mit Wireshark analysiert.",
+    "Die Zigbee-Geräte senden ihre Schlüssel unverschlüsselt.",
+]
+
+
+class RerankerLatencyBenchmark(LoggerMixin):
+    """
+    Compares the time the cross-encoder needs to rerank the candidates with the prefill time of the LLM it saves,
+    because fewer chunks end up in the prompt.
+
+    The chunks are taken from the sparse index if it exists, otherwise they are made up of numbered sample sentences,
+    so the `ContextBuilder` does not drop them as duplicates. The prefill time is the `prompt_eval_duration` reported by
+    Ollama for a prompt with `baseline_top_k` chunks and for a prompt with `rerank_top_k` chunks. The token budget of
+    the context fits `baseline_top_k` chunks, so it does not shorten the prompt the reranker is compared to.
+
+    :param number_of_queries: The number of measured queries per setting.
+    :param rerank_top_k: The number of chunks kept by the reranker.
+    :param baseline_top_k: The number of chunks in the prompt without the reranker.
+    """
+
+    def __init__(self, number_of_queries: int, rerank_top_k: int, baseline_top_k: int):
+        super().__init__()
+
+        self.number_of_queries = number_of_queries
+        self.rerank_top_k = rerank_top_k
+        self.baseline_top_k = baseline_top_k
+        self.random = random.Random(0)
+        self.chunks = self._load_chunks()
+
+    def _load_chunks(self) -> list[Document]:
+        document_store = SparseDocumentStore()
+        if document_store.count_documents() >= 100:
+            return document_store.filter_documents()
+
+        self.log.info("The sparse index is empty, using sample chunks")
+        return [
+            Document(
+                content=" ".join(
+                    f"{sentence.removesuffix('.')} (Beispiel {index * 5 + position})."
+                    for position, sentence in enumerate(
+                        self.random.sample(SAMPLE_SENTENCES * 2, 5)
+                    )
+                ),
+                meta={"talk_id": f"talk {index // 20}", "title": f"Talk {index // 20}"},
+            )
+            for index in range(1000)
+        ]
+
+    def _sample(self, count: int) -> tuple[str, list[Document]]:
+        query = self.random.choice(SAMPLE_QUERIES)
+        return query, self.random.sample(self.chunks, min(count, len(self.chunks)))
+
+    def measure_reranker(
+        self, candidate_counts: list[int]
+    ) -> dict[int, dict[str, float]]:
+        """
+        :param candidate_counts: The numbers of candidates to rerank.
+        :return: The median and 99th percentile latency of the reranker in milliseconds per number of candidates.
+        """
+        ranker = TransformersSimilarityRanker(
+            model=RERANKER_MODEL, top_k=self.rerank_top_k, batch_size=16
+        )
+        ranker.warm_up()
+        ranker.run(*self._sample(candidate_counts[0]))
+
+        results = {}
+        for candidate_count in candidate_counts:
+            latencies = []
+            for _ in range(self.number_of_queries):
+                query, candidates = self._sample(candidate_count)
+                start = time.perf_counter()
+                ranker.run(query=query, documents=candidates)
+                latencies.append((time.perf_counter() - start) * 1000)
+
+            results[candidate_count] = {
+                "p50": float(np.percentile(latencies, 50)),
+                "p99": float(np.percentile(latencies, 99)),
+            }
+            self.log.info(
+                f"Reranking {candidate_count:>3} candidates: p50 {results[candidate_count]['p50']:.1f}ms, "
+                f"p99 {results[candidate_count]['p99']:.1f}ms"
+            )
+
+        return results
+
+    def measure_prefill(
+        self, ollama_url: str, model: str
+    ) -> tuple[dict[int, float], dict[int, float]]:
+        """
+        :param ollama_url: The URL of the Ollama server.
+        :param model: The LLM to measure.
+        :return: The median prefill time in milliseconds and the median number of prompt tokens per number of chunks
+        in the prompt.
+        """
+        prompt_builder = ChatPromptBuilder(
+            template=[ChatMessage.from_user(DOCUMENT_PROMPT_TEMPLATE)]
+        )
+        longest_chunk = max(
+            ContextBuilder.count_tokens(chunk.content) for chunk in self.chunks
+        )
+        # Leaves room for the header of every talk
+        context_builder = ContextBuilder(
+            token_budget=self.baseline_top_k * (longest_chunk + 64)
+        )
+
+        results = {}
+        prompt_tokens = {}
+        for top_k in (self.baseline_top_k, self.rerank_top_k):
+            durations = []
+            token_counts = []
+            for _ in range(self.number_of_queries):
+                # Different chunks per query keep Ollama from reusing the prompt of the last query
+                query, chunks = self._sample(top_k)
+                context = context_builder.run(documents=chunks)["documents"]
+                prompt = prompt_builder.run(documents=context, query=query)["prompt"]
+                response = requests.post(
+                    f"{ollama_url}/api/chat",
+                    json={
+                        "model": model,
+                        "messages": [{"role": "user", "content": prompt[0].text}],
+                        "stream": False,
+                        "options": {"num_predict": 1},
+                    },
+                    timeout=300,
+                )
+                response.raise_for_status()
+                durations.append(response.json()["prompt_eval_duration"] / 1e6)
+                token_counts.append(response.json()["prompt_eval_count"])
+
+            results[top_k] = float(np.percentile(durations, 50))
+            prompt_tokens[top_k] = float(np.percentile(token_counts, 50))
+            self.log.info(
+                f"Prefill of {top_k:>3} chunks ({prompt_tokens[top_k]:.0f} prompt tokens): "
+                f"p50 {results[top_k]:.1f}ms"
+            )
+
+        return results, prompt_tokens
+
+    def run(
+        self,
+        candidate_counts: list[int],
+        ollama_url: str = None,
+        model: str = "llama3.2",
+    ) -> dict:
+        """
+        :param candidate_counts: The numbers of candidates to rerank.
+        :param ollama_url: The URL of the Ollama server. The prefill is not measured if it is None.
+        :param model: The LLM to measure.
+        :return: The latencies of the reranker, the prefill times and the numbers of prompt tokens.
+        """
+        results = {"reranker": self.measure_reranker(candidate_counts)}
+        if ollama_url is None:
+            return results
+
+        results["prefill"], results["prompt_tokens"] = self.measure_prefill(
+            ollama_url, model
+        )
+        saved = (
+            results["prefill"][self.baseline_top_k]
+            - results["prefill"][self.rerank_top_k]
+        )
+        for candidate_count, latencies in results["reranker"].items():
+            self.log.info(
+                f"Reranking {candidate_count} candidates to {self.rerank_top_k} chunks costs {latencies['p50']:.1f}ms "
+                f"and saves {saved:.1f}ms of prefill compared to {self.baseline_top_k} chunks: "
+                f"{saved - latencies['p50']:+.1f}ms per query"
+            )
+
+        return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the latency of the cross-encoder reranker with the LLM prefill time it saves"
+    )
+    parser.add_argument("--candidates", type=int, nargs="+", default=[20, 50, 100])
+    parser.add_argument("--rerank-top-k", type=int, default=5)
+    parser.add_argument("--baseline-top-k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument(
+        "--ollama-url",
+        default=os.environ.get("OLLAMA_URL", "http://localhost:11434"),
+        help="The URL of the Ollama server - Default: %(default)s",
+    )
+    parser.add_argument(
+        "--skip-prefill",
+        action="store_true",
+        default=False,
+        help="Only measure the reranker - Default: %(default)s",
+    )
+    parser.add_argument("--model", default="llama3.2")
+    arguments = parser.parse_args()
+
+    benchmark = RerankerLatencyBenchmark(
+        number_of_queries=arguments.queries,
+        rerank_top_k=arguments.rerank_top_k,
+        baseline_top_k=arguments.baseline_top_k,
+    )
+    benchmark.run(
+        candidate_counts=arguments.candidates,
+        ollama_url=None if arguments.skip_prefill else arguments.ollama_url,
+        model=arguments.model,
+    )
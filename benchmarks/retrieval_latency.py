@@ -0,0 +1,130 @@
+import argparse
+import statistics
+import tempfile
+import time
+
+import numpy as np
+from haystack import Document
+from haystack_integrations.components.retrievers.qdrant import QdrantEmbeddingRetriever
+from haystack_integrations.document_stores.qdrant import QdrantDocumentStore
+
+from source.flat_document_store import FlatDocumentStore
+from source.flat_embedding_retriever import FlatEmbeddingRetriever
+from source.logger import LoggerMixin
+
+EMBEDDING_DIM = 384
+
+
+class RetrievalLatencyBenchmark(LoggerMixin):
+    """
+    Measures the latency of a single retrieval with the embedded `FlatDocumentStore`, Qdrant in local mode and the
+    Qdrant server. Every backend is filled with the same random chunks and queried with the same random embeddings.
+
+    :param number_of_chunks: The number of chunks in the index.
+    :param number_of_queries: The number of measured queries per backend.
+    :param top_k: The number of documents retrieved per query.
+    """
+
+    def __init__(self, number_of_chunks: int, number_of_queries: int, top_k: int):
+        super().__init__()
+
+        generator = np.random.default_rng(0)
+        self.documents = [
+            Document(
+                content=f"Chunk {index}",
+                meta={"talk_id": f"talk {index // 50}"},
+                embedding=embedding.tolist(),
+            )
+            for index, embedding in enumerate(
+                generator.standard_normal((number_of_chunks, EMBEDDING_DIM))
+            )
+        ]
+        self.queries = generator.standard_normal(
+            (number_of_queries, EMBEDDING_DIM)
+        ).tolist()
+        self.top_k = top_k
+
+    def measure(self, name: str, retriever: object) -> dict[str, float]:
+        """
+        :param name: The name of the backend, only used for logging.
+        :param retriever: The retriever of the backend.
+        :return: The median, 99th percentile and mean latency in milliseconds.
+        """
+        # The first query maps the index and warms up caches
+        retriever.run(query_embedding=self.queries[0], top_k=self.top_k)
+
+        latencies = []
+        for query in self.queries:
+            start = time.perf_counter()
+            retriever.run(query_embedding=query, top_k=self.top_k)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        results = {
+            "p50": float(np.percentile(latencies, 50)),
+            "p99": float(np.percentile(latencies, 99)),
+            "mean": statistics.mean(latencies),
+        }
+        self.log.info(
+            f"{name:>12}: p50 {results['p50']:.2f}ms, p99 {results['p99']:.2f}ms, mean {results['mean']:.2f}ms"
+        )
+
+        return results
+
+    def run(self, qdrant_url: str = None) -> dict[str, dict[str, float]]:
+        """
+        Fills and queries every backend.
+
+        :param qdrant_url: The URL of a Qdrant server. The server is skipped if it is None.
+        :return: The latencies per backend.
+        """
+        results = {}
+        with tempfile.TemporaryDirectory() as directory:
+            flat_document_store = FlatDocumentStore(
+                directory=f"{directory}/flat", embedding_dim=EMBEDDING_DIM
+            )
+            flat_document_store.write_documents(self.documents)
+            results["flat"] = self.measure(
+                "flat", FlatEmbeddingRetriever(document_store=flat_document_store)
+            )
+
+            locations = {"qdrant-local": {"path": f"{directory}/qdrant_local"}}
+            if qdrant_url:
+                locations["qdrant"] = {"location": qdrant_url}
+
+            for name, location in locations.items():
+                qdrant_document_store = QdrantDocumentStore(
+                    **location,
+                    index="gpn-chat-benchmark",
+                    embedding_dim=EMBEDDING_DIM,
+                    recreate_index=True,
+                    progress_bar=False,
+                )
+                qdrant_document_store.write_documents(self.documents)
+                results[name] = self.measure(
+                    name, QdrantEmbeddingRetriever(document_store=qdrant_document_store)
+                )
+                qdrant_document_store.client.delete_collection("gpn-chat-benchmark")
+
+        return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the retrieval latency of the embedded vector backends with the Qdrant server"
+    )
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument(
+        "--qdrant-url",
+        default=None,
+        help="The URL of the Qdrant server, e.g. http://localhost:6333. Without it the server is not measured.",
+    )
+    arguments = parser.parse_args()
+
+    benchmark = RetrievalLatencyBenchmark(
+        number_of_chunks=arguments.chunks,
+        number_of_queries=arguments.queries,
+        top_k=arguments.top_k,
+    )
+    benchmark.run(qdrant_url=arguments.qdrant_url)
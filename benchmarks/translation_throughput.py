@@ -0,0 +1,96 @@
+import argparse
+import time
+
+import torch
+
+from source.logger import LoggerMixin
+from source.translator import Translator, split_into_sentences
+
+SAMPLE_TEXTS = {
+    "en": (
+        "Welcome to my talk. Today I want to show you how we built our own router firmware. "
+        "It started as a weekend project and got out of hand quite quickly! "
+        "Who of you has ever flashed a custom firmware onto a device? "
+        "Great, that is more than I expected. "
+        "The first problem we ran into was that the bootloader was locked down by the vendor."
+    ),
+    "de": (
+        "Herzlich willkommen zu meinem Vortrag. Heute möchte ich euch zeigen, wie wir unsere eigene Router-Firmware "
+        "gebaut haben. Es hat als Wochenendprojekt angefangen und ist ziemlich schnell eskaliert! "
+        "Wer von euch hat schon einmal eine eigene Firmware auf ein Gerät geflasht? "
+        "Super, das sind mehr als ich erwartet hatte. "
+        "Das erste Problem war, dass der Bootloader vom Hersteller gesperrt wurde."
+    ),
+}
+
+
+class TranslationThroughputBenchmark(LoggerMixin):
+    """
+    Measures how many sentences per second the `Translator` translates on the CPU for different batch sizes.
+
+    :param target_language: The language to translate to.
+    :param source_language: The language to translate from.
+    :param number_of_sentences: The number of sentences that are translated per batch size.
+    """
+
+    def __init__(
+        self, target_language: str, source_language: str, number_of_sentences: int
+    ):
+        super().__init__()
+
+        # The cache would answer every batch size after the first one and fill the production cache
+        self.translator = Translator(target_language=target_language, use_cache=False)
+        self.source_language = source_language
+
+        sample_sentences = split_into_sentences(SAMPLE_TEXTS[source_language])
+        repetitions = -(-number_of_sentences // len(sample_sentences))
+        self.text = " ".join((sample_sentences * repetitions)[:number_of_sentences])
+        self.number_of_sentences = number_of_sentences
+
+    def run(self, batch_sizes: list[int]) -> dict[int, float]:
+        """
+        Translates the sample text once with every batch size.
+
+        :param batch_sizes: The batch sizes to compare.
+        :return: The throughput in sentences per second for each batch size.
+        """
+        # Warm up the model, so that the first batch size is not penalized
+        self.translator.translate_text(self.text[:200], self.source_language)
+
+        results = {}
+        for batch_size in batch_sizes:
+            self.translator.max_batch_size = batch_size
+            start = time.perf_counter()
+            self.translator.translate_text(self.text, self.source_language)
+            duration = time.perf_counter() - start
+
+            results[batch_size] = self.number_of_sentences / duration
+            self.log.info(
+                f"Batch size {batch_size:>3}: {results[batch_size]:.1f} sentences/s ({duration:.1f}s)"
+            )
+
+        return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the translation throughput of different batch sizes on the CPU"
+    )
+    parser.add_argument("--source-language", choices=["en", "de"], default="en")
+    parser.add_argument("--target-language", default="de")
+    parser.add_argument("--sentences", type=int, default=256)
+    parser.add_argument(
+        "--batch-sizes", type=int, nargs="+", default=[1, 4, 8, 16, 32, 64]
+    )
+    parser.add_argument("--threads", type=int, default=None)
+    arguments = parser.parse_args()
+
+    if arguments.threads:
+        torch.set_num_threads(arguments.threads)
+
+    benchmark = TranslationThroughputBenchmark(
+        target_language=arguments.target_language,
+        source_language=arguments.source_language,
+        number_of_sentences=arguments.sentences,
+    )
+    benchmark.run(arguments.batch_sizes)
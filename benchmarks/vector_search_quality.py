@@ -0,0 +1,230 @@
+import argparse
+import time
+
+import numpy as np
+from qdrant_client import QdrantClient
+from qdrant_client.http import models as rest
+
+from source.embedding_cache import EmbeddingCache
+from source.indexing_pipeline import IndexingPipeline
+from source.logger import LoggerMixin
+from source.vector_backend import VectorBackend
+
+COLLECTION_NAME = "gpn-chat-benchmark"
+
+
+class VectorSearchQualityBenchmark(LoggerMixin):
+    """
+    Compares quantization and HNSW settings of the Qdrant server. For every combination it reports the recall@k
+    against an exact search, the p50 and p99 latency of a search and an estimate of the memory the collection needs.
+
+    The vectors are taken from the embedding cache of the indexing pipeline if it contains enough of them. Otherwise,
+    clustered random vectors are generated. The queries are held-out vectors, so they are never in the collection.
+
+    :param qdrant_url: The URL of the Qdrant server.
+    :param number_of_chunks: The number of vectors in the collection.
+    :param number_of_queries: The number of measured queries per combination.
+    :param top_k: The number of results per query.
+    """
+
+    def __init__(
+        self, qdrant_url: str, number_of_chunks: int, number_of_queries: int, top_k: int
+    ):
+        super().__init__()
+
+        self.client = QdrantClient(url=qdrant_url, timeout=300)
+        self.top_k = top_k
+
+        vectors = self._load_vectors(number_of_chunks + number_of_queries)
+        self.vectors = vectors[:number_of_chunks]
+        self.queries = vectors[number_of_chunks:]
+
+    def _load_vectors(self, number_of_vectors: int) -> np.ndarray:
+        """
+        :param number_of_vectors: The number of vectors to load.
+        :return: The vectors, real embeddings if enough are cached.
+        """
+        cache = EmbeddingCache(
+            model_name=IndexingPipeline.EMBEDDING_MODEL,
+            embedding_dim=IndexingPipeline.EMBEDDING_DIM,
+        )
+        if len(cache) >= number_of_vectors:
+            self.log.info("Using the embeddings of the embedding cache")
+            embeddings = cache.all_embeddings()
+            rows = np.random.default_rng(0).permutation(len(embeddings))
+            return embeddings[rows[:number_of_vectors]]
+
+        self.log.info(
+            f"The embedding cache only contains {len(cache)} embeddings, using random clustered vectors"
+        )
+        generator = np.random.default_rng(0)
+        centers = generator.standard_normal((256, IndexingPipeline.EMBEDDING_DIM))
+        labels = generator.integers(0, len(centers), number_of_vectors)
+        noise = generator.standard_normal(
+            (number_of_vectors, IndexingPipeline.EMBEDDING_DIM)
+        )
+        return (centers[labels] + 0.5 * noise).astype(np.float32)
+
+    def _create_collection(self, vector_backend: VectorBackend) -> None:
+        """
+        Creates the benchmark collection with the settings of the backend and waits until its index is built.
+
+        :param vector_backend: The backend with the settings of the collection.
+        :return: None
+        """
+        self.client.recreate_collection(
+            collection_name=COLLECTION_NAME,
+            vectors_config=rest.VectorParams(
+                size=IndexingPipeline.EMBEDDING_DIM, distance=rest.Distance.COSINE
+            ),
+            hnsw_config=vector_backend.hnsw_configuration(),
+            quantization_config=vector_backend.quantization_configuration(),
+            # Build the HNSW index even for small collections
+            optimizers_config=rest.OptimizersConfigDiff(indexing_threshold=1),
+        )
+        self.client.upload_collection(
+            collection_name=COLLECTION_NAME,
+            vectors=self.vectors,
+            ids=range(len(self.vectors)),
+            batch_size=256,
+            wait=True,
+        )
+        while (
+            self.client.get_collection(COLLECTION_NAME).status
+            != rest.CollectionStatus.GREEN
+        ):
+            time.sleep(1)
+
+    def _search(
+        self, query: np.ndarray, search_params: rest.SearchParams
+    ) -> tuple[set[int], float]:
+        """
+        :param query: The query vector.
+        :param search_params: The parameters of the search.
+        :return: The IDs of the results and the latency in milliseconds.
+        """
+        start = time.perf_counter()
+        points = self.client.query_points(
+            collection_name=COLLECTION_NAME,
+            query=query,
+            search_params=search_params,
+            limit=self.top_k,
+            with_payload=False,
+        ).points
+        latency = (time.perf_counter() - start) * 1000
+
+        return {point.id for point in points}, latency
+
+    def estimate_memory(self, vector_backend: VectorBackend) -> float:
+        """
+        Estimates the memory of the vectors, the quantized vectors and the links of the HNSW graph.
+
+        :param vector_backend: The backend with the settings of the collection.
+        :return: The estimated memory in MiB.
+        """
+        number_of_vectors, dimension = self.vectors.shape
+        size = number_of_vectors * dimension * 4
+        if vector_backend.quantization == "scalar":
+            size += number_of_vectors * dimension
+        elif vector_backend.quantization == "binary":
+            size += number_of_vectors * dimension / 8
+        # The lowest layer of the graph has 2 * m links of 4 bytes per vector
+        size += number_of_vectors * 2 * (vector_backend.hnsw_m or 16) * 4
+
+        return size / 1024**2
+
+    def run(
+        self,
+        quantizations: list[str],
+        hnsw_ms: list[int],
+        hnsw_efs: list[int],
+        oversamplings: list[float],
+    ) -> list[dict]:
+        """
+        Measures every combination of the given settings.
+
+        :param quantizations: The quantizations to compare.
+        :param hnsw_ms: The numbers of edges per node of the HNSW graph to compare.
+        :param hnsw_efs: The sizes of the candidate list while searching to compare.
+        :param oversamplings: The oversampling factors to compare, only used with quantization.
+        :return: The recall, latencies and memory of every combination.
+        """
+        results = []
+        for quantization in quantizations:
+            for hnsw_m in hnsw_ms:
+                vector_backend = VectorBackend(
+                    backend="qdrant", quantization=quantization, hnsw_m=hnsw_m
+                )
+                self._create_collection(vector_backend)
+                exact_results = [
+                    self._search(query, rest.SearchParams(exact=True))[0]
+                    for query in self.queries
+                ]
+
+                for hnsw_ef in hnsw_efs:
+                    for oversampling in (
+                        oversamplings if quantization != "none" else [1]
+                    ):
+                        vector_backend.hnsw_ef = hnsw_ef
+                        vector_backend.oversampling = oversampling
+                        search_params = vector_backend.search_parameters()
+
+                        recalls = []
+                        latencies = []
+                        for query, exact_result in zip(self.queries, exact_results):
+                            result, latency = self._search(query, search_params)
+                            recalls.append(len(result & exact_result) / self.top_k)
+                            latencies.append(latency)
+
+                        result = {
+                            "quantization": quantization,
+                            "m": hnsw_m,
+                            "ef": hnsw_ef,
+                            "oversampling": oversampling,
+                            "recall": float(np.mean(recalls)),
+                            "p50": float(np.percentile(latencies, 50)),
+                            "p99": float(np.percentile(latencies, 99)),
+                            "memory": self.estimate_memory(vector_backend),
+                        }
+                        results.append(result)
+                        self.log.info(
+                            f"{quantization:>6} m={hnsw_m:<3} ef={hnsw_ef:<4} oversampling={oversampling:<4}: "
+                            f"recall@{self.top_k} {result['recall']:.3f}, p50 {result['p50']:.2f}ms, "
+                            f"p99 {result['p99']:.2f}ms, ~{result['memory']:.0f} MiB"
+                        )
+
+        self.client.delete_collection(COLLECTION_NAME)
+        return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the recall, latency and memory of quantization and HNSW settings of the Qdrant server"
+    )
+    parser.add_argument("--qdrant-url", default="http://localhost:6333")
+    parser.add_argument("--chunks", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument(
+        "--quantizations",
+        nargs="+",
+        choices=VectorBackend.QUANTIZATIONS,
+        default=list(VectorBackend.QUANTIZATIONS),
+    )
+    parser.add_argument("--hnsw-m", type=int, nargs="+", default=[16, 32])
+    parser.add_argument("--hnsw-ef", type=int, nargs="+", default=[64, 128])
+    parser.add_argument("--oversampling", type=float, nargs="+", default=[1.0, 2.0])
+    arguments = parser.parse_args()
+
+    benchmark = VectorSearchQualityBenchmark(
+        qdrant_url=arguments.qdrant_url,
+        number_of_chunks=arguments.chunks,
+        number_of_queries=arguments.queries,
+        top_k=arguments.top_k,
+    )
+    benchmark.run(
+        quantizations=arguments.quantizations,
+        hnsw_ms=arguments.hnsw_m,
+        hnsw_efs=arguments.hnsw_ef,
+        oversamplings=arguments.oversampling,
+    )
@@ -18,10 +18,11 @@ def main() -> None:
 
 
 def configure_state() -> dict:
+    # The values are only created for a new session, not on every rerun of the script
     return {
-        RENDERED_MESSAGES: [],
-        CHAT_HISTORY: [],
-        GPN_CHAT_PIPELINE: Chatbot(),
+        RENDERED_MESSAGES: list,
+        CHAT_HISTORY: list,
+        GPN_CHAT_PIPELINE: Chatbot,
     }
 
 
@@ -30,11 +31,11 @@ def initialize_session_state(config: dict) -> None:
         Initialize Streamlit session state variables using the provided configuration.
 
     Args:
-        config (dict): Configuration dictionary.
+        config (dict): Configuration dictionary mapping each key to a function creating its initial value.
     """
-    for key, value in config.items():
+    for key, create_value in config.items():
         if key not in st.session_state:
-            st.session_state[key] = value
+            st.session_state[key] = create_value()
 
 
 def render_history() -> None:
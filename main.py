@@ -6,6 +6,9 @@ from iso639 import Lang
 from iso639.exceptions import InvalidLanguageValue
 
 from source.crawler import Crawler
+from source.indexing_pipeline import IndexingPipeline
+from source.ingestion_pipeline import IngestionPipeline
+from source.instrumentation import Instrumentation
 from source.transcriber import Transcriber
 from source.translator import Translator
 
@@ -14,6 +17,34 @@ class IllegalArgumentError(ValueError):
     pass
 
 
+def check_ingestion_arguments(
+    args: argparse.Namespace,
+    ingest_argument_name: str,
+    incompatible_argument_names: list[str],
+    positive_argument_names: list[str],
+) -> None:
+    """
+    Checks the arguments if the talks are ingested, which runs all stages at once.
+
+    :param args: The parsed arguments.
+    :param ingest_argument_name: The name of the argument that enables the ingestion.
+    :param incompatible_argument_names: The names of the arguments that can not be used while ingesting.
+    :param positive_argument_names: The names of the arguments that have to be at least 1.
+    :return: None
+    """
+    if not args.ingest:
+        return
+
+    for argument_name in incompatible_argument_names:
+        if getattr(args, argument_name.removeprefix("--").replace("-", "_")):
+            raise IllegalArgumentError(
+                f"Error: {argument_name} can not be used with {ingest_argument_name}!"
+            )
+    for argument_name in positive_argument_names:
+        if getattr(args, argument_name.removeprefix("--").replace("-", "_")) < 1:
+            raise IllegalArgumentError(f"Error: {argument_name} has to be at least 1!")
+
+
 def parse_arguments() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         prog="Gulaschprogrammiernacht Chat",
@@ -27,6 +58,27 @@ def parse_arguments() -> argparse.Namespace:
         default=False,
         help="Crawl the audio files and metadata from the GPN archive. This is slow and only has to be done once, the data is written to disk - Default: %(default)s",
     )
+    full_crawl_argument_name = "--full-crawl"
+    parser.add_argument(
+        full_crawl_argument_name,
+        action="store_true",
+        default=False,
+        help="Ignore the crawl manifest and crawl every talk again instead of only the ones that changed - Default: %(default)s",
+    )
+    crawl_workers_argument_name = "--crawl-workers"
+    parser.add_argument(
+        crawl_workers_argument_name,
+        type=int,
+        default=8,
+        help="The amount of talk pages to crawl concurrently. Use 1 to crawl sequentially - Default: %(default)s",
+    )
+    crawl_downloads_argument_name = "--crawl-downloads"
+    parser.add_argument(
+        crawl_downloads_argument_name,
+        type=int,
+        default=4,
+        help="The amount of audio files to download concurrently while crawling - Default: %(default)s",
+    )
     transcribe_argument_name = "--transcribe"
     parser.add_argument(
         transcribe_argument_name,
@@ -47,6 +99,30 @@ def parse_arguments() -> argparse.Namespace:
         default=None,
         help=f"The amount of CPU cores to use for transcribing - Default: 3/4 of the available CPU cores ({multiprocessing.cpu_count() * 3 // 4})",
     )
+    transcribe_device_argument_name = "--transcription-device"
+    parser.add_argument(
+        transcribe_device_argument_name,
+        choices=["cpu", "cuda"],
+        help="The device to run the Whisper model on - Default: cuda if it is available, otherwise cpu",
+    )
+    transcribe_pool_argument_name = "--transcription-pool"
+    parser.add_argument(
+        transcribe_pool_argument_name,
+        choices=["process", "thread"],
+        help="Whether the transcription workers are processes or threads. Each worker loads the model once - Default: process",
+    )
+    transcribe_threads_per_worker_argument_name = "--transcription-threads-per-worker"
+    parser.add_argument(
+        transcribe_threads_per_worker_argument_name,
+        type=int,
+        help="The amount of threads torch may use in each transcription worker. The amount of workers is the amount of CPU cores divided by this - Default: 1",
+    )
+    transcribe_segment_length_argument_name = "--transcription-segment-length"
+    parser.add_argument(
+        transcribe_segment_length_argument_name,
+        type=float,
+        help="Cut each talk at silent positions into segments of roughly this many seconds and transcribe the segments of a talk in parallel - Default: Transcribe each talk as a whole",
+    )
     overwrite_existing_transcriptions_argument_name = (
         "--overwrite-existing-transcriptions"
     )
@@ -61,6 +137,41 @@ def parse_arguments() -> argparse.Namespace:
         translation_target_language_argument_name,
         help="Language to translate the transcriptions to. Specify a ISO 639 language code - Default: de",
     )
+    translation_workers_argument_name = "--translation-workers"
+    parser.add_argument(
+        translation_workers_argument_name,
+        type=int,
+        default=1,
+        help="The amount of processes (threads while ingesting) that translate talks in parallel. Each of them loads its own translation models - Default: %(default)s",
+    )
+    ingest_argument_name = "--ingest"
+    parser.add_argument(
+        ingest_argument_name,
+        action="store_true",
+        default=False,
+        help="Stream every talk through crawling, downloading, transcribing, translating and indexing as soon as the previous stage finished it instead of running the stages one after another. Talks are resumed at the stage they stopped at. The crawl and download workers are set with --crawl-workers and --crawl-downloads - Default: %(default)s",
+    )
+    ingest_transcription_workers_argument_name = "--ingest-transcription-workers"
+    parser.add_argument(
+        ingest_transcription_workers_argument_name,
+        type=int,
+        default=1,
+        help="The amount of talks that are transcribed at once while ingesting. Each worker loads its own model - Default: %(default)s",
+    )
+    ingest_index_batch_size_argument_name = "--ingest-index-batch-size"
+    parser.add_argument(
+        ingest_index_batch_size_argument_name,
+        type=int,
+        default=8,
+        help="The maximum amount of waiting talks that are indexed at once while ingesting - Default: %(default)s",
+    )
+    ingest_queue_size_argument_name = "--ingest-queue-size"
+    parser.add_argument(
+        ingest_queue_size_argument_name,
+        type=int,
+        default=4,
+        help="The amount of talks that may wait in front of each stage while ingesting - Default: %(default)s",
+    )
     parser.add_argument(
         "--loglevel",
         choices=["debug", "info", "warning", "error", "critical"],
@@ -68,12 +179,37 @@ def parse_arguments() -> argparse.Namespace:
         help="Set the logging level - Default: %(default)s",
     )
 
-    if not args.crawl and not args.transcribe:
+    args = parser.parse_args()
+
+    if not args.crawl and not args.transcribe and not args.ingest:
+        raise IllegalArgumentError(
+            f"Error: You must at least specify {crawl_argument_name}, {transcribe_argument_name} or {ingest_argument_name}! To run the UI run python chatui.py."
+        )
+
+    if args.full_crawl and not args.crawl and not args.ingest:
         raise IllegalArgumentError(
-            f"Error: You must at least specify {crawl_argument_name} or {transcribe_argument_name}! To run the UI run python chatui.py."
+            f"Error: {full_crawl_argument_name} can only be used if {crawl_argument_name} or {ingest_argument_name} is provided!"
         )
 
-    if not args.transcribe:
+    check_ingestion_arguments(
+        args,
+        ingest_argument_name,
+        incompatible_argument_names=[
+            crawl_argument_name,
+            transcribe_argument_name,
+            transcribe_cpu_count_argument_name,
+            transcribe_pool_argument_name,
+            transcribe_segment_length_argument_name,
+            overwrite_existing_transcriptions_argument_name,
+        ],
+        positive_argument_names=[
+            ingest_transcription_workers_argument_name,
+            ingest_index_batch_size_argument_name,
+            ingest_queue_size_argument_name,
+        ],
+    )
+
+    if not args.transcribe and not args.ingest:
         if args.transcription_model:
             raise IllegalArgumentError(
                 f"Error: {transcribe_model_argument_name} can only be used if {transcribe_argument_name} is provided!"
@@ -84,8 +220,49 @@ def parse_arguments() -> argparse.Namespace:
             )
         if args.overwrite_existing_transcriptions:
             raise IllegalArgumentError(
-                f"Error: {transcribe_cpu_count_argument_name} can only be used if {transcribe_argument_name} is provided!"
+                f"Error: {overwrite_existing_transcriptions_argument_name} can only be used if {transcribe_argument_name} is provided!"
             )
+        for argument_name, value in (
+            (transcribe_device_argument_name, args.transcription_device),
+            (transcribe_pool_argument_name, args.transcription_pool),
+            (
+                transcribe_threads_per_worker_argument_name,
+                args.transcription_threads_per_worker,
+            ),
+            (
+                transcribe_segment_length_argument_name,
+                args.transcription_segment_length,
+            ),
+        ):
+            if value:
+                raise IllegalArgumentError(
+                    f"Error: {argument_name} can only be used if {transcribe_argument_name} is provided!"
+                )
+    if args.crawl_workers < 1:
+        raise IllegalArgumentError(
+            f"Error: {crawl_workers_argument_name} has to be at least 1!"
+        )
+    if args.crawl_downloads < 1:
+        raise IllegalArgumentError(
+            f"Error: {crawl_downloads_argument_name} has to be at least 1!"
+        )
+
+    if (
+        args.transcription_threads_per_worker is not None
+        and args.transcription_threads_per_worker < 1
+    ):
+        raise IllegalArgumentError(
+            f"Error: {transcribe_threads_per_worker_argument_name} has to be at least 1!"
+        )
+
+    if (
+        args.transcription_segment_length is not None
+        and args.transcription_segment_length <= 0
+    ):
+        raise IllegalArgumentError(
+            f"Error: {transcribe_segment_length_argument_name} has to be positive!"
+        )
+
     if (
         args.transcription_cpu_count
         and args.transcription_cpu_count > multiprocessing.cpu_count()
@@ -94,6 +271,11 @@ def parse_arguments() -> argparse.Namespace:
             f"Error: {transcribe_cpu_count_argument_name} has to be lower than the number of available CPU cores ({multiprocessing.cpu_count()})"
         )
 
+    if args.translation_workers < 1:
+        raise IllegalArgumentError(
+            f"Error: {translation_workers_argument_name} has to be at least 1!"
+        )
+
     if args.translation_target_language:
         try:
             Lang(args.translation_target_language)
@@ -108,19 +290,56 @@ def parse_arguments() -> argparse.Namespace:
     return args
 
 
-args = parse_arguments()
+# The transcription workers are spawned processes which import this module again
+if __name__ == "__main__":
+    args = parse_arguments()
+    Instrumentation().enable()
 
-if args.crawl:
-    crawler = Crawler()
-    crawler.run()
+    if args.ingest:
+        ingestion_pipeline = IngestionPipeline(
+            crawler=Crawler(
+                max_workers=args.crawl_workers,
+                max_downloads=args.crawl_downloads,
+                incremental=not args.full_crawl,
+            ),
+            transcriber=Transcriber(
+                transcriber_model_name=args.transcription_model or "base",
+                device=args.transcription_device,
+                threads_per_worker=args.transcription_threads_per_worker or 1,
+            ),
+            translator=Translator(
+                target_language=args.translation_target_language or "de"
+            ),
+            indexing_pipeline=IndexingPipeline(),
+            transcription_workers=args.ingest_transcription_workers,
+            translation_workers=args.translation_workers,
+            index_batch_size=args.ingest_index_batch_size,
+            queue_size=args.ingest_queue_size,
+        )
+        ingestion_pipeline.run()
+    else:
+        if args.crawl:
+            crawler = Crawler(
+                max_workers=args.crawl_workers,
+                max_downloads=args.crawl_downloads,
+                incremental=not args.full_crawl,
+            )
+            crawler.run()
 
-if args.transcribe:
-    transcriber = Transcriber(
-        transcriber_model_name=args.transcription_model,
-        max_cores=args.transcription_cpu_count,
-        overwrite=args.overwrite_existing_transcriptions,
-    )
-    transcriber.start()
+        if args.transcribe:
+            transcriber = Transcriber(
+                transcriber_model_name=args.transcription_model or "base",
+                max_cores=args.transcription_cpu_count,
+                overwrite=args.overwrite_existing_transcriptions,
+                device=args.transcription_device,
+                pool=args.transcription_pool or "process",
+                threads_per_worker=args.transcription_threads_per_worker or 1,
+                segment_length=args.transcription_segment_length,
+            )
+            transcriber.start()
 
-translator = Translator(target_language=args.translation_target_language)
-translator.start()
+        translator = Translator(
+            target_language=args.translation_target_language or "de",
+            max_workers=args.translation_workers,
+        )
+        translator.start()
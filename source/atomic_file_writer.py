@@ -0,0 +1,28 @@
+import os
+import tempfile
+
+
+class AtomicFileWriter:
+    """
+    This class provides a method to replace the content of a file atomically.
+    """
+
+    @staticmethod
+    def write(file_path: str, content: str) -> None:
+        """
+        Writes the content to a temporary file next to the target and renames it to the target afterward. Readers and
+        interrupted runs therefore either see the old or the new content, never a partially written file.
+
+        :param file_path: The path of the file to write.
+        :param content: The new content of the file.
+        :return: None
+        """
+        directory = os.path.dirname(file_path)
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            mode="w", encoding="utf-8", dir=directory, suffix=".tmp", delete=False
+        ) as file:
+            file.write(content)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(file.name, file_path)
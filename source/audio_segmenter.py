@@ -0,0 +1,90 @@
+import numpy as np
+from whisper.audio import SAMPLE_RATE
+
+from source.logger import LoggerMixin
+
+
+class AudioSegmenter(LoggerMixin):
+    """
+    Cuts a long recording into segments of roughly `segment_length` seconds, so that the segments can be transcribed
+    in parallel. The cuts are placed into the quietest part of a search window around the desired cut position, so
+    that no words are cut in half.
+
+    The loudness is measured as the root mean square of short frames, smoothed over a few hundred milliseconds so that
+    a short pause between syllables is not mistaken for silence.
+
+    :param segment_length: The desired length of a segment in seconds.
+    :param search_window: How many seconds before and after the desired cut position are searched for silence.
+    :param frame_length: The length of a frame in seconds for which the loudness is measured.
+    :param smoothing_length: The length of the moving average over the loudness of the frames in seconds.
+    """
+
+    def __init__(
+        self,
+        segment_length: float = 60.0,
+        search_window: float = 10.0,
+        frame_length: float = 0.03,
+        smoothing_length: float = 0.3,
+    ):
+        super().__init__()
+
+        self.segment_length = segment_length
+        self.search_window = search_window
+        self.frame_size = int(frame_length * SAMPLE_RATE)
+        self.smoothing_frames = max(1, int(smoothing_length / frame_length))
+
+    def _loudness_of_frames(self, audio: np.ndarray) -> np.ndarray:
+        """
+        :param audio: The audio as returned by `whisper.load_audio()`.
+        :return: The smoothed loudness of every frame of the audio.
+        """
+        number_of_frames = len(audio) // self.frame_size
+        frames = audio[: number_of_frames * self.frame_size].reshape(
+            number_of_frames, self.frame_size
+        )
+        loudness = np.sqrt(np.mean(np.square(frames, dtype=np.float64), axis=1))
+
+        kernel = np.ones(self.smoothing_frames) / self.smoothing_frames
+        return np.convolve(loudness, kernel, mode="same")
+
+    def find_cuts(self, audio: np.ndarray) -> list[int]:
+        """
+        Determines where the audio should be cut.
+
+        :param audio: The audio as returned by `whisper.load_audio()`.
+        :return: The sample positions of the cuts, starting with 0 and ending with the length of the audio.
+        """
+        frames_per_second = SAMPLE_RATE / self.frame_size
+        segment_frames = int(self.segment_length * frames_per_second)
+        window_frames = int(self.search_window * frames_per_second)
+
+        loudness = self._loudness_of_frames(audio)
+        cuts = [0]
+        cursor = 0
+        while len(loudness) - cursor > segment_frames + window_frames:
+            window_start = cursor + segment_frames - window_frames
+            window_end = cursor + segment_frames + window_frames
+            cursor = window_start + int(np.argmin(loudness[window_start:window_end]))
+            cuts.append(cursor * self.frame_size)
+        cuts.append(len(audio))
+
+        return cuts
+
+    def split(self, audio: np.ndarray) -> list[tuple[float, np.ndarray]]:
+        """
+        Cuts the audio into segments.
+
+        :param audio: The audio as returned by `whisper.load_audio()`.
+        :return: The segments in order, each as a tuple of its start in seconds and its audio.
+        """
+        cuts = self.find_cuts(audio)
+        segments = [
+            (start / SAMPLE_RATE, audio[start:end])
+            for start, end in zip(cuts[:-1], cuts[1:])
+            if end > start
+        ]
+        self.log.debug(
+            f"Split {len(audio) / SAMPLE_RATE:.0f}s of audio into {len(segments)} segments"
+        )
+
+        return segments
@@ -0,0 +1,55 @@
+from haystack import Document, component
+from haystack.components.embedders import SentenceTransformersDocumentEmbedder
+
+from source.embedding_cache import EmbeddingCache
+from source.logger import LoggerMixin
+
+
+@component
+class CachedDocumentEmbedder(LoggerMixin):
+    """
+    Embeds documents like the wrapped `SentenceTransformersDocumentEmbedder`, but takes the embeddings of texts that
+    were embedded before from an `EmbeddingCache`. The model is only loaded once a document is not in the cache, so
+    rebuilding an index from the cache does not need the model at all.
+
+    :param embedder: The embedder that embeds the documents which are not in the cache.
+    :param cache: The cache of the embeddings of the model of the embedder.
+    """
+
+    def __init__(
+        self, embedder: SentenceTransformersDocumentEmbedder, cache: EmbeddingCache
+    ):
+        # The component decorator recreates the class, which breaks the argument-less super()
+        LoggerMixin.__init__(self)
+
+        self.embedder = embedder
+        self.cache = cache
+        self._is_warmed_up = False
+
+    @component.output_types(documents=list[Document])
+    def run(self, documents: list[Document]) -> dict[str, list[Document]]:
+        texts = [document.content or "" for document in documents]
+        cached_embeddings = self.cache.get_many(texts)
+        for index, embedding in cached_embeddings.items():
+            documents[index].embedding = embedding
+
+        missing_documents = [
+            document
+            for index, document in enumerate(documents)
+            if index not in cached_embeddings
+        ]
+        self.log.info(
+            f"Embedding {len(missing_documents)} of {len(documents)} chunks, the others are cached"
+        )
+        if missing_documents:
+            if not self._is_warmed_up:
+                self.embedder.warm_up()
+                self._is_warmed_up = True
+
+            self.embedder.run(documents=missing_documents)
+            self.cache.put_many(
+                [document.content or "" for document in missing_documents],
+                [document.embedding for document in missing_documents],
+            )
+
+        return {"documents": documents}
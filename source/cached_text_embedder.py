@@ -0,0 +1,73 @@
+import threading
+from collections import OrderedDict
+from typing import Union
+
+from haystack import component
+from haystack.components.embedders import SentenceTransformersTextEmbedder
+
+from source.logger import LoggerMixin
+from source.query_embedding_batcher import QueryEmbeddingBatcher
+
+
+@component
+class CachedTextEmbedder(LoggerMixin):
+    """
+    Embeds a query like the wrapped `SentenceTransformersTextEmbedder` or `QueryEmbeddingBatcher`, but keeps the
+    embeddings of the most recently used queries in memory, so a question that is asked again is not embedded again.
+    The least recently used query is evicted once more than `max_size` queries are cached. The wrapped embedder is
+    never called while the cache is locked, so cached queries are answered while a query is embedded.
+
+    :param embedder: The embedder that embeds the queries which are not in the cache.
+    :param max_size: The maximum number of cached queries, 0 disables the cache.
+    """
+
+    def __init__(
+        self,
+        embedder: Union[SentenceTransformersTextEmbedder, QueryEmbeddingBatcher],
+        max_size: int = 1024,
+    ):
+        # The component decorator recreates the class, which breaks the argument-less super()
+        LoggerMixin.__init__(self)
+
+        self.embedder = embedder
+        self.max_size = max_size
+
+        self._embeddings = OrderedDict()
+        self._lock = threading.Lock()
+        self._is_warmed_up = False
+
+    @staticmethod
+    def _normalize(text: str) -> str:
+        # Queries that only differ in their whitespace have the same embedding
+        return " ".join(text.split())
+
+    def warm_up(self) -> None:
+        """
+        Loads the model of the wrapped embedder.
+
+        :return: None
+        """
+        self.embedder.warm_up()
+        self._is_warmed_up = True
+
+    @component.output_types(embedding=list[float])
+    def run(self, text: str) -> dict[str, list[float]]:
+        key = self._normalize(text)
+        with self._lock:
+            if key in self._embeddings:
+                self._embeddings.move_to_end(key)
+                self.log.debug("The embedding of the query is cached")
+                return {"embedding": self._embeddings[key]}
+
+        # The embedder is also used outside a pipeline, which warms up its components
+        if not self._is_warmed_up:
+            self.warm_up()
+        embedding = self.embedder.run(text=key)["embedding"]
+
+        with self._lock:
+            if self.max_size > 0:
+                self._embeddings[key] = embedding
+                while len(self._embeddings) > self.max_size:
+                    self._embeddings.popitem(last=False)
+
+        return {"embedding": embedding}
@@ -0,0 +1,291 @@
+import argparse
+import asyncio
+import functools
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from aiohttp import web
+from haystack import Document
+from haystack.dataclasses import StreamingChunk
+
+from source.gpn_chat_pipeline import GPNChatPipeline
+from source.instrumentation import Instrumentation
+from source.logger import LoggerMixin
+
+
+class ChatAPI(LoggerMixin):
+    """
+    An asyncio HTTP service around a shared `GPNChatPipeline`. It offers the following endpoints:
+
+    - `POST /chat` with `{"query": "..."}`: Returns `{"answer": "...", "sources": [...]}` once the answer is complete.
+    - `POST /chat/stream` with `{"query": "..."}`: Streams the answer as server-sent events. A `token` event is sent
+      per generated chunk, followed by a `sources` event with the context the answer is based on and a `done` event
+      with the complete answer. Errors after the stream started are sent as an `error` event.
+    - `GET /health`: Returns the number of running and waiting requests.
+
+    At most `max_concurrency` queries run through the pipeline at once, so the LLM backend is never asked for more
+    answers than it can generate in parallel. Up to `max_waiting` further requests wait for a free slot, any more are
+    rejected with 503 right away. A request that is not answered within `request_timeout` seconds gets a 504 (or an
+    `error` event). Its query keeps its slot until the pipeline finished it, because the LLM is still busy with it.
+
+    :param pipeline: The pipeline shared by all requests.
+    :param max_concurrency: The maximum number of queries that run through the pipeline at once.
+    :param max_waiting: The maximum number of requests waiting for a free slot.
+    :param request_timeout: The amount of seconds after which a request is aborted, including the waiting time.
+    """
+
+    def __init__(
+        self,
+        pipeline: GPNChatPipeline,
+        max_concurrency: int = 4,
+        max_waiting: int = 16,
+        request_timeout: float = 120,
+    ):
+        super().__init__()
+
+        self.pipeline = pipeline
+        self.max_concurrency = max_concurrency
+        self.max_waiting = max_waiting
+        self.request_timeout = request_timeout
+
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._running = 0
+        self._waiting = 0
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="ChatAPI"
+        )
+
+    def application(self) -> web.Application:
+        """
+        :return: The aiohttp application serving the endpoints.
+        """
+        application = web.Application()
+        application.add_routes(
+            [
+                web.get("/health", self.health),
+                web.post("/chat", self.chat),
+                web.post("/chat/stream", self.chat_stream),
+            ]
+        )
+        application.on_cleanup.append(self._shut_down)
+
+        return application
+
+    async def _shut_down(self, _: web.Application) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    async def _read_query(request: web.Request) -> str:
+        """
+        :param request: A chat request.
+        :return: The query of the request.
+        """
+        try:
+            body = await request.json()
+        except json.JSONDecodeError:
+            raise web.HTTPBadRequest(text="The body has to be JSON")
+
+        query = body.get("query") if isinstance(body, dict) else None
+        if not isinstance(query, str) or not query.strip():
+            raise web.HTTPBadRequest(text='The body has to contain a "query"')
+
+        return query
+
+    async def _acquire_slot(self, deadline: float) -> None:
+        """
+        Waits for a free slot until the deadline.
+
+        :param deadline: The time of the event loop at which the request times out.
+        :return: None
+        """
+        if self._running + self._waiting >= self.max_concurrency + self.max_waiting:
+            self.log.warning("Too many waiting requests, rejecting the request")
+            raise web.HTTPServiceUnavailable(
+                text="Too many requests, try again later", headers={"Retry-After": "1"}
+            )
+
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(
+                self._slots.acquire(),
+                timeout=deadline - asyncio.get_running_loop().time(),
+            )
+        except asyncio.TimeoutError:
+            raise web.HTTPGatewayTimeout(text="No free slot within the timeout")
+        finally:
+            self._waiting -= 1
+
+    def _start_query(
+        self, query: str, streaming_callback: Callable[[StreamingChunk], None] = None
+    ) -> asyncio.Future:
+        """
+        Runs the query through the pipeline in a worker thread. The slot is released once the pipeline finished, even
+        if the request timed out before.
+
+        :param query: The query of the user.
+        :param streaming_callback: The callback that receives the answer chunk by chunk. It is called in the worker
+        thread.
+        :return: The future of the answer and its sources.
+        """
+
+        def release_slot(_: asyncio.Future) -> None:
+            self._running -= 1
+            self._slots.release()
+
+        self._running += 1
+        future = asyncio.get_running_loop().run_in_executor(
+            self._executor,
+            functools.partial(
+                self.pipeline.run_with_sources, query, streaming_callback
+            ),
+        )
+        future.add_done_callback(release_slot)
+
+        return future
+
+    @staticmethod
+    def _serialize_source(document: Document) -> dict[str, Any]:
+        return {
+            "id": document.id,
+            "score": document.score,
+            "content": document.content,
+            "meta": document.meta,
+        }
+
+    async def health(self, _: web.Request) -> web.Response:
+        return web.json_response({"running": self._running, "waiting": self._waiting})
+
+    async def chat(self, request: web.Request) -> web.Response:
+        query = await self._read_query(request)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.request_timeout
+
+        await self._acquire_slot(deadline)
+        future = self._start_query(query)
+        try:
+            # The query has to keep running after a timeout to release its slot afterward
+            answer, sources = await asyncio.wait_for(
+                asyncio.shield(future), timeout=deadline - loop.time()
+            )
+        except asyncio.TimeoutError:
+            raise web.HTTPGatewayTimeout(text="The answer took too long")
+        except Exception as error:
+            self.log.error(f"Could not answer the query: {error}")
+            raise web.HTTPBadGateway(text="The answer could not be generated")
+
+        return web.json_response(
+            {
+                "answer": answer,
+                "sources": [self._serialize_source(source) for source in sources],
+            }
+        )
+
+    @staticmethod
+    async def _send_event(
+        response: web.StreamResponse, event: str, data: object
+    ) -> None:
+        message = f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        await response.write(message.encode("utf-8"))
+
+    async def chat_stream(self, request: web.Request) -> web.StreamResponse:
+        query = await self._read_query(request)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.request_timeout
+
+        # A rejected request still gets a regular status code
+        await self._acquire_slot(deadline)
+
+        chunks = asyncio.Queue()
+        future = self._start_query(
+            query,
+            lambda chunk: loop.call_soon_threadsafe(chunks.put_nowait, chunk.content),
+        )
+        # The chunks are scheduled before the future completes, so this marks the end of the answer
+        future.add_done_callback(lambda _: chunks.put_nowait(None))
+
+        response = web.StreamResponse(
+            headers={
+                "Content-Type": "text/event-stream",
+                "Cache-Control": "no-cache",
+                "X-Accel-Buffering": "no",
+            }
+        )
+        await response.prepare(request)
+
+        try:
+            while (
+                chunk := await asyncio.wait_for(
+                    chunks.get(), timeout=deadline - loop.time()
+                )
+            ) is not None:
+                await self._send_event(response, "token", {"content": chunk})
+
+            try:
+                answer, sources = future.result()
+            except Exception as error:
+                self.log.error(f"Could not answer the query: {error}")
+                await self._send_event(
+                    response, "error", {"message": "The answer could not be generated"}
+                )
+                return response
+
+            await self._send_event(
+                response,
+                "sources",
+                [self._serialize_source(source) for source in sources],
+            )
+            await self._send_event(response, "done", {"answer": answer})
+        except asyncio.TimeoutError:
+            await self._send_event(
+                response, "error", {"message": "The answer took too long"}
+            )
+        except ConnectionResetError:
+            self.log.debug("The client disconnected while the answer was streamed")
+
+        return response
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve the GPN Chat pipeline over HTTP with a JSON and a server-sent events endpoint"
+    )
+    parser.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="The host to listen on - Default: %(default)s",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8080,
+        help="The port to listen on - Default: %(default)s",
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=4,
+        help="The maximum number of queries that run through the pipeline at once - Default: %(default)s",
+    )
+    parser.add_argument(
+        "--max-waiting",
+        type=int,
+        default=16,
+        help="The maximum number of requests waiting for a free slot, further requests are rejected - Default: %(default)s",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=120,
+        help="The amount of seconds after which a request is aborted - Default: %(default)s",
+    )
+    arguments = parser.parse_args()
+
+    Instrumentation().enable()
+    chat_api = ChatAPI(
+        pipeline=GPNChatPipeline(),
+        max_concurrency=arguments.max_concurrency,
+        max_waiting=arguments.max_waiting,
+        request_timeout=arguments.timeout,
+    )
+    web.run_app(chat_api.application(), host=arguments.host, port=arguments.port)
@@ -2,18 +2,32 @@ import streamlit as st
 from haystack.dataclasses import StreamingChunk
 
 from source.gpn_chat_pipeline import GPNChatPipeline
+from source.instrumentation import Instrumentation
+
+
+@st.cache_resource
+def get_shared_pipeline() -> GPNChatPipeline:
+    """
+    Creates the pipeline once per process. All sessions share it, so the embedding model and the clients are only
+    loaded once.
+
+    :return: The pipeline shared by all sessions.
+    """
+    Instrumentation().enable()
+    return GPNChatPipeline()
 
 
 class Chatbot:
     """
     Class that represents a Chatbot capable of processing prompts by sending them to the pipeline and generating responses.
+    Every session has its own Chatbot, which streams the responses into the session, while the pipeline is shared.
     """
 
     def __init__(self):
         self.container = None
         self.response_tokens = None
 
-        self.pipeline = GPNChatPipeline(self.write_streaming_chunk)
+        self.pipeline = get_shared_pipeline()
 
     def run(self, prompt: str) -> str:
         """
@@ -25,7 +39,7 @@ class Chatbot:
         self.container = st.empty()
         self.response_tokens = []
 
-        return self.pipeline.run(prompt)
+        return self.pipeline.run(prompt, streaming_callback=self.write_streaming_chunk)
 
     def write_streaming_chunk(self, chunk: StreamingChunk) -> None:
         """
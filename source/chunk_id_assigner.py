@@ -0,0 +1,24 @@
+from haystack import Document, component
+
+
+@component
+class ChunkIdAssigner:
+    """
+    Assigns deterministic IDs to the chunks of a talk, derived from the ID of the talk and the position of the chunk.
+    Writing a chunk again therefore overwrites it instead of adding a duplicate.
+    """
+
+    @component.output_types(documents=list[Document])
+    def run(self, documents: list[Document]) -> dict[str, list[Document]]:
+        new_ids = {
+            document.id: f"{document.meta['talk_id']}/{document.meta['split_id']}"
+            for document in documents
+        }
+
+        for document in documents:
+            document.id = new_ids[document.id]
+            # The splitter references the overlapping chunks by their old IDs
+            for overlap in document.meta.get("_split_overlap", []):
+                overlap["doc_id"] = new_ids.get(overlap["doc_id"], overlap["doc_id"])
+
+        return {"documents": documents}
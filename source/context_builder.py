@@ -0,0 +1,139 @@
+import math
+import re
+
+from haystack import Document, component
+
+from source.logger import LoggerMixin
+
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+# A rough estimate for German and English text, the LLM has no tokenizer available here
+CHARACTERS_PER_TOKEN = 4
+
+
+@component
+class ContextBuilder(LoggerMixin):
+    """
+    Turns the retrieved chunks into a compact context for the prompt.
+
+    The chunks are grouped by their talk, the talk of the best chunk first. Within a talk, adjacent and overlapping
+    chunks are merged by their position in the transcription, so the sentences the splitter repeats in consecutive
+    chunks only appear once. Sentences that already appeared elsewhere in the context are dropped. Every talk becomes
+    one document that starts with a short header with the title, speakers and date of the talk.
+
+    The context is filled in the order of the talks until `token_budget` tokens are used, the remaining sentences are
+    left out. The tokens are estimated from the number of characters.
+
+    :param token_budget: The maximum number of tokens of the context.
+    """
+
+    def __init__(self, token_budget: int = 1500):
+        # The component decorator recreates the class, which breaks the argument-less super()
+        LoggerMixin.__init__(self)
+
+        self.token_budget = token_budget
+
+    @staticmethod
+    def count_tokens(text: str) -> int:
+        """
+        :param text: A text.
+        :return: The estimated number of tokens of the text.
+        """
+        return math.ceil(len(text) / CHARACTERS_PER_TOKEN)
+
+    @staticmethod
+    def _merge_chunks(chunks: list[Document]) -> list[str]:
+        """
+        :param chunks: The chunks of one talk.
+        :return: The passages of the talk in their order in the transcription. Adjacent and overlapping chunks are
+        merged into one passage.
+        """
+        if any("split_idx_start" not in chunk.meta for chunk in chunks):
+            return [chunk.content for chunk in chunks]
+
+        passages = []
+        passage_end = None
+        for chunk in sorted(chunks, key=lambda chunk: chunk.meta["split_idx_start"]):
+            start = chunk.meta["split_idx_start"]
+            end = start + len(chunk.content)
+            if passage_end is None or start > passage_end:
+                passages.append(chunk.content)
+            elif end > passage_end:
+                overlap = passage_end - start
+                passages[-1] += chunk.content[overlap:]
+            passage_end = end if passage_end is None else max(passage_end, end)
+
+        return passages
+
+    @staticmethod
+    def _create_header(meta: dict) -> str:
+        details = []
+        if meta.get("speakers"):
+            details.append(", ".join(meta["speakers"]))
+        if meta.get("date"):
+            details.append(meta["date"])
+        header = f"Talk: {meta.get('title', meta.get('talk_id', ''))}"
+
+        return f"{header} ({'; '.join(details)})" if details else header
+
+    @component.output_types(documents=list[Document])
+    def run(self, documents: list[Document]) -> dict[str, list[Document]]:
+        chunks_by_talk = {}
+        for document in documents:
+            chunks_by_talk.setdefault(
+                document.meta.get("talk_id", document.id), []
+            ).append(document)
+
+        context = []
+        seen_sentences = set()
+        remaining_tokens = self.token_budget
+        budget_exhausted = False
+        for chunks in chunks_by_talk.values():
+            header = self._create_header(chunks[0].meta)
+            remaining_tokens -= self.count_tokens(header)
+
+            passages = []
+            for passage in self._merge_chunks(chunks):
+                sentences = []
+                for sentence in SENTENCE_BOUNDARY.split(passage.strip()):
+                    normalized_sentence = " ".join(sentence.lower().split())
+                    if not normalized_sentence or normalized_sentence in seen_sentences:
+                        continue
+
+                    tokens = self.count_tokens(sentence) + 1
+                    if tokens > remaining_tokens:
+                        budget_exhausted = True
+                        break
+                    seen_sentences.add(normalized_sentence)
+                    sentences.append(sentence)
+                    remaining_tokens -= tokens
+
+                if sentences:
+                    passages.append(" ".join(sentences))
+                if budget_exhausted:
+                    break
+
+            if passages:
+                context.append(
+                    Document(
+                        content=f"{header}\n{' … '.join(passages)}",
+                        meta=chunks[0].meta,
+                        score=max((chunk.score or 0) for chunk in chunks),
+                    )
+                )
+            else:
+                remaining_tokens += self.count_tokens(header)
+            if budget_exhausted:
+                break
+
+        retrieved_tokens = sum(
+            self.count_tokens(document.content) for document in documents
+        )
+        context_tokens = sum(
+            self.count_tokens(document.content) for document in context
+        )
+        self.log.info(
+            f"Built the context from {len(documents)} chunks of {len(chunks_by_talk)} talks with {context_tokens} "
+            f"instead of {retrieved_tokens} tokens, saving {retrieved_tokens - context_tokens} tokens"
+        )
+
+        return {"documents": context}
@@ -0,0 +1,395 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing, contextmanager
+from typing import Iterator, Optional
+
+from source.git_root_finder import GitRootFinder
+from source.logger import LoggerMixin
+
+# The stages a talk passes through, in order
+STAGES = ("crawled", "downloaded", "transcribed", "translated")
+
+# The files of a talk in `data/`, keyed by their kind
+FILE_KINDS = {
+    "metadata": ("metadata", ".json"),
+    "audio": ("audio", ".mp3"),
+    "transcription": ("transcriptions", ".txt"),
+}
+
+
+class CorpusCatalog(LoggerMixin):
+    """
+    The catalog of all talks of the corpus, stored in a SQLite database. Every stage registers what it produced, so
+    the following stages query the catalog instead of scanning the data directories and parsing every metadata file.
+
+    The database consists of the following tables, all keyed by the ID of the talk (the name of its files):
+
+    - `talks`: The title, the language and the metadata of every talk.
+    - `files`: The path, size and checksum of the metadata, audio and transcription file of every talk.
+    - `stages`: When a talk finished a stage (crawled, downloaded, transcribed, translated).
+    - `transcripts`: A FTS5 full-text index over the titles and transcriptions.
+
+    If the database does not exist yet, it is filled from the files that already exist in `data/`. This can be
+    repeated with `python -m source.corpus_catalog --rebuild`.
+
+    A connection is opened per operation, so the catalog can be used from multiple threads and processes.
+
+    :param catalog_path: The path of the database. Defaults to `data/corpus_catalog.sqlite`.
+    """
+
+    def __init__(self, catalog_path: str = None):
+        super().__init__()
+
+        self.data_directory = os.path.join(GitRootFinder.get(), "data")
+        if catalog_path is None:
+            catalog_path = os.path.join(self.data_directory, "corpus_catalog.sqlite")
+        self.catalog_path = catalog_path
+
+        is_new = not os.path.exists(self.catalog_path)
+        os.makedirs(os.path.dirname(self.catalog_path), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS talks (
+                    talk_id TEXT PRIMARY KEY,
+                    title TEXT NOT NULL,
+                    language TEXT,
+                    metadata TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS files (
+                    talk_id TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    PRIMARY KEY (talk_id, kind)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS stages (
+                    talk_id TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    finished_at REAL NOT NULL,
+                    PRIMARY KEY (talk_id, stage)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS files_by_kind ON files (kind, size);
+                CREATE VIRTUAL TABLE IF NOT EXISTS transcripts USING fts5 (
+                    talk_id UNINDEXED, title, content
+                );
+                """
+            )
+
+        if is_new:
+            self.rebuild()
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """
+        Opens a connection and commits the transaction when the block is left without an error.
+        """
+        with closing(sqlite3.connect(self.catalog_path, timeout=60)) as connection:
+            connection.row_factory = sqlite3.Row
+            with connection:
+                yield connection
+
+    @staticmethod
+    def hash_file(path: str) -> str:
+        """
+        :param path: The path of a file.
+        :return: The SHA-256 checksum of the file.
+        """
+        checksum = hashlib.sha256()
+        with open(path, mode="rb") as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                checksum.update(chunk)
+
+        return checksum.hexdigest()
+
+    def path_of(self, talk_id: str, kind: str) -> str:
+        """
+        :param talk_id: The ID of a talk.
+        :param kind: The kind of the file ("metadata", "audio" or "transcription").
+        :return: The path the file of the talk is stored at.
+        """
+        directory, extension = FILE_KINDS[kind]
+        return os.path.join(self.data_directory, directory, f"{talk_id}{extension}")
+
+    def register_talk(self, talk_id: str, metadata: dict) -> None:
+        """
+        Adds a talk or replaces its metadata and marks it as crawled.
+
+        :param talk_id: The ID of the talk.
+        :param metadata: The metadata of the talk, as written to its metadata file.
+        :return: None
+        """
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO talks VALUES (?, ?, ?, ?)",
+                (
+                    talk_id,
+                    metadata.get("title", talk_id),
+                    metadata.get("language"),
+                    json.dumps(metadata, ensure_ascii=False),
+                ),
+            )
+        self.register_file(talk_id, "metadata")
+        self.mark_stage(talk_id, "crawled")
+
+    def register_file(self, talk_id: str, kind: str, sha256: str = None) -> None:
+        """
+        Records the size and checksum of a file of a talk.
+
+        :param talk_id: The ID of the talk.
+        :param kind: The kind of the file ("metadata", "audio" or "transcription").
+        :param sha256: The checksum of the file, if it is already known. Otherwise, the file is hashed.
+        :return: None
+        """
+        path = self.path_of(talk_id, kind)
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                (
+                    talk_id,
+                    kind,
+                    path,
+                    os.path.getsize(path),
+                    sha256 or self.hash_file(path),
+                ),
+            )
+
+    def register_transcription(self, talk_id: str) -> None:
+        """
+        Records the transcription file of a talk, adds it to the full-text index and marks the talk as transcribed.
+
+        :param talk_id: The ID of the talk.
+        :return: None
+        """
+        self.register_file(talk_id, "transcription")
+        with open(
+            self.path_of(talk_id, "transcription"), mode="r", encoding="utf-8"
+        ) as file:
+            content = file.read()
+
+        with self._connect() as connection:
+            connection.execute("DELETE FROM transcripts WHERE talk_id = ?", (talk_id,))
+            connection.execute(
+                """
+                INSERT INTO transcripts
+                SELECT talk_id, title, ? FROM talks WHERE talk_id = ?
+                """,
+                (content, talk_id),
+            )
+        self.mark_stage(talk_id, "transcribed")
+
+    def discard_transcription(self, talk_id: str) -> None:
+        """
+        Removes the transcription of a talk from the catalog and the full-text index and marks the talk as neither
+        transcribed nor translated, e.g. because its audio file changed.
+
+        :param talk_id: The ID of the talk.
+        :return: None
+        """
+        with self._connect() as connection:
+            connection.execute(
+                "DELETE FROM files WHERE talk_id = ? AND kind = 'transcription'",
+                (talk_id,),
+            )
+            connection.execute("DELETE FROM transcripts WHERE talk_id = ?", (talk_id,))
+            connection.execute(
+                "DELETE FROM stages WHERE talk_id = ? AND stage IN ('transcribed', 'translated')",
+                (talk_id,),
+            )
+
+    def set_language(self, talk_id: str, language: str) -> None:
+        """
+        Changes the language of a talk, e.g. after its transcription was translated.
+
+        :param talk_id: The ID of the talk.
+        :param language: The new ISO 639 code of the language of the talk.
+        :return: None
+        """
+        metadata = self.get_metadata(talk_id)
+        metadata["language"] = language
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE talks SET language = ?, metadata = ? WHERE talk_id = ?",
+                (language, json.dumps(metadata, ensure_ascii=False), talk_id),
+            )
+
+    def get_language(self, talk_id: str) -> Optional[str]:
+        """
+        :param talk_id: The ID of a talk.
+        :return: The language of the talk or None if it is unknown.
+        """
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT language FROM talks WHERE talk_id = ?", (talk_id,)
+            ).fetchone()
+
+        return row["language"] if row else None
+
+    def mark_stage(self, talk_id: str, stage: str) -> None:
+        """
+        :param talk_id: The ID of a talk.
+        :param stage: The stage the talk finished, one of `STAGES`.
+        :return: None
+        """
+        if stage not in STAGES:
+            raise ValueError(f'Unknown stage "{stage}", use one of {STAGES}')
+
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO stages VALUES (?, ?, ?)",
+                (talk_id, stage, time.time()),
+            )
+
+    def get_metadata(self, talk_id: str) -> Optional[dict]:
+        """
+        :param talk_id: The ID of a talk.
+        :return: The metadata of the talk or None if the talk is not in the catalog.
+        """
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT metadata FROM talks WHERE talk_id = ?", (talk_id,)
+            ).fetchone()
+
+        return json.loads(row["metadata"]) if row else None
+
+    def talks_with_files(
+        self, *kinds: str, without_stage: str = None, largest_first: str = None
+    ) -> list[str]:
+        """
+        Looks up the talks that have all the given files.
+
+        :param kinds: The kinds of files the talks need to have.
+        :param without_stage: Only return the talks that did not finish this stage yet.
+        :param largest_first: Sort the talks by the size of this kind of file, the largest first. Otherwise, the talks
+        are sorted by their ID.
+        :return: The IDs of the talks.
+        """
+        joins = "".join(
+            f" JOIN files AS file_{index} ON file_{index}.talk_id = talks.talk_id AND file_{index}.kind = ?"
+            for index in range(len(kinds))
+        )
+        parameters = list(kinds)
+        query = f"SELECT talks.talk_id FROM talks{joins}"
+
+        if without_stage is not None:
+            query += " WHERE NOT EXISTS (SELECT 1 FROM stages WHERE stages.talk_id = talks.talk_id AND stage = ?)"
+            parameters.append(without_stage)
+
+        if largest_first is not None:
+            query += f" ORDER BY file_{kinds.index(largest_first)}.size DESC"
+        else:
+            query += " ORDER BY talks.talk_id"
+
+        with self._connect() as connection:
+            return [row["talk_id"] for row in connection.execute(query, parameters)]
+
+    def talks_not_in_language(self, language: str) -> list[tuple[str, str]]:
+        """
+        :param language: The ISO 639 code of a language.
+        :return: The IDs and languages of the transcribed talks that are in another language, the longest
+        transcription first.
+        """
+        with self._connect() as connection:
+            rows = connection.execute(
+                """
+                SELECT talks.talk_id, talks.language FROM talks
+                JOIN files ON files.talk_id = talks.talk_id AND files.kind = 'transcription'
+                WHERE talks.language != ?
+                ORDER BY files.size DESC
+                """,
+                (language,),
+            )
+            return [(row["talk_id"], row["language"]) for row in rows]
+
+    def search(self, query: str, limit: int = 10) -> list[dict]:
+        """
+        Searches the titles and transcriptions with the FTS5 query syntax.
+
+        :param query: The full-text query, e.g. `"router firmware" OR bootloader`.
+        :param limit: The maximum number of results.
+        :return: The best matching talks with their ID, title and a snippet of the transcription.
+        """
+        with self._connect() as connection:
+            rows = connection.execute(
+                """
+                SELECT talk_id, title, snippet(transcripts, 2, '[', ']', '…', 16) AS snippet
+                FROM transcripts WHERE transcripts MATCH ? ORDER BY rank LIMIT ?
+                """,
+                (query, limit),
+            )
+            return [dict(row) for row in rows]
+
+    def rebuild(self) -> None:
+        """
+        Replaces the content of the catalog with the talks and files that exist in `data/`. This is the only place
+        that scans the data directories.
+
+        :return: None
+        """
+        self.log.info("Filling the corpus catalog from the files in the data directory")
+        with self._connect() as connection:
+            for table in ("talks", "files", "stages", "transcripts"):
+                connection.execute(f"DELETE FROM {table}")
+
+        talk_ids = {}
+        for kind, (directory, extension) in FILE_KINDS.items():
+            directory = os.path.join(self.data_directory, directory)
+            if os.path.isdir(directory):
+                talk_ids[kind] = [
+                    filename.removesuffix(extension)
+                    for filename in os.listdir(directory)
+                    if filename.endswith(extension)
+                ]
+            else:
+                talk_ids[kind] = []
+
+        for talk_id in talk_ids["metadata"]:
+            with open(
+                self.path_of(talk_id, "metadata"), mode="r", encoding="utf-8"
+            ) as file:
+                self.register_talk(talk_id, json.load(file))
+
+        known_talks = set(talk_ids["metadata"])
+        for talk_id in talk_ids["audio"]:
+            if talk_id in known_talks:
+                self.register_file(talk_id, "audio")
+                self.mark_stage(talk_id, "downloaded")
+        for talk_id in talk_ids["transcription"]:
+            if talk_id in known_talks:
+                self.register_transcription(talk_id)
+
+        self.log.info(
+            f"The corpus catalog contains {len(known_talks)} talks, {len(talk_ids['audio'])} audio files and {len(talk_ids['transcription'])} transcriptions"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Maintain and search the corpus catalog"
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        default=False,
+        help="Register all files that exist in the data directory again - Default: %(default)s",
+    )
+    parser.add_argument(
+        "--search",
+        type=str,
+        default=None,
+        help="Search the transcriptions with a full-text query - Default: %(default)s",
+    )
+    arguments = parser.parse_args()
+
+    catalog = CorpusCatalog()
+    if arguments.rebuild:
+        catalog.rebuild()
+    if arguments.search:
+        for result in catalog.search(arguments.search):
+            print(f"{result['title']}: {result['snippet']}")
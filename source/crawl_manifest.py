@@ -0,0 +1,121 @@
+import json
+import os
+import threading
+import time
+
+from source.atomic_file_writer import AtomicFileWriter
+from source.git_root_finder import GitRootFinder
+from source.logger import LoggerMixin
+
+
+class CrawlManifest(LoggerMixin):
+    """
+    Persists what the crawler has already fetched, so that a re-crawl only downloads what changed.
+
+    The manifest is stored as a JSON file with two sections:
+
+    - "pages": The validators (ETag, Last-Modified, checksum) of the conference pages together with the data that
+      was parsed from them.
+    - "talks": Per talk the validators and checksum of its page as well as the URL, validators, content length,
+      checksum and completion state of its audio file.
+
+    All methods are thread safe. Changes are written to disk at most every `save_interval` seconds and when
+    `save()` is called explicitly.
+
+    :param manifest_path: The path of the manifest file. Defaults to `data/crawl_manifest.json`.
+    :param save_interval: The minimum amount of seconds between two automatic saves.
+    """
+
+    def __init__(self, manifest_path: str = None, save_interval: float = 5.0):
+        super().__init__()
+
+        if manifest_path is None:
+            manifest_path = os.path.join(
+                GitRootFinder.get(), "data", "crawl_manifest.json"
+            )
+        self.manifest_path = manifest_path
+        self.save_interval = save_interval
+
+        self._lock = threading.Lock()
+        self._last_save = time.monotonic()
+        self._entries = self._load()
+
+    def _load(self) -> dict:
+        """
+        Loads the manifest from disk. A missing or corrupt manifest results in an empty one.
+
+        :return: The entries of the manifest.
+        """
+        entries = {"pages": {}, "talks": {}}
+        if not os.path.exists(self.manifest_path):
+            self.log.debug("No crawl manifest found, crawling everything")
+            return entries
+
+        try:
+            with open(self.manifest_path, mode="r", encoding="utf-8") as file:
+                entries |= json.load(file)
+        except json.JSONDecodeError:
+            self.log.warning(
+                f"The crawl manifest {self.manifest_path} is corrupt, crawling everything"
+            )
+
+        return entries
+
+    def get_page(self, url: str) -> dict:
+        """
+        :param url: The URL of a conference page.
+        :return: A copy of the entry of the page, empty if the page was never crawled.
+        """
+        with self._lock:
+            return dict(self._entries["pages"].get(url, {}))
+
+    def update_page(self, url: str, **values: object) -> None:
+        """
+        Updates the entry of a conference page.
+
+        :param url: The URL of a conference page.
+        :param values: The values to store.
+        :return: None
+        """
+        with self._lock:
+            self._entries["pages"].setdefault(url, {}).update(values)
+        self._save_if_due()
+
+    def get_talk(self, talk_title: str) -> dict:
+        """
+        :param talk_title: The title of a talk.
+        :return: A copy of the entry of the talk, empty if the talk was never crawled.
+        """
+        with self._lock:
+            entry = self._entries["talks"].get(talk_title, {})
+            return {key: dict(value) for key, value in entry.items()}
+
+    def update_talk(self, talk_title: str, section: str, **values: object) -> None:
+        """
+        Updates a section ("page" or "audio") of the entry of a talk.
+
+        :param talk_title: The title of a talk.
+        :param section: The section of the entry to update.
+        :param values: The values to store.
+        :return: None
+        """
+        with self._lock:
+            talk = self._entries["talks"].setdefault(talk_title, {})
+            talk.setdefault(section, {}).update(values)
+        self._save_if_due()
+
+    def _save_if_due(self) -> None:
+        if time.monotonic() - self._last_save >= self.save_interval:
+            self.save()
+
+    def save(self) -> None:
+        """
+        Writes the manifest to disk. The file is replaced atomically, so an interrupted save never leaves a corrupt
+        manifest behind.
+
+        :return: None
+        """
+        with self._lock:
+            serialized = json.dumps(self._entries, indent=4, ensure_ascii=False)
+            self._last_save = time.monotonic()
+            AtomicFileWriter.write(self.manifest_path, serialized)
@@ -1,10 +1,21 @@
+import hashlib
 import json
 import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 from html import unescape
+from typing import Iterator, Optional
+from urllib.parse import urlparse
 
 import requests
 from bs4 import BeautifulSoup
+from haystack import tracing
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+from source.corpus_catalog import CorpusCatalog
+from source.crawl_manifest import CrawlManifest
 from source.git_root_finder import GitRootFinder
 from source.logger import LoggerMixin
 
@@ -22,7 +33,33 @@ TO_REPLACE_CHARACTERS = {
 
 
 class Crawler(LoggerMixin):
-    def __init__(self):
+    """
+    Crawls the metadata and audio files of all talks from the GPN archive.
+
+    All requests share one keep-alive session. Talk pages are scraped by a pool of workers while the mp3 files are
+    downloaded by a second pool, so downloads overlap with scraping. Each talk page is only fetched once.
+
+    Unless `incremental` is disabled, the crawler keeps a `CrawlManifest`. Pages are requested conditionally, talks
+    whose page did not change are skipped and interrupted audio downloads are resumed with an HTTP range request.
+
+    The crawl is traced as the span `crawler.run`, every talk page as `crawler.crawl_talk` and every audio download as
+    `crawler.download_audio` with the number of downloaded bytes, see `Instrumentation`.
+
+    :param max_workers: The number of talk pages that are scraped concurrently. Use 1 to crawl sequentially.
+    :param max_downloads: The number of audio files that are downloaded concurrently.
+    :param max_connections_per_host: The maximum number of concurrent requests sent to a single host.
+    :param max_retries: How often a failed request is retried (with exponential backoff) before giving up.
+    :param incremental: Whether to skip unchanged talks and resume downloads using the crawl manifest.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 8,
+        max_downloads: int = 4,
+        max_connections_per_host: int = 6,
+        max_retries: int = 5,
+        incremental: bool = True,
+    ):
         super().__init__()
         self.BASE_URL = "https://media.ccc.de"
         self.CONFERENCES_URL = f"{self.BASE_URL}/b/conferences/gpn"
@@ -33,13 +70,133 @@ class Crawler(LoggerMixin):
         self.talks = {}
         self.amount_of_talks = 0
 
+        self.max_workers = max_workers
+        self.max_downloads = max_downloads
+        self.max_connections_per_host = max_connections_per_host
+        self.max_retries = max_retries
+        self.session = self._create_session()
+        self._host_semaphores = {}
+        self._host_semaphores_lock = threading.Lock()
+
+        self.incremental = incremental
+        self.manifest = CrawlManifest()
+        self.catalog = CorpusCatalog()
+
+    def _create_session(self) -> requests.Session:
+        """
+        Creates a session with a connection pool that is large enough for all workers and retries failed requests
+        with an exponential backoff.
+
+        :return: The configured session.
+        """
+        retry = Retry(
+            total=self.max_retries,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=("GET", "HEAD"),
+            respect_retry_after_header=True,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=self.max_workers + self.max_downloads,
+            max_retries=retry,
+        )
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+
+        return session
+
+    @contextmanager
+    def _limit_host(self, url: str) -> Iterator[None]:
+        """
+        Blocks until fewer than `max_connections_per_host` requests are running against the host of the URL.
+
+        :param url: The URL that is about to be requested.
+        """
+        host = urlparse(url).netloc
+        with self._host_semaphores_lock:
+            if host not in self._host_semaphores:
+                self._host_semaphores[host] = threading.BoundedSemaphore(
+                    self.max_connections_per_host
+                )
+            semaphore = self._host_semaphores[host]
+
+        with semaphore:
+            yield
+
+    @staticmethod
+    def _conditional_headers(validators: dict) -> dict:
+        """
+        :param validators: The validators of an earlier response.
+        :return: The headers that make a request conditional on the resource having changed since then.
+        """
+        headers = {}
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+
+        return headers
+
+    @staticmethod
+    def _validators_of(response: requests.Response) -> dict:
+        """
+        :param response: A response of the server.
+        :return: The validators (ETag and Last-Modified) of the response.
+        """
+        return {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+
+    def _get_page(
+        self, url: str, validators: dict = None
+    ) -> tuple[Optional[bytes], dict]:
+        """
+        Downloads a page while respecting the per-host limit. If validators of an earlier download are given, the
+        page is requested conditionally and compared to the recorded checksum.
+
+        :param url: The URL of the page.
+        :param validators: The validators (ETag, Last-Modified and checksum) of an earlier download of the page.
+        :return: A tuple of the content of the page (None if it did not change) and its new validators.
+        """
+        validators = validators if self.incremental and validators else {}
+        with self._limit_host(url):
+            response = self.session.get(
+                url, headers=self._conditional_headers(validators), timeout=30
+            )
+        if response.status_code == 304:
+            return None, validators
+        response.raise_for_status()
+
+        checksum = hashlib.sha256(response.content).hexdigest()
+        if checksum == validators.get("sha256"):
+            return None, validators
+
+        return response.content, self._validators_of(response) | {"sha256": checksum}
+
     def run(self) -> None:
         """
         This method is used to run the software. It performs the following steps:
         1. Retrieves the conference links and gpns using the method `get_conferences_and_gpns()`.
         2. Retrieves the talks using the method `get_talks()`.
-        3. Creates and writes the metadata of the talks using the method `create_and_write_metadata_of_talks()`.
-        4. Downloads the audio files of the talks using the method `download_audio_of_talks()`.
+        3. Scrapes every talk page once with `crawl_talk()`, which writes the metadata and queues the audio download.
+
+        The crawl manifest is saved at the end, even if the crawl was interrupted.
+
+        :return: None
+        """
+        try:
+            with tracing.tracer.trace("crawler.run") as span:
+                self._crawl()
+                span.set_tag("talks", self.amount_of_talks)
+        finally:
+            self.manifest.save()
+
+    def find_talks(self) -> None:
+        """
+        Retrieves the conferences and their talks and stores them in `conferences_links`, `gpns` and `talks`.
 
         :return: None
         """
@@ -47,10 +204,45 @@ class Crawler(LoggerMixin):
         self.talks = self.get_talks()
         self.amount_of_talks = len(self.talks)
         self.log.debug(f"Number of talks: {self.amount_of_talks}")
-        self.create_and_write_metadata_of_talks()
-        self.log.debug("Metadata files created")
-        self.download_audio_of_talks()
-        self.log.debug("Audio files downloaded")
+
+    def _crawl(self) -> None:
+        self.find_talks()
+
+        download_futures = []
+        with ThreadPoolExecutor(
+            max_workers=self.max_downloads
+        ) as download_executor, ThreadPoolExecutor(
+            max_workers=self.max_workers
+        ) as scrape_executor:
+            scrape_futures = {
+                scrape_executor.submit(
+                    self.crawl_talk, index, talk, download_executor
+                ): talk["title"]
+                for index, talk in enumerate(self.talks.values(), start=1)
+            }
+            for future, talk_title in scrape_futures.items():
+                download_future = self._result_or_log(future, talk_title)
+                if download_future:
+                    download_futures.append((download_future, talk_title))
+            self.log.debug("Metadata files created")
+
+            for download_future, talk_title in download_futures:
+                self._result_or_log(download_future, talk_title)
+            self.log.debug("Audio files downloaded")
+
+    def _result_or_log(self, future: Future, talk_title: str) -> Optional[object]:
+        """
+        Returns the result of a finished future. A failing talk is logged instead of aborting the whole crawl.
+
+        :param future: The future of a scrape or download job.
+        :param talk_title: The title of the talk the job belongs to.
+        :return: The result of the future or None if it failed.
+        """
+        try:
+            return future.result()
+        except requests.RequestException as error:
+            self.log.error(f"Failed to crawl talk {talk_title}: {error}")
+            return None
 
     def get_conferences_and_gpns(self) -> tuple[list, list]:
         """
@@ -59,7 +251,13 @@ class Crawler(LoggerMixin):
         :return: A tuple containing two lists.
         The first list contains the URLs of the conferences, and the second list contains the corresponding gpns.
         """
-        conferences_page = requests.get(self.CONFERENCES_URL).content
+        conferences_page, validators = self._get_page(
+            self.CONFERENCES_URL, self.manifest.get_page(self.CONFERENCES_URL)
+        )
+        if conferences_page is None:
+            self.log.debug("The list of conferences did not change")
+            cached = self.manifest.get_page(self.CONFERENCES_URL)
+            return cached["conferences_links"], cached["gpns"]
 
         conferences_soup = BeautifulSoup(conferences_page, "html.parser")
         conferences = conferences_soup.find_all("a", class_="thumbnail conference")
@@ -71,124 +269,347 @@ class Crawler(LoggerMixin):
             gpn = link.split("/")[-1]
             gpns.append(gpn)
 
+        self.manifest.update_page(
+            self.CONFERENCES_URL,
+            **validators,
+            conferences_links=conferences_links,
+            gpns=gpns,
+        )
+
         return conferences_links, gpns
 
     def get_talks(self) -> dict[str, dict]:
         """
         This method is used to fetch information about talks from conference websites. It scrapes the conference websites and retrieves the titles and links of the talks.
+        The conference pages are downloaded concurrently.
 
         :return: A dictionary containing talk information. The keys of the dictionary are the titles of the talks, and the values are dictionaries with the following keys:
             - "title": The title of the talk.
             - "link": The link to the talk.
             - "gpn": The GPN (Global Presentation Number) associated with the talk.
         """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            talks_of_conferences = list(
+                executor.map(
+                    self.get_talks_of_conference, self.conferences_links, self.gpns
+                )
+            )
+
         talks = {}
-        for index, conference_link in enumerate(self.conferences_links):
-            conference_site = requests.get(self.BASE_URL + conference_link).content
-            conference_soup = BeautifulSoup(conference_site, "html.parser")
-            talk_elements = conference_soup.find_all("h3")
-            for talk_element in talk_elements:
-                link_element = talk_element.find("a")
-                title = link_element.text.replace("\n", "")
-                for char in TO_REPLACE_CHARACTERS.keys():
-                    title = title.replace(char, TO_REPLACE_CHARACTERS[char])
-                link = link_element["href"]
-                talks[title] = {"title": title, "link": link, "gpn": self.gpns[index]}
+        for talks_of_conference in talks_of_conferences:
+            talks |= talks_of_conference
 
         return talks
 
-    def create_and_write_metadata_of_talks(self) -> None:
+    def get_talks_of_conference(
+        self, conference_link: str, gpn: str
+    ) -> dict[str, dict]:
         """
-        This method is used to create and write metadata of talks.
-        It retrieves data from a website and populates the metadata for each talk.
+        Scrapes the titles and links of the talks of a single conference. If the conference page did not change, the
+        talks are taken from the crawl manifest.
 
-        :return: None
+        :param conference_link: The link to the conference.
+        :param gpn: The GPN associated with the conference.
+        :return: The talks of the conference in the format of `get_talks()`.
         """
-        for index, talk in enumerate(self.talks.values(), start=1):
+        url = self.BASE_URL + conference_link
+        conference_site, validators = self._get_page(url, self.manifest.get_page(url))
+        if conference_site is None:
+            self.log.debug(f"The talks of {gpn} did not change")
+            return self.manifest.get_page(url)["talks"]
+
+        talks = {}
+        conference_soup = BeautifulSoup(conference_site, "html.parser")
+        talk_elements = conference_soup.find_all("h3")
+        for talk_element in talk_elements:
+            link_element = talk_element.find("a")
+            title = link_element.text.replace("\n", "")
+            for char in TO_REPLACE_CHARACTERS.keys():
+                title = title.replace(char, TO_REPLACE_CHARACTERS[char])
+            link = link_element["href"]
+            talks[title] = {"title": title, "link": link, "gpn": gpn}
+
+        self.manifest.update_page(url, **validators, talks=talks)
+
+        return talks
+
+    def crawl_talk(
+        self, index: int, talk: dict, download_executor: ThreadPoolExecutor
+    ) -> Optional[Future]:
+        """
+        Scrapes the page of a talk with `scrape_talk()` and hands the download of its audio file over to the download
+        executor.
+
+        :param index: The position of the talk, only used for logging.
+        :param talk: The talk as returned by `get_talks()`.
+        :param download_executor: The executor that downloads the audio files.
+        :return: The future of the audio download or None if there is nothing to download.
+        """
+        audio_link = self.scrape_talk(index, talk)
+        if audio_link is None:
+            return None
+
+        return download_executor.submit(
+            self.download_audio_of_talk, talk["title"], audio_link
+        )
+
+    def scrape_talk(self, index: int, talk: dict) -> Optional[str]:
+        """
+        Fetches and parses the page of a talk exactly once and writes its metadata to disk.
+        Talks whose page did not change since the last crawl and whose audio file is complete are skipped.
+
+        :param index: The position of the talk, only used for logging.
+        :param talk: The talk as returned by `get_talks()`.
+        :return: The download link of the audio file or None if the talk has no audio or its audio is up to date.
+        """
+        with tracing.tracer.trace("crawler.crawl_talk") as span:
             self.log.info(
-                f"Creating metadata file for {index} of {self.amount_of_talks}: {talk['title']}"
+                f"Crawling talk {index} of {self.amount_of_talks}: {talk['title']}"
             )
 
-            talk_site = requests.get(self.BASE_URL + talk["link"]).content
-            talk_soup = BeautifulSoup(talk_site, "html.parser")
-            speaker_paragraphs = talk_soup.find("p", class_="persons").find_all("a")
-            speakers = []
-            for speaker in speaker_paragraphs:
-                speakers.append(speaker.text.replace("\n", ""))
-
-            metadata_list = talk_soup.find("ul", class_="metadata")
-            metadata = metadata_list.find_all("li")
-            duration = metadata[0].text.replace("\n", "")
-            date = metadata[1].text.replace("\n", "")
-
-            description_paragraph = talk_soup.find("p", class_="description")
-            description = (
-                description_paragraph.text.replace("\n", "")
-                if description_paragraph
-                else ""
+            manifest_entry = self.manifest.get_talk(talk["title"])
+            page_validators = manifest_entry.get("page", {})
+            if not os.path.exists(self._metadata_path_of_talk(talk["title"])):
+                page_validators = {}
+
+            talk_site, validators = self._get_page(
+                self.BASE_URL + talk["link"], page_validators
             )
-            description = unescape(description)
-
-            # Find the language and remove the last character
-            # The website uses "deu" and "eng" as language indicators
-            # However we want to use ISO 639 language codes ("de" and "en")
-            language = talk_soup.find("span", class_="language").text[:-1]
-
-            metadata = {
-                "speakers": speakers,
-                "duration": duration,
-                "date": date,
-                "description": description,
-                "language": language,
-            }
+            span.set_tag("page_bytes", len(talk_site) if talk_site else 0)
+            if talk_site is None:
+                audio_link = page_validators.get("audio_link")
+            else:
+                talk_soup = BeautifulSoup(talk_site, "html.parser")
+                self.write_metadata_of_talk(
+                    self.parse_metadata_of_talk(talk, talk_soup)
+                )
+                audio_link = self.parse_audio_link_of_talk(talk_soup)
+                self.manifest.update_talk(
+                    talk["title"], "page", **validators, audio_link=audio_link
+                )
+
+            if not audio_link:
+                self.log.debug(
+                    f"No audio found for talk: {talk['title']}, continuing with next talk..."
+                )
+                return None
+
+            if talk_site is None and self._is_audio_complete(
+                talk["title"], manifest_entry.get("audio", {}), audio_link
+            ):
+                self.log.debug(f"Talk {talk['title']} did not change, skipping it...")
+                return None
+
+            return audio_link
+
+    @staticmethod
+    def parse_metadata_of_talk(talk: dict, talk_soup: BeautifulSoup) -> dict:
+        """
+        Extracts the metadata of a talk from its page.
+
+        :param talk: The talk as returned by `get_talks()`.
+        :param talk_soup: The parsed page of the talk.
+        :return: The metadata of the talk.
+        """
+        speaker_paragraphs = talk_soup.find("p", class_="persons").find_all("a")
+        speakers = []
+        for speaker in speaker_paragraphs:
+            speakers.append(speaker.text.replace("\n", ""))
+
+        metadata_list = talk_soup.find("ul", class_="metadata")
+        metadata = metadata_list.find_all("li")
+        duration = metadata[0].text.replace("\n", "")
+        date = metadata[1].text.replace("\n", "")
+
+        description_paragraph = talk_soup.find("p", class_="description")
+        description = (
+            description_paragraph.text.replace("\n", "")
+            if description_paragraph
+            else ""
+        )
+        description = unescape(description)
+
+        # Find the language and remove the last character
+        # The website uses "deu" and "eng" as language indicators
+        # However we want to use ISO 639 language codes ("de" and "en")
+        language = talk_soup.find("span", class_="language").text[:-1]
+
+        # The link attribute is left out as it does not have any relevant information
+        # and could confuse the model
+        return {
+            "title": talk["title"],
+            "gpn": talk["gpn"],
+            "speakers": speakers,
+            "duration": duration,
+            "date": date,
+            "description": description,
+            "language": language,
+        }
 
-            talk |= metadata
+    @staticmethod
+    def parse_audio_link_of_talk(talk_soup: BeautifulSoup) -> Optional[str]:
+        """
+        Searches the page of a talk for the download link of the mp3 file.
+
+        :param talk_soup: The parsed page of the talk.
+        :return: The download link or None if the talk has no audio.
+        """
+        audio_row = talk_soup.find("div", class_="row audio")
+        if not audio_row:
+            return None
+
+        download_tag = audio_row.find("div", string="Download mp3")
+        return download_tag.parent["href"]
 
-            # Remove the link attribute as it does not have any relevant information now
-            # and could confuse the model
-            del talk["link"]
+    def _metadata_path_of_talk(self, talk_title: str) -> str:
+        return f"{self.metadata_directory}/{talk_title}.json"
+
+    def _audio_path_of_talk(self, talk_title: str) -> str:
+        return f"{self.audio_directory}/{talk_title}.mp3"
+
+    def _is_audio_complete(
+        self, talk_title: str, audio_entry: dict, download_link: str
+    ) -> bool:
+        """
+        :param talk_title: The title of the talk.
+        :param audio_entry: The manifest entry of the audio file of the talk.
+        :param download_link: The current download link of the audio file.
+        :return: Whether the audio file was downloaded completely from the same link.
+        """
+        if not self.incremental or not audio_entry.get("complete"):
+            return False
+        if audio_entry.get("url") != download_link:
+            return False
 
-            self.write_metadata_of_talk(talk)
+        audio_path = self._audio_path_of_talk(talk_title)
+        return os.path.exists(audio_path) and os.path.getsize(
+            audio_path
+        ) == audio_entry.get("content_length")
 
     def write_metadata_of_talk(self, talk: dict) -> None:
         """
-        Writes metadata of talk to a file.
+        Writes metadata of talk to a file and registers the talk in the corpus catalog.
 
         :param talk: The metadata of the talk as a dictionary.
         :return: None
         """
         with open(
-            f"{self.metadata_directory}/{talk['title']}.json",
+            self._metadata_path_of_talk(talk["title"]),
             mode="w",
             encoding="utf-8",
         ) as file:
             file.write(json.dumps(talk, indent=4, ensure_ascii=False))
+        self.catalog.register_talk(talk["title"], talk)
 
-    def download_audio_of_talks(self) -> None:
+    def download_audio_of_talk(self, talk_title: str, download_link: str) -> bool:
         """
-        Downloads the audio for each talk in the `self.talks` dictionary.
-        It retrieves the talk's page from the provided `BASE_URL` and parses it using BeautifulSoup.
-        It then searches for the audio file download link and downloads the mp3 file.
+        Downloads the mp3 file of a talk.
 
-        :return: None
+        The file is downloaded to `name_of_the_talk.mp3.part` and only renamed once it is complete. A complete file is
+        only downloaded again if the server reports a change and a partial file is resumed with a range request.
+
+        :param talk_title: The title of the talk, used as the file name.
+        :param download_link: The download link of the mp3 file.
+        :return: Whether the audio file changed, i.e. whether its transcription is outdated.
         """
-        for index, (talk_title, talk) in enumerate(self.talks.items(), start=1):
-            self.log.debug(f"Downloading audio for #{index} talk: {talk_title}")
-            talk_site = requests.get(self.BASE_URL + talk["link"]).content
-            talk_soup = BeautifulSoup(talk_site, "html.parser")
-            audio_row = talk_soup.find("div", class_="row audio")
-            if not audio_row:
-                self.log.debug(
-                    f"No audio found for talk: {talk_title}, continuing with next talk..."
+        with tracing.tracer.trace("crawler.download_audio") as span:
+            audio_path = self._audio_path_of_talk(talk_title)
+            partial_audio_path = f"{audio_path}.part"
+
+            audio_entry = self.manifest.get_talk(talk_title).get("audio", {})
+            if not self.incremental or audio_entry.get("url") != download_link:
+                audio_entry = {}
+            previous_sha256 = audio_entry.get("sha256")
+
+            headers = {}
+            offset = 0
+            if audio_entry.get("complete") and os.path.exists(audio_path):
+                headers = self._conditional_headers(audio_entry)
+            elif os.path.exists(partial_audio_path):
+                range_validator = self._range_validator(audio_entry)
+                if range_validator:
+                    offset = os.path.getsize(partial_audio_path)
+                    headers = {"Range": f"bytes={offset}-", "If-Range": range_validator}
+
+            with self._limit_host(download_link):
+                response = self.session.get(
+                    download_link, headers=headers, stream=True, timeout=30
                 )
-                continue
-
-            download_tag = audio_row.find("div", string="Download mp3")
-            download_link = download_tag.parent["href"]
-            response = requests.get(download_link, stream=True)
-            with open(f"{self.audio_directory}/{talk_title}.mp3", mode="wb") as file:
-                for chunk in response.iter_content(chunk_size=10 * 1024):
-                    file.write(chunk)
+                if response.status_code == 304:
+                    self.log.debug(f"Audio of talk {talk_title} did not change")
+                    return False
+                if response.status_code == 416:
+                    # The partial file does not match the file on the server anymore
+                    response.close()
+                    offset = 0
+                    response = self.session.get(download_link, stream=True, timeout=30)
+                response.raise_for_status()
+
+                if response.status_code == 206:
+                    content_length = int(
+                        response.headers["Content-Range"].split("/")[-1]
+                    )
+                    self.log.debug(
+                        f"Resuming download of audio for talk {talk_title} at byte {offset}"
+                    )
+                else:
+                    offset = 0
+                    content_length = (
+                        int(response.headers.get("Content-Length", 0)) or None
+                    )
+                    self.log.debug(f"Downloading audio for talk: {talk_title}")
+
+                self.manifest.update_talk(
+                    talk_title,
+                    "audio",
+                    url=download_link,
+                    **self._validators_of(response),
+                    content_length=content_length,
+                    sha256=None,
+                    complete=False,
+                )
+
+                checksum = hashlib.sha256()
+                if offset:
+                    with open(partial_audio_path, mode="rb") as file:
+                        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                            checksum.update(chunk)
+
+                downloaded_bytes = 0
+                with open(partial_audio_path, mode="ab" if offset else "wb") as file:
+                    for chunk in response.iter_content(chunk_size=1024 * 1024):
+                        file.write(chunk)
+                        checksum.update(chunk)
+                        downloaded_bytes += len(chunk)
+                span.set_tag("downloaded_bytes", downloaded_bytes)
+
+            os.replace(partial_audio_path, audio_path)
+            self.manifest.update_talk(
+                talk_title,
+                "audio",
+                content_length=os.path.getsize(audio_path),
+                sha256=checksum.hexdigest(),
+                complete=True,
+            )
+            self.catalog.register_file(talk_title, "audio", sha256=checksum.hexdigest())
+            self.catalog.mark_stage(talk_title, "downloaded")
+
+            return checksum.hexdigest() != previous_sha256
+
+    @staticmethod
+    def _range_validator(audio_entry: dict) -> Optional[str]:
+        """
+        Determines the validator for the `If-Range` header, which makes sure that a partial download is only resumed
+        if the file on the server did not change. Weak ETags are not allowed in this header.
+
+        :param audio_entry: The manifest entry of the audio file.
+        :return: The validator or None if the partial download can not be resumed safely.
+        """
+        etag = audio_entry.get("etag")
+        if etag and not etag.startswith("W/"):
+            return etag
+
+        return audio_entry.get("last_modified")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,205 @@
+import fcntl
+import hashlib
+import os
+from contextlib import contextmanager
+from typing import Iterator
+
+import numpy as np
+
+from source.git_root_finder import GitRootFinder
+from source.logger import LoggerMixin
+
+
+class EmbeddingCache(LoggerMixin):
+    """
+    A persistent cache of embeddings, keyed by the name of the embedding model and the hash of the embedded text.
+
+    Each model gets its own directory in `data/embedding_cache/` with two files:
+
+    - `embeddings.<dtype>`: The embeddings as rows of a raw array, which is read as a memory-mapped file.
+    - `index.tsv`: One line per row with the hash of the text it belongs to.
+
+    New embeddings are appended to the array before they are added to the index, so an interrupted write only leaves
+    unused rows behind, which are cut off before the next write.
+
+    Multiple processes may use the same cache, e.g. the indexing pipeline and a benchmark. Reading the index, cutting
+    off unused rows and appending happen under an exclusive lock on the file `lock`, and a process reads the rows that
+    other processes appended before it appends its own.
+
+    :param model_name: The name of the embedding model.
+    :param embedding_dim: The dimension of the embeddings.
+    :param dtype: The data type of the stored embeddings, "float16" halves the size of the cache.
+    :param cache_directory: The directory of all caches. Defaults to `data/embedding_cache`.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        embedding_dim: int,
+        dtype: str = "float16",
+        cache_directory: str = None,
+    ):
+        super().__init__()
+
+        if cache_directory is None:
+            cache_directory = os.path.join(
+                GitRootFinder.get(), "data", "embedding_cache"
+            )
+        directory = os.path.join(cache_directory, model_name.replace("/", "__"))
+        os.makedirs(directory, exist_ok=True)
+
+        self.embedding_dim = embedding_dim
+        self.dtype = np.dtype(dtype)
+        self.row_size = self.embedding_dim * self.dtype.itemsize
+        self.embeddings_path = os.path.join(directory, f"embeddings.{dtype}")
+        self.index_path = os.path.join(directory, "index.tsv")
+        self.lock_path = os.path.join(directory, "lock")
+
+        self._rows = {}
+        self._index_length = 0
+        self._embeddings = None
+        with self._locked():
+            self._read_index()
+            self._truncate_unused_rows()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    @staticmethod
+    def hash_text(text: str) -> str:
+        """
+        :param text: An embedded text.
+        :return: The hash of the text.
+        """
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """
+        Blocks until no other process or instance reads or changes the files of the cache.
+        """
+        with open(self.lock_path, mode="a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_index(self) -> None:
+        """
+        Adds the rows that were added to the index since it was read the last time, also by other processes. A line of
+        an interrupted write is removed. Must be called with the lock held.
+
+        :return: None
+        """
+        if not os.path.exists(self.index_path):
+            return
+
+        valid_length = self._index_length
+        with open(self.index_path, mode="rb") as file:
+            file.seek(self._index_length)
+            for line in file:
+                if not line.endswith(b"\n"):
+                    break
+                text_hash, row = line.decode("utf-8").split("\t")
+                self._rows[text_hash] = int(row)
+                valid_length += len(line)
+
+        if valid_length < os.path.getsize(self.index_path):
+            with open(self.index_path, mode="r+b") as file:
+                file.truncate(valid_length)
+        self._index_length = valid_length
+
+    def _truncate_unused_rows(self) -> None:
+        """
+        Removes rows of an interrupted write that never made it into the index. Must be called with the lock held.
+
+        :return: None
+        """
+        used_size = len(self._rows) * self.row_size
+        if os.path.exists(self.embeddings_path):
+            if os.path.getsize(self.embeddings_path) > used_size:
+                self.log.warning(f"Removing unused rows from {self.embeddings_path}")
+                with open(self.embeddings_path, mode="r+b") as file:
+                    file.truncate(used_size)
+
+    def _get_embeddings(self) -> np.ndarray:
+        """
+        :return: The memory-mapped array of all cached embeddings. It is mapped again after it grew.
+        """
+        if self._embeddings is None or len(self._embeddings) != len(self._rows):
+            self._embeddings = np.memmap(
+                self.embeddings_path,
+                dtype=self.dtype,
+                mode="r",
+                shape=(len(self._rows), self.embedding_dim),
+            )
+
+        return self._embeddings
+
+    def all_embeddings(self) -> np.ndarray:
+        """
+        :return: All cached embeddings as float32, e.g. to benchmark a vector index with real data.
+        """
+        if not self._rows:
+            return np.empty((0, self.embedding_dim), dtype=np.float32)
+
+        return np.asarray(self._get_embeddings(), dtype=np.float32)
+
+    def get_many(self, texts: list[str]) -> dict[int, list[float]]:
+        """
+        Looks up the embeddings of multiple texts.
+
+        :param texts: The texts to look up.
+        :return: The cached embeddings, keyed by the index of their text.
+        """
+        found = {
+            index: self._rows[text_hash]
+            for index, text_hash in enumerate(map(self.hash_text, texts))
+            if text_hash in self._rows
+        }
+        if not found:
+            return {}
+
+        embeddings = self._get_embeddings()[list(found.values())].astype(np.float32)
+
+        return {
+            index: embedding.tolist() for index, embedding in zip(found, embeddings)
+        }
+
+    def put_many(self, texts: list[str], embeddings: list[list[float]]) -> None:
+        """
+        Stores the embeddings of multiple texts. Texts that are already cached are skipped.
+
+        :param texts: The embedded texts.
+        :param embeddings: The embeddings of the texts in the same order.
+        :return: None
+        """
+        with self._locked():
+            self._read_index()
+            new_rows = {}
+            for text, embedding in zip(texts, embeddings):
+                text_hash = self.hash_text(text)
+                if text_hash not in self._rows and text_hash not in new_rows:
+                    new_rows[text_hash] = embedding
+            if not new_rows:
+                return
+
+            self._truncate_unused_rows()
+            with open(self.embeddings_path, mode="ab") as file:
+                file.write(
+                    np.asarray(list(new_rows.values()), dtype=self.dtype).tobytes()
+                )
+                file.flush()
+                os.fsync(file.fileno())
+
+            first_row = len(self._rows)
+            lines = "".join(
+                f"{text_hash}\t{row}\n"
+                for row, text_hash in enumerate(new_rows, start=first_row)
+            )
+            with open(self.index_path, mode="a", encoding="utf-8") as file:
+                file.write(lines)
+            for row, text_hash in enumerate(new_rows, start=first_row):
+                self._rows[text_hash] = row
+            self._index_length += len(lines.encode("utf-8"))
@@ -0,0 +1,390 @@
+import json
+import os
+import sqlite3
+import threading
+from contextlib import closing, contextmanager
+from typing import Any, Iterator, Optional
+
+import numpy as np
+from haystack import Document, default_from_dict, default_to_dict
+from haystack.document_stores.errors import DuplicateDocumentError
+from haystack.document_stores.types import DuplicatePolicy
+from haystack.utils.filters import document_matches_filter
+
+from source.logger import LoggerMixin
+from source.query_analyzer import talk_ids_of_filters
+
+
+class FlatDocumentStore(LoggerMixin):
+    """
+    An embedded document store that keeps the embeddings in a memory-mapped float32 array and searches them with an
+    exact NumPy scan in the current process. For a corpus of our size this is faster than the network round trip to a
+    Qdrant server and needs no running service.
+
+    The directory of the store contains:
+
+    - `documents.sqlite`: The content and metadata of every document together with its row in the embedding array.
+    - `embeddings.<generation>.float32`: The normalized embeddings, one row per written document.
+
+    Overwritten and deleted documents leave unused rows behind, which are removed by rewriting the array under a new
+    generation once they outnumber the used rows. Every change increases the generation in the database, so a reader
+    in another process notices it and maps the array again before its next search. Searches from multiple threads
+    share the mapped array.
+
+    The rows of every talk are kept in memory as well, so a search filtered by talk IDs (see `QueryAnalyzer`) only
+    scores the rows of these talks. Searches do not support other filters.
+
+    :param directory: The directory the store is kept in.
+    :param embedding_dim: The dimension of the embeddings.
+    :param recreate_index: Whether to delete all documents of an existing store.
+    """
+
+    def __init__(
+        self, directory: str, embedding_dim: int = 384, recreate_index: bool = False
+    ):
+        super().__init__()
+
+        self.directory = directory
+        self.embedding_dim = embedding_dim
+        self.database_path = os.path.join(self.directory, "documents.sqlite")
+
+        os.makedirs(self.directory, exist_ok=True)
+        with self._connect() as connection:
+            connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS documents (
+                    id TEXT PRIMARY KEY,
+                    row INTEGER NOT NULL,
+                    content TEXT,
+                    meta TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS state (
+                    key TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                );
+                INSERT OR IGNORE INTO state
+                VALUES ('generation', 0), ('rows', 0), ('embeddings_generation', 0);
+                """
+            )
+
+        self._lock = threading.Lock()
+        self._generation = None
+        self._embeddings = None
+        self._row_ids = None
+        self._rows_by_talk = None
+
+        if recreate_index:
+            self.delete_documents([document.id for document in self.filter_documents()])
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """
+        Opens a connection and commits the transaction when the block is left without an error.
+        """
+        with closing(sqlite3.connect(self.database_path, timeout=60)) as connection:
+            with connection:
+                yield connection
+
+    def _embeddings_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"embeddings.{generation}.float32")
+
+    @staticmethod
+    def _get_state(connection: sqlite3.Connection) -> dict[str, int]:
+        return dict(connection.execute("SELECT key, value FROM state"))
+
+    def _refresh(self) -> tuple[np.ndarray, np.ndarray, dict[str, np.ndarray]]:
+        """
+        Maps the embeddings again and reloads which row belongs to which document and talk if the store changed since
+        the last search.
+
+        :return: The embeddings, the ID of the document of every row and the rows of every talk, which always belong to
+        the same version.
+        """
+        with self._lock:
+            self._refresh_unlocked()
+            return self._embeddings, self._row_ids, self._rows_by_talk
+
+    def _refresh_unlocked(self) -> None:
+        with self._connect() as connection:
+            # Both reads have to see the same version of the store
+            connection.execute("BEGIN")
+            state = self._get_state(connection)
+            if state["generation"] == self._generation:
+                return
+
+            rows = connection.execute(
+                "SELECT row, id, json_extract(meta, '$.talk_id') FROM documents"
+            ).fetchall()
+
+        self._row_ids = np.full(state["rows"], None, dtype=object)
+        rows_by_talk = {}
+        for row, document_id, talk_id in rows:
+            self._row_ids[row] = document_id
+            rows_by_talk.setdefault(talk_id, []).append(row)
+        self._rows_by_talk = {
+            talk_id: np.array(talk_rows, dtype=np.int64)
+            for talk_id, talk_rows in rows_by_talk.items()
+        }
+
+        embeddings_path = self._embeddings_path(state["embeddings_generation"])
+        if state["rows"] and os.path.exists(embeddings_path):
+            self._embeddings = np.memmap(
+                embeddings_path,
+                dtype=np.float32,
+                mode="r",
+                shape=(state["rows"], self.embedding_dim),
+            )
+        else:
+            self._embeddings = np.empty((0, self.embedding_dim), dtype=np.float32)
+        self._generation = state["generation"]
+
+    def count_documents(self) -> int:
+        with self._connect() as connection:
+            return connection.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    @staticmethod
+    def _to_document(document_id: str, content: str, meta: str) -> Document:
+        return Document(id=document_id, content=content, meta=json.loads(meta))
+
+    def filter_documents(
+        self, filters: Optional[dict[str, Any]] = None
+    ) -> list[Document]:
+        """
+        :param filters: Haystack filters on the documents, e.g. `{"field": "meta.talk_id", "operator": "==", "value":
+        "..."}`.
+        :return: All documents matching the filters, without their embeddings.
+        """
+        with self._connect() as connection:
+            documents = [
+                self._to_document(*row)
+                for row in connection.execute(
+                    "SELECT id, content, meta FROM documents ORDER BY row"
+                )
+            ]
+
+        if not filters:
+            return documents
+
+        return [
+            document
+            for document in documents
+            if document_matches_filter(filters, document)
+        ]
+
+    def write_documents(
+        self, documents: list[Document], policy: DuplicatePolicy = DuplicatePolicy.NONE
+    ) -> int:
+        """
+        Writes documents and their embeddings to the store.
+
+        :param documents: The documents to write, each with an embedding.
+        :param policy: How to handle documents whose ID already exists. `NONE` behaves like `FAIL`.
+        :return: The number of written documents.
+        """
+        with self._connect() as connection:
+            # Only one process may append to the embeddings at a time
+            connection.execute("BEGIN IMMEDIATE")
+            existing_ids = {
+                document_id
+                for (document_id,) in connection.execute("SELECT id FROM documents")
+            }
+            if policy == DuplicatePolicy.SKIP:
+                documents = [
+                    document
+                    for document in documents
+                    if document.id not in existing_ids
+                ]
+            elif policy != DuplicatePolicy.OVERWRITE:
+                duplicate_ids = [
+                    document.id for document in documents if document.id in existing_ids
+                ]
+                if duplicate_ids:
+                    raise DuplicateDocumentError(
+                        f"Documents with the IDs {duplicate_ids} already exist"
+                    )
+            if not documents:
+                return 0
+
+            embeddings = np.asarray(
+                [document.embedding for document in documents], dtype=np.float32
+            )
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings /= np.where(norms == 0, 1, norms)
+
+            state = self._get_state(connection)
+            embeddings_path = self._embeddings_path(state["embeddings_generation"])
+            mode = "r+b" if os.path.exists(embeddings_path) else "wb"
+            with open(embeddings_path, mode=mode) as file:
+                # Rows of an interrupted write are not referenced and are overwritten
+                file.seek(state["rows"] * self.embedding_dim * 4)
+                file.write(embeddings.tobytes())
+                file.truncate()
+
+            connection.executemany(
+                "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?)",
+                [
+                    (
+                        document.id,
+                        row,
+                        document.content,
+                        json.dumps(document.meta, ensure_ascii=False),
+                    )
+                    for row, document in enumerate(documents, start=state["rows"])
+                ],
+            )
+            connection.execute(
+                "UPDATE state SET value = value + ? WHERE key = 'rows'",
+                (len(documents),),
+            )
+            connection.execute(
+                "UPDATE state SET value = value + 1 WHERE key = 'generation'"
+            )
+
+        self._compact_if_needed()
+        return len(documents)
+
+    def delete_documents(self, document_ids: list[str]) -> None:
+        """
+        :param document_ids: The IDs of the documents to delete.
+        :return: None
+        """
+        with self._connect() as connection:
+            connection.executemany(
+                "DELETE FROM documents WHERE id = ?",
+                [(document_id,) for document_id in document_ids],
+            )
+            connection.execute(
+                "UPDATE state SET value = value + 1 WHERE key = 'generation'"
+            )
+
+        self._compact_if_needed()
+
+    def _compact_if_needed(self) -> None:
+        """
+        Rewrites the embedding array without the unused rows once they outnumber the used rows. The new array gets a
+        new file name, so readers that still map the old one are not disturbed.
+
+        :return: None
+        """
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            state = self._get_state(connection)
+            rows = [
+                row
+                for (row,) in connection.execute(
+                    "SELECT row FROM documents ORDER BY row"
+                )
+            ]
+            if state["rows"] - len(rows) <= len(rows):
+                return
+
+            old_generation = state["embeddings_generation"]
+            new_generation = old_generation + 1
+            old_path = self._embeddings_path(old_generation)
+            if rows:
+                embeddings = np.memmap(
+                    old_path,
+                    dtype=np.float32,
+                    mode="r",
+                    shape=(state["rows"], self.embedding_dim),
+                )
+                np.ascontiguousarray(embeddings[rows]).tofile(
+                    self._embeddings_path(new_generation)
+                )
+                del embeddings
+            else:
+                open(self._embeddings_path(new_generation), mode="wb").close()
+
+            connection.executemany(
+                "UPDATE documents SET row = ? WHERE row = ?",
+                [(new_row, old_row) for new_row, old_row in enumerate(rows)],
+            )
+            connection.executemany(
+                "INSERT OR REPLACE INTO state VALUES (?, ?)",
+                [
+                    ("rows", len(rows)),
+                    ("embeddings_generation", new_generation),
+                    ("generation", state["generation"] + 1),
+                ],
+            )
+
+        if os.path.exists(old_path):
+            os.remove(old_path)
+        self.log.debug(f"Compacted the embeddings to {len(rows)} rows")
+
+    def query_by_embedding(
+        self,
+        query_embedding: list[float],
+        top_k: int = 10,
+        filters: Optional[dict[str, Any]] = None,
+    ) -> list[Document]:
+        """
+        Finds the documents whose embeddings are the most similar to the query embedding by their cosine similarity.
+
+        :param query_embedding: The embedding of the query.
+        :param top_k: The maximum number of documents to return.
+        :param filters: A Haystack filter that compares `meta.talk_id` with "==" or "in", only the rows of these talks
+        are scored.
+        :return: The most similar documents with their score, the most similar first. Documents that were deleted
+        during the search are left out.
+        """
+        talk_ids = talk_ids_of_filters(filters)
+        if filters and talk_ids is None:
+            raise ValueError(
+                f'Unsupported filter {filters}, only "meta.talk_id" can be compared with "==" or "in"'
+            )
+
+        embeddings, row_ids, rows_by_talk = self._refresh()
+        if not len(embeddings):
+            return []
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1
+
+        if talk_ids is not None:
+            rows = [
+                rows_by_talk[talk_id] for talk_id in talk_ids if talk_id in rows_by_talk
+            ]
+            rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+            scores = np.full(len(embeddings), -np.inf, dtype=np.float32)
+            scores[rows] = embeddings[rows] @ query
+        else:
+            scores = embeddings @ query
+            # Unused rows of overwritten or deleted documents must never be found
+            scores[row_ids == None] = -np.inf  # noqa: E711
+
+        top_k = min(top_k, int(np.isfinite(scores).sum()))
+        if top_k == 0:
+            return []
+        best_rows = np.argpartition(-scores, top_k - 1)[:top_k]
+        best_rows = best_rows[np.argsort(-scores[best_rows])]
+
+        documents_by_id = self._get_documents([row_ids[row] for row in best_rows])
+        results = []
+        for row in best_rows:
+            # The document was deleted after the rows were read
+            document = documents_by_id.get(row_ids[row])
+            if document is None:
+                continue
+            document.score = float(scores[row])
+            results.append(document)
+
+        return results
+
+    def _get_documents(self, document_ids: list[str]) -> dict[str, Document]:
+        placeholders = ", ".join("?" * len(document_ids))
+        with self._connect() as connection:
+            rows = connection.execute(
+                f"SELECT id, content, meta FROM documents WHERE id IN ({placeholders})",
+                document_ids,
+            )
+            return {row[0]: self._to_document(*row) for row in rows}
+
+    def to_dict(self) -> dict[str, Any]:
+        return default_to_dict(
+            self, directory=self.directory, embedding_dim=self.embedding_dim
+        )
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "FlatDocumentStore":
+        return default_from_dict(cls, data)
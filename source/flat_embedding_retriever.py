@@ -0,0 +1,57 @@
+from typing import Any, Optional
+
+from haystack import Document, component, default_from_dict, default_to_dict
+
+from source.flat_document_store import FlatDocumentStore
+
+
+@component
+class FlatEmbeddingRetriever:
+    """
+    Retrieves the documents that are the most similar to a query embedding from a `FlatDocumentStore`. It has the same
+    inputs and outputs as the `QdrantSearchRetriever`, so both can be used interchangeably.
+
+    :param document_store: The store to search.
+    :param top_k: The maximum number of documents to return.
+    :param filters: A filter on the talks the documents have to belong to, see `FlatDocumentStore.query_by_embedding()`.
+    """
+
+    def __init__(
+        self,
+        document_store: FlatDocumentStore,
+        top_k: int = 10,
+        filters: Optional[dict[str, Any]] = None,
+    ):
+        self.document_store = document_store
+        self.top_k = top_k
+        self.filters = filters
+
+    def to_dict(self) -> dict[str, Any]:
+        return default_to_dict(
+            self,
+            document_store=self.document_store.to_dict(),
+            top_k=self.top_k,
+            filters=self.filters,
+        )
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "FlatEmbeddingRetriever":
+        data["init_parameters"]["document_store"] = FlatDocumentStore.from_dict(
+            data["init_parameters"]["document_store"]
+        )
+        return default_from_dict(cls, data)
+
+    @component.output_types(documents=list[Document])
+    def run(
+        self,
+        query_embedding: list[float],
+        top_k: Optional[int] = None,
+        filters: Optional[dict[str, Any]] = None,
+    ) -> dict[str, list[Document]]:
+        documents = self.document_store.query_by_embedding(
+            query_embedding=query_embedding,
+            top_k=top_k or self.top_k,
+            filters=filters or self.filters,
+        )
+
+        return {"documents": documents}
@@ -1,104 +1,434 @@
-import os
-from pathlib import Path
-from typing import Callable
-
-from haystack.components.builders import ChatPromptBuilder
-from haystack.components.embedders import SentenceTransformersTextEmbedder
-from haystack.core.pipeline import Pipeline
-from haystack.dataclasses import ChatMessage
-from haystack_integrations.components.generators.ollama import OllamaChatGenerator
-from haystack_integrations.components.retrievers.qdrant import QdrantEmbeddingRetriever
-from haystack_integrations.document_stores.qdrant import QdrantDocumentStore
-
-from source.git_root_finder import GitRootFinder
-from source.logger import LoggerMixin
-
-DOCUMENT_PROMPT_TEMPLATE = """
-    Beantworte anhand der folgenden Dokumente die Frage. \nDokumente:
-    {% for doc in documents %}
-        {{ doc.content }}
-    {% endfor %}
-
-    Sei freundlich, höflich und hilfsbereit und benutze Emojis in deiner Antwort, wenn es passt.
-
-    \nFrage: {{query}}
-    \nAntwort:
-    """
-
-
-class GPNChatPipeline(LoggerMixin):
-    """
-    GPNChatPipeline is a class that defines a chat pipeline leveraging various components
-    like a dense text embedder, a retriever, a prompt builder, and a language model.
-    It interacts with a Qdrant document store for data storage and indexing.
-    """
-
-    def __init__(self, streaming_callback: Callable):
-        super().__init__()
-
-        ollama_chat_generator = OllamaChatGenerator(
-            model="llama3.2",
-            url="http://localhost:11434/api/chat",
-            generation_kwargs={
-                "num_predict": 512,
-                "temperature": 0.95,
-            },
-            streaming_callback=streaming_callback,
-        )
-
-        qdrant_document_store = QdrantDocumentStore(
-            location="http://localhost:6333",
-            embedding_dim=384,
-            index="gpn-chat",
-            use_sparse_embeddings=False,
-            sparse_idf=True,
-        )
-
-        self.pipeline = Pipeline()
-
-        self.pipeline.add_component(
-            name="dense_text_embedder",
-            instance=SentenceTransformersTextEmbedder(
-                model="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
-            ),
-        )
-        self.pipeline.add_component(
-            "retriever",
-            QdrantEmbeddingRetriever(document_store=qdrant_document_store, top_k=10),
-        )
-        self.pipeline.add_component(
-            "prompt_builder",
-            ChatPromptBuilder(
-                template=[ChatMessage.from_user(DOCUMENT_PROMPT_TEMPLATE)]
-            ),
-        )
-        self.pipeline.add_component("llm", ollama_chat_generator)
-
-        self.pipeline.connect(
-            sender="dense_text_embedder.embedding", receiver="retriever.query_embedding"
-        )
-        self.pipeline.connect(sender="retriever", receiver="prompt_builder.documents")
-        self.pipeline.connect(
-            sender="retriever.documents", receiver="prompt_builder.documents"
-        )
-        self.pipeline.connect(sender="prompt_builder", receiver="llm")
-
-        self.pipeline.draw(
-            Path(os.path.join(GitRootFinder.get(), "gpn_chat_pipeline.png"))
-        )
-
-    def run(self, query: str) -> str:
-        """
-        Sends the query input from the user to the pipeline
-
-        :param query: A string representing the input query for which a response is to be generated.
-        :return: The content of the reply generated by the language model based on the provided query.
-        """
-        self.log.info(f"Received query: {query}")
-        response = self.pipeline.run(
-            {"dense_text_embedder": {"text": query}, "prompt_builder": {"query": query}}
-        )
-        response_content = response["llm"]["replies"][0].content
-        self.log.info(f"Generated answer: {response_content}")
-
-        return response_content
+import os
+import time
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Callable, Optional, Union
+
+from haystack import Document, tracing
+from haystack.components.builders import ChatPromptBuilder
+from haystack.components.embedders import SentenceTransformersDocumentEmbedder
+from haystack.components.rankers import TransformersSimilarityRanker
+from haystack.core.pipeline import Pipeline
+from haystack.dataclasses import ChatMessage, StreamingChunk
+from haystack_integrations.components.generators.ollama import OllamaChatGenerator
+from haystack_integrations.document_stores.qdrant import QdrantDocumentStore
+
+from source.cached_text_embedder import CachedTextEmbedder
+from source.context_builder import ContextBuilder
+from source.git_root_finder import GitRootFinder
+from source.logger import LoggerMixin
+from source.query_analyzer import QueryAnalyzer
+from source.query_embedding_batcher import QueryEmbeddingBatcher
+from source.reciprocal_rank_fusion import ReciprocalRankFusion
+from source.semantic_answer_cache import SemanticAnswerCache
+from source.sparse_document_store import SparseDocumentStore
+from source.sparse_retriever import SparseRetriever
+from source.vector_backend import VectorBackend
+
+RERANKER_MODEL = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+
+DOCUMENT_PROMPT_TEMPLATE = """
+    Beantworte anhand der folgenden Dokumente die Frage. \nDokumente:
+    {% for doc in documents %}
+        {{ doc.content }}
+    {% endfor %}
+
+    Sei freundlich, höflich und hilfsbereit und benutze Emojis in deiner Antwort, wenn es passt.
+
+    \nFrage: {{query}}
+    \nAntwort:
+    """
+
+
+def _get_setting(
+    value: Union[str, int, float, bool, None],
+    variable: str,
+    default: Union[str, int, float, bool],
+) -> Union[str, int, float, bool]:
+    """
+    :param value: The value that was passed explicitly.
+    :param variable: The name of the environment variable that is used if no value was passed.
+    :param default: The default if neither a value was passed nor the environment variable is set.
+    :return: The value of the setting, converted to the type of the default.
+    """
+    if value is not None:
+        return value
+
+    setting = os.environ.get(variable)
+    if setting is None:
+        return default
+    if isinstance(default, bool):
+        return setting.lower() == "true"
+
+    return type(default)(setting)
+
+
+class GPNChatPipeline(LoggerMixin):
+    """
+    GPNChatPipeline is a class that defines a chat pipeline leveraging various components
+    like a dense text embedder, a retriever, a prompt builder, and a language model.
+    It retrieves the documents from the vector backend selected by `VECTOR_BACKEND`, see `VectorBackend`.
+
+    In the "hybrid" retrieval mode a BM25 retriever searches the `SparseDocumentStore` for the words of the query in
+    parallel to the dense retriever, which finds names and acronyms the embeddings miss. Both result lists are fused
+    with `ReciprocalRankFusion`, so fewer but better chunks end up in the prompt. The settings are read from the
+    environment variables in parentheses unless they are passed explicitly.
+
+    With the reranker enabled, a wider set of candidates is retrieved and scored by a cross-encoder on the CPU, of which
+    only the best ones are kept. Its ranking is more precise than the one of the embeddings, so fewer chunks are enough
+    for the prompt.
+
+    The `ContextBuilder` merges the retrieved chunks per talk, removes repeated sentences and limits the context to a
+    token budget before it is passed to the LLM.
+
+    Queries that arrive at the same time are embedded together by a `QueryEmbeddingBatcher` and the embeddings of recent
+    queries are kept in a `CachedTextEmbedder`. With the answer cache enabled, a question that
+    is similar enough to a recently answered one with the same filters gets the cached answer from the
+    `SemanticAnswerCache` immediately.
+
+    One instance is meant to be shared by all users of the chat, `run()` can be called from multiple threads at the same
+    time. The generated answer is streamed to the callback that is passed to the call. The LLM is served by Ollama at
+    `OLLAMA_URL` (default: http://localhost:11434), a request to it fails after `OLLAMA_TIMEOUT` seconds (default: 120).
+    Every call is traced as the span `chat.query` with the number of sources, the tokens of the prompt and the answer
+    and the time to the first token, see `Instrumentation`.
+
+    :param streaming_callback: The callback that receives the generated answer chunk by chunk if no callback is passed
+    to `run()`.
+    :param retrieval_mode: "hybrid" or "dense" (`RETRIEVAL_MODE`, default: hybrid).
+    :param top_k: The number of chunks passed to the LLM without the reranker (`RETRIEVAL_TOP_K`, default: 10).
+    :param dense_top_k: The number of chunks retrieved by the dense retriever in the hybrid mode (`DENSE_TOP_K`,
+    default: 20 or the number of rerank candidates if it is larger).
+    :param sparse_top_k: The number of chunks retrieved by the BM25 retriever in the hybrid mode (`SPARSE_TOP_K`,
+    default: 20 or the number of rerank candidates if it is larger).
+    :param dense_weight: The weight of the dense ranks in the fusion (`DENSE_WEIGHT`, default: 1.0).
+    :param sparse_weight: The weight of the BM25 ranks in the fusion (`SPARSE_WEIGHT`, default: 1.0).
+    :param reranker: Whether the candidates are reranked by a cross-encoder (`RERANKER`, default: false).
+    :param rerank_candidates: The number of candidates retrieved for the reranker (`RERANK_CANDIDATES`, default: 50).
+    :param rerank_top_k: The number of reranked chunks passed to the LLM (`RERANK_TOP_K`, default: 5).
+    :param rerank_score_threshold: The minimum score between 0 and 1 a reranked chunk needs to be passed to the LLM
+    (`RERANK_SCORE_THRESHOLD`, default: none).
+    :param query_filters: Whether the retrievers only search the talks of the GPN editions, speakers and titles the
+    question mentions, see `QueryAnalyzer` (`QUERY_FILTERS`, default: true).
+    :param context_token_budget: The maximum number of tokens of the context passed to the LLM
+    (`CONTEXT_TOKEN_BUDGET`, default: 1500).
+    :param query_batch_window_ms: The amount of milliseconds a query waits for further queries to be embedded with
+    (`QUERY_BATCH_WINDOW_MS`, default: 5).
+    :param query_batch_size: The maximum number of queries embedded at once (`QUERY_BATCH_SIZE`, default: 32).
+    :param query_embedding_cache_size: The number of cached query embeddings, 0 disables the cache
+    (`QUERY_EMBEDDING_CACHE_SIZE`, default: 1024).
+    :param answer_cache: Whether answers are cached (`ANSWER_CACHE`, default: false).
+    :param answer_cache_threshold: The minimum cosine similarity of two questions to share an answer
+    (`ANSWER_CACHE_THRESHOLD`, default: 0.95).
+    :param answer_cache_ttl: The amount of seconds an answer is cached (`ANSWER_CACHE_TTL`, default: 3600).
+    :param answer_cache_size: The maximum number of cached answers (`ANSWER_CACHE_SIZE`, default: 256).
+    :param hnsw_ef: The size of the HNSW candidate list while searching. Defaults to `QDRANT_HNSW_EF`.
+    :param oversampling: How many times `top_k` candidates are fetched with the quantized vectors before they are
+    rescored. Defaults to `QDRANT_OVERSAMPLING`.
+    :param draw: Whether the pipeline is drawn to "gpn_chat_pipeline.png", which needs access to mermaid.ink.
+    """
+
+    def __init__(
+        self,
+        streaming_callback: Callable[[StreamingChunk], None] = None,
+        retrieval_mode: str = None,
+        top_k: int = None,
+        dense_top_k: int = None,
+        sparse_top_k: int = None,
+        dense_weight: float = None,
+        sparse_weight: float = None,
+        reranker: bool = None,
+        rerank_candidates: int = None,
+        rerank_top_k: int = None,
+        rerank_score_threshold: float = None,
+        query_filters: bool = None,
+        context_token_budget: int = None,
+        query_batch_window_ms: float = None,
+        query_batch_size: int = None,
+        query_embedding_cache_size: int = None,
+        answer_cache: bool = None,
+        answer_cache_threshold: float = None,
+        answer_cache_ttl: float = None,
+        answer_cache_size: int = None,
+        hnsw_ef: int = None,
+        oversampling: float = None,
+        draw: bool = True,
+    ):
+        super().__init__()
+
+        self.retrieval_mode = _get_setting(retrieval_mode, "RETRIEVAL_MODE", "hybrid")
+        if self.retrieval_mode not in ("hybrid", "dense"):
+            raise ValueError(
+                f'Unknown retrieval mode "{self.retrieval_mode}", use "hybrid" or "dense"'
+            )
+        top_k = _get_setting(top_k, "RETRIEVAL_TOP_K", 10)
+        reranker = _get_setting(reranker, "RERANKER", False)
+        if reranker:
+            # The retrievers only preselect the candidates for the reranker
+            top_k = _get_setting(rerank_candidates, "RERANK_CANDIDATES", 50)
+        self.streaming_callback = streaming_callback
+        # Each call of run() streams to its own callback, even when calls from multiple threads overlap
+        self._call_streaming_callback = ContextVar("streaming_callback", default=None)
+        self._call_trace = ContextVar("trace", default=None)
+
+        self.query_analyzer = None
+        if _get_setting(query_filters, "QUERY_FILTERS", True):
+            self.query_analyzer = QueryAnalyzer()
+
+        self.answer_cache = None
+        if _get_setting(answer_cache, "ANSWER_CACHE", False):
+            self.answer_cache = SemanticAnswerCache(
+                similarity_threshold=_get_setting(
+                    answer_cache_threshold, "ANSWER_CACHE_THRESHOLD", 0.95
+                ),
+                ttl=_get_setting(answer_cache_ttl, "ANSWER_CACHE_TTL", 3600.0),
+                max_size=_get_setting(answer_cache_size, "ANSWER_CACHE_SIZE", 256),
+            )
+
+        ollama_chat_generator = OllamaChatGenerator(
+            model="llama3.2",
+            url=f"{os.environ.get('OLLAMA_URL', 'http://localhost:11434')}/api/chat",
+            timeout=_get_setting(None, "OLLAMA_TIMEOUT", 120),
+            generation_kwargs={
+                "num_predict": 512,
+                "temperature": 0.95,
+            },
+            streaming_callback=self._stream_chunk,
+        )
+
+        vector_backend = VectorBackend(hnsw_ef=hnsw_ef, oversampling=oversampling)
+        document_store = vector_backend.create_document_store()
+        if isinstance(document_store, QdrantDocumentStore):
+            # The client is created on its first use, which must not happen in multiple threads at once
+            document_store.client
+
+        self.pipeline = Pipeline()
+
+        query_batch_window_ms = _get_setting(
+            query_batch_window_ms, "QUERY_BATCH_WINDOW_MS", 5.0
+        )
+        query_batch_size = _get_setting(query_batch_size, "QUERY_BATCH_SIZE", 32)
+        self.text_embedder = CachedTextEmbedder(
+            embedder=QueryEmbeddingBatcher(
+                embedder=SentenceTransformersDocumentEmbedder(
+                    model="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
+                    batch_size=query_batch_size,
+                    progress_bar=False,
+                ),
+                window=query_batch_window_ms / 1000,
+                max_batch_size=query_batch_size,
+            ),
+            max_size=_get_setting(
+                query_embedding_cache_size, "QUERY_EMBEDDING_CACHE_SIZE", 1024
+            ),
+        )
+        self.pipeline.add_component(
+            name="dense_text_embedder", instance=self.text_embedder
+        )
+        if self.retrieval_mode == "hybrid":
+            self.pipeline.add_component(
+                "retriever",
+                vector_backend.create_retriever(
+                    document_store,
+                    top_k=_get_setting(dense_top_k, "DENSE_TOP_K", max(20, top_k)),
+                ),
+            )
+            self.pipeline.add_component(
+                "sparse_retriever",
+                SparseRetriever(
+                    document_store=SparseDocumentStore(),
+                    top_k=_get_setting(sparse_top_k, "SPARSE_TOP_K", max(20, top_k)),
+                ),
+            )
+            self.pipeline.add_component(
+                "fusion",
+                ReciprocalRankFusion(
+                    dense_weight=_get_setting(dense_weight, "DENSE_WEIGHT", 1.0),
+                    sparse_weight=_get_setting(sparse_weight, "SPARSE_WEIGHT", 1.0),
+                    top_k=top_k,
+                ),
+            )
+        else:
+            self.pipeline.add_component(
+                "retriever",
+                vector_backend.create_retriever(document_store, top_k=top_k),
+            )
+        if reranker:
+            if (
+                rerank_score_threshold is None
+                and "RERANK_SCORE_THRESHOLD" in os.environ
+            ):
+                rerank_score_threshold = float(os.environ["RERANK_SCORE_THRESHOLD"])
+            self.pipeline.add_component(
+                "ranker",
+                TransformersSimilarityRanker(
+                    model=RERANKER_MODEL,
+                    top_k=_get_setting(rerank_top_k, "RERANK_TOP_K", 5),
+                    score_threshold=rerank_score_threshold,
+                    batch_size=16,
+                ),
+            )
+        self.pipeline.add_component(
+            "context_builder",
+            ContextBuilder(
+                token_budget=_get_setting(
+                    context_token_budget, "CONTEXT_TOKEN_BUDGET", 1500
+                )
+            ),
+        )
+        self.pipeline.add_component(
+            "prompt_builder",
+            ChatPromptBuilder(
+                template=[ChatMessage.from_user(DOCUMENT_PROMPT_TEMPLATE)]
+            ),
+        )
+        self.pipeline.add_component("llm", ollama_chat_generator)
+
+        self.pipeline.connect(
+            sender="dense_text_embedder.embedding", receiver="retriever.query_embedding"
+        )
+        # The context is built from the output of the last retrieval stage
+        self.last_retrieval_stage = "retriever"
+        if self.retrieval_mode == "hybrid":
+            self.pipeline.connect(
+                sender="retriever.documents", receiver="fusion.dense_documents"
+            )
+            self.pipeline.connect(
+                sender="sparse_retriever.documents", receiver="fusion.sparse_documents"
+            )
+            self.last_retrieval_stage = "fusion"
+        if reranker:
+            self.pipeline.connect(
+                sender=f"{self.last_retrieval_stage}.documents",
+                receiver="ranker.documents",
+            )
+            self.last_retrieval_stage = "ranker"
+        self.pipeline.connect(
+            sender=f"{self.last_retrieval_stage}.documents",
+            receiver="context_builder.documents",
+        )
+        self.pipeline.connect(
+            sender="context_builder.documents", receiver="prompt_builder.documents"
+        )
+        self.pipeline.connect(sender="prompt_builder", receiver="llm")
+
+        # Load the reranker now instead of in the first, possibly concurrent, calls
+        self.pipeline.warm_up()
+        if draw:
+            self.pipeline.draw(
+                Path(os.path.join(GitRootFinder.get(), "gpn_chat_pipeline.png"))
+            )
+
+    def _stream_chunk(self, chunk: StreamingChunk) -> None:
+        """
+        Passes a generated chunk to the callback of the current call of `run()`.
+
+        :param chunk: The chunk of the answer.
+        :return: None
+        """
+        call_trace = self._call_trace.get()
+        if call_trace is not None:
+            if chunk.content and "first_token" not in call_trace:
+                call_trace["first_token"] = time.perf_counter()
+                call_trace["span"].set_tag(
+                    "time_to_first_token_seconds",
+                    call_trace["first_token"] - call_trace["start"],
+                )
+            # The last chunk of Ollama carries the number of tokens of the prompt and the answer
+            for tag, key in (
+                ("prompt_tokens", "prompt_eval_count"),
+                ("answer_tokens", "eval_count"),
+            ):
+                if key in chunk.meta:
+                    call_trace["span"].set_tag(tag, chunk.meta[key])
+
+        streaming_callback = (
+            self._call_streaming_callback.get() or self.streaming_callback
+        )
+        if streaming_callback is not None:
+            streaming_callback(chunk)
+
+    def run(
+        self,
+        query: str,
+        streaming_callback: Optional[Callable[[StreamingChunk], None]] = None,
+    ) -> str:
+        """
+        Sends the query input from the user to the pipeline
+
+        :param query: A string representing the input query for which a response is to be generated.
+        :param streaming_callback: The callback that receives the answer chunk by chunk. Defaults to the callback of
+        the pipeline.
+        :return: The content of the reply generated by the language model based on the provided query.
+        """
+        return self.run_with_sources(query, streaming_callback)[0]
+
+    def run_with_sources(
+        self,
+        query: str,
+        streaming_callback: Optional[Callable[[StreamingChunk], None]] = None,
+    ) -> tuple[str, list[Document]]:
+        """
+        Sends the query input from the user to the pipeline or takes the answer from the answer cache.
+
+        :param query: A string representing the input query for which a response is to be generated.
+        :param streaming_callback: The callback that receives the answer chunk by chunk. Defaults to the callback of
+        the pipeline.
+        :return: The content of the reply and the documents that were passed to the language model, i.e. the merged
+        passages of every talk that fit into the token budget of the `ContextBuilder`.
+        """
+        with tracing.tracer.trace("chat.query") as span:
+            token = self._call_streaming_callback.set(streaming_callback)
+            trace_token = self._call_trace.set(
+                {"span": span, "start": time.perf_counter()}
+            )
+            try:
+                response_content, sources = self._run(query)
+            finally:
+                self._call_streaming_callback.reset(token)
+                self._call_trace.reset(trace_token)
+            span.set_tag("documents", len(sources))
+
+            return response_content, sources
+
+    def _run(self, query: str) -> tuple[str, list[Document]]:
+        self.log.info(f"Received query: {query}")
+        # The filters are part of the key of the answer cache, so they are determined first
+        filters = self.query_analyzer.analyze(query) if self.query_analyzer else None
+        if self.answer_cache is not None:
+            embedding = self.text_embedder.run(text=query)["embedding"]
+            cached_answer = self.answer_cache.get(embedding, filters)
+            if cached_answer is not None:
+                response_content, sources = cached_answer
+                self._call_trace.get()["span"].set_tag("answer_cache_hits", 1)
+                self.log.info(f"Answered from the cache: {response_content}")
+                # The caller receives the answer the same way as a generated one
+                self._stream_chunk(StreamingChunk(content=response_content))
+                return response_content, sources
+
+        inputs = {
+            "dense_text_embedder": {"text": query},
+            "prompt_builder": {"query": query},
+        }
+        if self.retrieval_mode == "hybrid":
+            inputs["sparse_retriever"] = {"query": query}
+        if filters is not None:
+            self._call_trace.get()["span"].set_tag(
+                "filtered_talks", len(filters["value"])
+            )
+            inputs["retriever"] = {"filters": filters}
+            if self.retrieval_mode == "hybrid":
+                inputs["sparse_retriever"]["filters"] = filters
+        if self.last_retrieval_stage == "ranker":
+            inputs["ranker"] = {"query": query}
+
+        # The embedding is taken from the query embedding cache, so it is not calculated twice. Overlapping runs only
+        # share the visit counters of the components, which are used to detect loops and this pipeline has none.
+        response = self.pipeline.run(inputs, include_outputs_from={"context_builder"})
+        response_content = response["llm"]["replies"][0].content
+        sources = response["context_builder"]["documents"]
+        self.log.info(f"Generated answer: {response_content}")
+
+        if self.answer_cache is not None:
+            self.answer_cache.put(embedding, response_content, sources, filters)
+
+        return response_content, sources
@@ -0,0 +1,72 @@
+import bisect
+import math
+import threading
+
+
+class Histogram:
+    """
+    Counts observed values in buckets with fixed upper bounds, like a Prometheus histogram. All methods are thread
+    safe.
+
+    :param bounds: The upper bounds of the buckets in ascending order. Larger values are counted in an additional
+    bucket without an upper bound.
+    """
+
+    def __init__(self, bounds: tuple[float, ...]):
+        self.bounds = tuple(bounds)
+
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(self.bounds) + 1)
+        self._sum = 0.0
+
+    def observe(self, value: float) -> None:
+        """
+        :param value: The value to count.
+        :return: None
+        """
+        with self._lock:
+            self._counts[bisect.bisect_left(self.bounds, value)] += 1
+            self._sum += value
+
+    def snapshot(self) -> dict:
+        """
+        :return: The number and sum of the observed values and the cumulative count per upper bound.
+        """
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+
+        cumulative_counts = {}
+        cumulative_count = 0
+        for bound, count in zip(self.bounds + (math.inf,), counts):
+            cumulative_count += count
+            cumulative_counts[bound] = cumulative_count
+
+        return {"count": cumulative_count, "sum": total, "buckets": cumulative_counts}
+
+    def percentile(self, percentile: float) -> float:
+        """
+        :param percentile: The percentile between 0 and 100.
+        :return: The upper bound of the bucket that contains the percentile, 0 if nothing was observed.
+        """
+        snapshot = self.snapshot()
+        if not snapshot["count"]:
+            return 0.0
+
+        rank = percentile / 100 * snapshot["count"]
+        for bound, cumulative_count in snapshot["buckets"].items():
+            if cumulative_count >= rank:
+                return bound
+
+    def summary(self, unit: str = "") -> str:
+        """
+        :param unit: The unit appended to the values.
+        :return: The number of values, their mean and the bucket bounds of the median and the 99th percentile.
+        """
+        snapshot = self.snapshot()
+        mean = snapshot["sum"] / snapshot["count"] if snapshot["count"] else 0.0
+
+        return (
+            f"count {snapshot['count']}, mean {mean:.3g}{unit}, "
+            f"p50 <= {self.percentile(50):g}{unit}, p99 <= {self.percentile(99):g}{unit}"
+        )
@@ -0,0 +1,156 @@
+import hashlib
+import json
+import os
+
+from haystack import Document, component
+from haystack.document_stores.types import DocumentStore
+from haystack_integrations.document_stores.qdrant import QdrantDocumentStore
+from haystack_integrations.document_stores.qdrant.filters import (
+    convert_filters_to_qdrant,
+)
+from qdrant_client.http import models as rest
+
+from source.atomic_file_writer import AtomicFileWriter
+from source.logger import LoggerMixin
+
+
+@component
+class IncrementalIndexFilter(LoggerMixin):
+    """
+    Only lets talks through that changed since they were indexed the last time.
+
+    Each talk is identified by the `talk_id` in its metadata and hashed together with its transcription, its metadata
+    and the configuration of the indexing pipeline. The chunks of a talk whose hash changed are removed from the
+    document stores before the talk is passed on. The chunks of talks that do not exist anymore are removed by
+    `remove_other_talks()`.
+
+    The hashes are only persisted when `commit()` is called after the chunks of a batch were written, so an
+    interrupted run simply processes the talks of the unfinished batch again.
+
+    :param document_stores: The document stores the chunks are written to.
+    :param state_path: The path of the JSON file that stores the hashes of the indexed talks.
+    :param configuration: The configuration of the splitter and embedder. Changing it reindexes every talk.
+    """
+
+    def __init__(
+        self,
+        document_stores: list[DocumentStore],
+        state_path: str,
+        configuration: dict,
+    ):
+        # The component decorator recreates the class, which breaks the argument-less super()
+        LoggerMixin.__init__(self)
+
+        self.document_stores = document_stores
+        self.state_path = state_path
+        self.configuration = configuration
+
+        self.indexed_talks = self._load_state()
+        self._pending_talks = {}
+
+    def _load_state(self) -> dict[str, str]:
+        if not os.path.exists(self.state_path):
+            return {}
+
+        with open(self.state_path, mode="r", encoding="utf-8") as file:
+            return json.load(file)
+
+    def reset(self) -> None:
+        """
+        Forgets all indexed talks, e.g. after the index was recreated.
+
+        :return: None
+        """
+        self.indexed_talks = {}
+
+    def hash_talk(self, document: Document) -> str:
+        """
+        :param document: The document of a talk.
+        :return: The hash of the transcription, the metadata and the configuration.
+        """
+        serialized = json.dumps(
+            {
+                "content": document.content,
+                "meta": document.meta,
+                "configuration": self.configuration,
+            },
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+    def _delete_chunks_of_talk(self, talk_id: str) -> None:
+        talk_filter = {"field": "meta.talk_id", "operator": "==", "value": talk_id}
+        for document_store in self.document_stores:
+            if isinstance(document_store, QdrantDocumentStore):
+                self._delete_chunks_from_qdrant(document_store, talk_filter)
+            else:
+                chunks = document_store.filter_documents(filters=talk_filter)
+                document_store.delete_documents([chunk.id for chunk in chunks])
+
+    @staticmethod
+    def _delete_chunks_from_qdrant(
+        document_store: QdrantDocumentStore, talk_filter: dict
+    ) -> None:
+        # Qdrant deletes the chunks by their payload without fetching them first
+        qdrant_filter = convert_filters_to_qdrant(talk_filter)
+        document_store.client.delete(
+            collection_name=document_store.index,
+            points_selector=rest.FilterSelector(filter=qdrant_filter),
+            wait=True,
+        )
+
+    def remove_other_talks(self, talk_ids: list[str]) -> None:
+        """
+        Removes the chunks of all indexed talks that are not in the given list, i.e. that do not exist anymore.
+
+        :param talk_ids: The IDs of all existing talks.
+        :return: None
+        """
+        removed_talk_ids = self.indexed_talks.keys() - set(talk_ids)
+        if not removed_talk_ids:
+            return
+
+        for talk_id in removed_talk_ids:
+            self._delete_chunks_of_talk(talk_id)
+            del self.indexed_talks[talk_id]
+        self.log.info(f"Removed {len(removed_talk_ids)} talks from the index")
+        self._save_state()
+
+    @component.output_types(documents=list[Document])
+    def run(self, documents: list[Document]) -> dict[str, list[Document]]:
+        changed_documents = []
+        for document in documents:
+            talk_id = document.meta["talk_id"]
+            talk_hash = self.hash_talk(document)
+            if self.indexed_talks.get(talk_id) == talk_hash:
+                continue
+
+            if talk_id in self.indexed_talks:
+                self._delete_chunks_of_talk(talk_id)
+            changed_documents.append(document)
+            self._pending_talks[talk_id] = talk_hash
+
+        self.log.info(f"{len(changed_documents)} of {len(documents)} talks changed")
+
+        return {"documents": changed_documents}
+
+    def commit(self) -> None:
+        """
+        Persists the hashes of the talks that passed the filter since the last commit. Call this once the chunks of
+        these talks are written to the document store.
+
+        :return: None
+        """
+        if not self._pending_talks:
+            return
+
+        self.indexed_talks |= self._pending_talks
+        self._pending_talks = {}
+        self._save_state()
+
+    def _save_state(self) -> None:
+        AtomicFileWriter.write(
+            self.state_path,
+            json.dumps(self.indexed_talks, indent=4, ensure_ascii=False),
+        )
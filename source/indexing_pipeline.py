@@ -1,17 +1,28 @@
+import argparse
 import os
 from pathlib import Path
 
+from haystack import tracing
 from haystack.components.embedders import SentenceTransformersDocumentEmbedder
 from haystack.components.preprocessors import DocumentSplitter
 from haystack.components.writers import DocumentWriter
 from haystack.core.pipeline import Pipeline
-from haystack_integrations.document_stores.qdrant import QdrantDocumentStore
+from haystack.document_stores.types import DuplicatePolicy
 
+from source.cached_document_embedder import CachedDocumentEmbedder
+from source.chunk_id_assigner import ChunkIdAssigner
+from source.corpus_catalog import CorpusCatalog
+from source.embedding_cache import EmbeddingCache
 from source.git_root_finder import GitRootFinder
+from source.incremental_index_filter import IncrementalIndexFilter
+from source.instrumentation import Instrumentation
 from source.logger import LoggerMixin
+from source.query_analyzer import QueryAnalyzer
+from source.sparse_document_store import SparseDocumentStore
 from source.transcription_and_metadata_to_document import (
     TranscriptionAndMetadataToDocument,
 )
+from source.vector_backend import VectorBackend
 
 
 class IndexingPipeline(LoggerMixin):
@@ -21,70 +32,242 @@ class IndexingPipeline(LoggerMixin):
 
     This pipeline consists of the following components:
 
-    - TranscriptionAndMetadataToDocument: Converts transcription and metadata to documents.
+    - TranscriptionAndMetadataToDocument: Converts transcription and metadata of the talks in the `CorpusCatalog` to
+      documents.
+    - IncrementalIndexFilter: Only passes on talks that changed since the last run and removes their old chunks.
     - DocumentSplitter: Splits documents into smaller segments.
-    - SentenceTransformersDocumentEmbedder: Embeds the document segments using a pre-trained sentence transformer model.
-    - DocumentWriter: Writes the embedded documents to a Qdrant document store.
+    - ChunkIdAssigner: Gives the segments deterministic IDs, so that writing them again overwrites them.
+    - CachedDocumentEmbedder: Embeds the document segments using a pre-trained sentence transformer model. Segments
+      that were embedded before are taken from the embedding cache in `data/embedding_cache/`.
+    - DocumentWriter: Writes the embedded documents to the document store of the vector backend selected by
+      `VECTOR_BACKEND`, see `VectorBackend`.
+    - DocumentWriter: Writes the document segments of the ChunkIdAssigner to the BM25 index of the
+      `SparseDocumentStore`.
 
-    The components are connected in a sequence where the output of one is passed as input to the next.
+    The components are connected in a sequence where the output of one is passed as input to the next. The talks are
+    pushed through the pipeline in batches of `batch_size` talks, so the memory usage does not grow with the number of
+    talks and the chunks of every finished batch are already searchable while the next batch is processed.
 
-    The pipeline is visualized and saved as an image file "indexing_pipeline.png".
+    The pipeline is visualized and saved as an image file "indexing_pipeline.png" unless `draw` is disabled.
+
+    Running the pipeline again only embeds the talks that were added or changed and removes the chunks of talks that
+    were deleted. The hashes of the indexed talks are stored in `data/index_state.json`.
+
+    A run is traced as the span `indexing.run` and every batch as `indexing.batch` with the number of talks and written
+    chunks, see `Instrumentation`.
+
+    :param recreate_index: Whether to drop the collection and index every talk again. This is always done if no talk
+    was indexed before.
+    :param batch_size: The number of talks that are loaded, split, embedded and written at once.
+    :param quantization: The quantization of the Qdrant collection ("none", "scalar" or "binary"), see
+    `VectorBackend`. Defaults to `QDRANT_QUANTIZATION`.
+    :param hnsw_m: The number of edges per node of the HNSW graph. Defaults to `QDRANT_HNSW_M`.
+    :param hnsw_ef_construct: The size of the candidate list while building the HNSW graph. Defaults to
+    `QDRANT_HNSW_EF_CONSTRUCT`.
+    :param draw: Whether the pipeline is drawn to "indexing_pipeline.png", which needs access to mermaid.ink.
     """
 
-    def __init__(self):
+    SPLITTER_CONFIGURATION = {
+        "split_by": "sentence",
+        "split_length": 5,
+        "split_overlap": 2,
+    }
+    EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+    EMBEDDING_DIM = 384
+
+    def __init__(
+        self,
+        recreate_index: bool = False,
+        batch_size: int = 16,
+        quantization: str = None,
+        hnsw_m: int = None,
+        hnsw_ef_construct: int = None,
+        draw: bool = True,
+    ):
         super().__init__()
 
-        qdrant_document_store = QdrantDocumentStore(
-            location="http://localhost:6333",
-            recreate_index=True,
-            return_embedding=True,
-            wait_result_from_api=True,
-            embedding_dim=384,
-            index="gpn-chat",
-            use_sparse_embeddings=False,
-            sparse_idf=True,
+        self.batch_size = batch_size
+
+        state_path = os.path.join(GitRootFinder.get(), "data", "index_state.json")
+        recreate_index = recreate_index or not os.path.exists(state_path)
+        if recreate_index:
+            self.log.info("Recreating the index, every talk is indexed again")
+
+        vector_backend = VectorBackend(
+            embedding_dim=self.EMBEDDING_DIM,
+            quantization=quantization,
+            hnsw_m=hnsw_m,
+            hnsw_ef_construct=hnsw_ef_construct,
+        )
+        document_store = vector_backend.create_document_store(
+            recreate_index=recreate_index, return_embedding=True
+        )
+        if not recreate_index:
+            vector_backend.apply_collection_configuration(document_store)
+        sparse_document_store = SparseDocumentStore(recreate_index=recreate_index)
+
+        self.incremental_index_filter = IncrementalIndexFilter(
+            document_stores=[document_store, sparse_document_store],
+            state_path=state_path,
+            # Switching the backend writes every talk to the new backend
+            configuration=self.SPLITTER_CONFIGURATION
+            | {
+                "embedding_model": self.EMBEDDING_MODEL,
+                "vector_backend": vector_backend.backend,
+                "sparse_index": True,
+            },
         )
+        if recreate_index:
+            self.incremental_index_filter.reset()
 
         self.pipeline = Pipeline()
 
+        self.textfile_loader = TranscriptionAndMetadataToDocument(
+            catalog=CorpusCatalog()
+        )
         self.pipeline.add_component(
-            instance=TranscriptionAndMetadataToDocument(), name="textfile_loader"
+            instance=self.textfile_loader, name="textfile_loader"
         )
         self.pipeline.add_component(
-            instance=DocumentSplitter(
-                split_by="sentence", split_length=5, split_overlap=2
-            ),
+            instance=self.incremental_index_filter, name="incremental_index_filter"
+        )
+        self.pipeline.add_component(
+            instance=DocumentSplitter(**self.SPLITTER_CONFIGURATION),
             name="splitter",
         )
         self.pipeline.add_component(
-            instance=SentenceTransformersDocumentEmbedder(
-                model="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+            instance=ChunkIdAssigner(), name="chunk_id_assigner"
+        )
+        self.pipeline.add_component(
+            instance=CachedDocumentEmbedder(
+                embedder=SentenceTransformersDocumentEmbedder(
+                    model=self.EMBEDDING_MODEL
+                ),
+                cache=EmbeddingCache(
+                    model_name=self.EMBEDDING_MODEL, embedding_dim=self.EMBEDDING_DIM
+                ),
             ),
             name="embedder",
         )
         self.pipeline.add_component(
-            name="writer", instance=DocumentWriter(qdrant_document_store)
+            name="writer",
+            instance=DocumentWriter(document_store, policy=DuplicatePolicy.OVERWRITE),
+        )
+        self.pipeline.add_component(
+            name="sparse_writer",
+            instance=DocumentWriter(
+                sparse_document_store, policy=DuplicatePolicy.OVERWRITE
+            ),
         )
 
-        self.pipeline.connect(sender="textfile_loader", receiver="splitter")
-        self.pipeline.connect(sender="splitter", receiver="embedder")
+        self.pipeline.connect(
+            sender="textfile_loader", receiver="incremental_index_filter"
+        )
+        self.pipeline.connect(sender="incremental_index_filter", receiver="splitter")
+        self.pipeline.connect(sender="splitter", receiver="chunk_id_assigner")
+        self.pipeline.connect(sender="chunk_id_assigner", receiver="embedder")
         self.pipeline.connect(sender="embedder.documents", receiver="writer")
+        self.pipeline.connect(sender="chunk_id_assigner", receiver="sparse_writer")
 
-        self.pipeline.draw(
-            Path(os.path.join(GitRootFinder.get(), "indexing_pipeline.png"))
-        )
+        if draw:
+            self.pipeline.draw(
+                Path(os.path.join(GitRootFinder.get(), "indexing_pipeline.png"))
+            )
 
     def run(self) -> None:
         """
-        Runs the data processing pipeline.
+        Runs the data processing pipeline once per batch of talks. The progress is committed after every batch.
 
         :return: None
         """
-        data_directory = os.path.join(GitRootFinder.get(), "data")
-        self.pipeline.run({"textfile_loader": {"data_directory": data_directory}})
+        with tracing.tracer.trace("indexing.run") as span:
+            talk_ids = self.textfile_loader.list_talks()
+            self.incremental_index_filter.remove_other_talks(talk_ids)
+            span.set_tag("talks", len(talk_ids))
+
+            number_of_batches = -(-len(talk_ids) // self.batch_size)
+            for batch_number, start in enumerate(
+                range(0, len(talk_ids), self.batch_size), start=1
+            ):
+                end = start + self.batch_size
+                self.index_talks(talk_ids[start:end])
+                self.log.info(f"Indexed batch {batch_number} of {number_of_batches}")
+
+            self.build_query_lookup()
+
         self.log.info("The indexing pipeline finished successfully")
 
+    def index_talks(self, talk_ids: list[str]) -> int:
+        """
+        Runs the data processing pipeline for a batch of talks and commits the progress. Talks that did not change
+        since they were indexed are skipped.
+
+        :param talk_ids: The IDs of the talks.
+        :return: The number of chunks written to the vector backend.
+        """
+        with tracing.tracer.trace("indexing.batch") as span:
+            response = self.pipeline.run({"textfile_loader": {"talk_ids": talk_ids}})
+            self.incremental_index_filter.commit()
+            chunks = response.get("writer", {}).get("documents_written", 0)
+            span.set_tag("talks", len(talk_ids))
+            span.set_tag("chunks", chunks)
+
+        return chunks
+
+    def build_query_lookup(self) -> None:
+        """
+        Writes the lookup of the `QueryAnalyzer` for all talks that have a transcription and metadata.
+
+        :return: None
+        """
+        QueryAnalyzer.build_lookup(
+            self.textfile_loader.catalog, self.textfile_loader.list_talks()
+        )
+
 
 if __name__ == "__main__":
-    indexing_pipeline = IndexingPipeline()
+    parser = argparse.ArgumentParser(
+        description="Index the transcriptions and metadata into the QdrantDocumentStore"
+    )
+    parser.add_argument(
+        "--recreate-index",
+        action="store_true",
+        default=False,
+        help="Drop the collection and index every talk again instead of only the talks that changed - Default: %(default)s",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=16,
+        help="The number of talks that are indexed at once - Default: %(default)s",
+    )
+    parser.add_argument(
+        "--quantization",
+        choices=VectorBackend.QUANTIZATIONS,
+        default=None,
+        help="Quantize the vectors of the Qdrant collection - Default: QDRANT_QUANTIZATION or none",
+    )
+    parser.add_argument(
+        "--hnsw-m",
+        type=int,
+        default=None,
+        help="The number of edges per node of the HNSW graph - Default: QDRANT_HNSW_M or the default of Qdrant",
+    )
+    parser.add_argument(
+        "--hnsw-ef-construct",
+        type=int,
+        default=None,
+        help="The size of the candidate list while building the HNSW graph - Default: QDRANT_HNSW_EF_CONSTRUCT or the "
+        "default of Qdrant",
+    )
+    arguments = parser.parse_args()
+
+    Instrumentation().enable()
+    indexing_pipeline = IndexingPipeline(
+        recreate_index=arguments.recreate_index,
+        batch_size=arguments.batch_size,
+        quantization=arguments.quantization,
+        hnsw_m=arguments.hnsw_m,
+        hnsw_ef_construct=arguments.hnsw_ef_construct,
+    )
     indexing_pipeline.run()
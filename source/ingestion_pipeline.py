@@ -0,0 +1,391 @@
+import queue
+import threading
+import time
+from typing import Callable, Optional
+
+import requests
+from haystack import tracing
+
+from source.crawler import Crawler
+from source.indexing_pipeline import IndexingPipeline
+from source.logger import LoggerMixin
+from source.transcriber import Transcriber
+from source.translator import Translator
+
+# Put into the queue of a stage once per worker to stop the workers
+_STOP = object()
+
+
+class IngestionStage(LoggerMixin):
+    """
+    A stage of the `IngestionPipeline`. Its workers take talks from a bounded queue, process them and put the talks
+    they return into the queue of the next stage. A full queue blocks the previous stage, so a fast stage can not run
+    far ahead of a slow one. A talk that is put into the stage again while it is still waiting is only processed once.
+
+    :param name: The name of the stage, used for logging.
+    :param process: Processes a list of talk IDs and returns the IDs of the talks to pass on to the next stage.
+    :param workers: The number of threads that process talks.
+    :param queue_size: The number of talks that may wait in the queue.
+    :param batch_size: The maximum number of waiting talks a worker processes at once.
+    :param initialize_worker: Called once in every worker thread before it processes a talk.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        process: Callable[[list[str]], list[str]],
+        workers: int = 1,
+        queue_size: int = 4,
+        batch_size: int = 1,
+        initialize_worker: Callable[[], None] = None,
+    ):
+        super().__init__()
+
+        self.name = name
+        self.process = process
+        self.workers = workers
+        self.batch_size = batch_size
+        self.initialize_worker = initialize_worker
+        self.next_stage: Optional[IngestionStage] = None
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._waiting = set()
+        self.processed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+
+    def start(self) -> None:
+        self._threads = [
+            # Daemon threads do not keep an interrupted run alive, every stage can resume a killed talk
+            threading.Thread(
+                target=self._work, name=f"{self.name}-{index}", daemon=True
+            )
+            for index in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def put(self, talk_id: str) -> None:
+        """
+        Blocks until there is room in the queue. Talks that are already waiting in the queue are ignored, a talk that
+        is put again after a worker took it is processed again, e.g. after its audio file changed.
+
+        :param talk_id: The ID of the talk.
+        :return: None
+        """
+        with self._lock:
+            if talk_id in self._waiting:
+                return
+            self._waiting.add(talk_id)
+        self.queue.put(talk_id)
+
+    def stop(self) -> None:
+        """
+        Lets the workers finish the talks in the queue and waits for them. Nothing may be put into the stage anymore.
+
+        :return: None
+        """
+        for _ in self._threads:
+            self.queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+
+    def _take_batch(self) -> tuple[list[str], bool]:
+        """
+        Blocks until a talk is waiting and adds the further waiting talks up to the batch size.
+
+        :return: The talks and whether the worker has to stop afterward.
+        """
+        talk_ids = []
+        item = self.queue.get()
+        while item is not _STOP:
+            talk_ids.append(item)
+            with self._lock:
+                self._waiting.discard(item)
+            if len(talk_ids) == self.batch_size:
+                return talk_ids, False
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                return talk_ids, False
+
+        return talk_ids, True
+
+    def _work(self) -> None:
+        initialization_error = None
+        if self.initialize_worker:
+            try:
+                self.initialize_worker()
+            except Exception as error:
+                # The worker keeps taking talks, so the previous stage is not blocked by a queue nobody empties
+                self.log.error(f"Failed to initialize a {self.name} worker: {error}")
+                initialization_error = error
+
+        stopping = False
+        while not stopping:
+            talk_ids, stopping = self._take_batch()
+            if not talk_ids:
+                continue
+
+            start = time.perf_counter()
+            try:
+                if initialization_error:
+                    raise initialization_error
+                next_talk_ids = self.process(talk_ids)
+            except Exception as error:
+                # A failing talk is resumed at this stage in the next run
+                self.log.error(f"Failed to {self.name} {', '.join(talk_ids)}: {error}")
+                next_talk_ids = []
+                with self._lock:
+                    self.failed += len(talk_ids)
+            else:
+                with self._lock:
+                    self.processed += len(talk_ids)
+            with self._lock:
+                self.busy_seconds += time.perf_counter() - start
+
+            if self.next_stage:
+                for talk_id in next_talk_ids:
+                    self.next_stage.put(talk_id)
+
+
+class IngestionPipeline(LoggerMixin):
+    """
+    Streams every talk through crawling, downloading, transcribing, translating and indexing as soon as the previous
+    stage finished it, instead of running each stage for all talks before the next one starts. While one talk is
+    transcribed, the next ones are downloaded and the previous ones are translated and indexed, so a new talk is
+    searchable minutes after it was crawled.
+
+    Every stage is an `IngestionStage` with its own workers, connected to the next one by a bounded queue:
+    - crawl: Scrapes the page of a talk and writes its metadata (`Crawler.scrape_talk()`).
+    - download: Downloads the audio file of a talk (`Crawler.download_audio_of_talk()`). If the audio file changed, its
+      transcription is discarded, so the talk is transcribed, translated and indexed again.
+    - transcribe: Transcribes the audio file. Every worker thread loads its own Whisper model.
+    - translate: Translates the transcription if it is not in the target language. Every worker thread has its own
+      `Translator` and thereby its own models.
+    - index: Splits, embeds and upserts the talks with the `IndexingPipeline`. A single worker indexes all talks that
+      are waiting at once (up to `index_batch_size`), because the index state is committed after every batch.
+
+    Talks are resumed at the stage they stopped at in the last run: Downloaded talks that are not transcribed start
+    at the transcribe stage, transcribed talks that are not in the target language at the translate stage and all
+    other transcribed talks at the index stage, which skips the talks that did not change since they were indexed.
+
+    The run is traced as the span `ingestion.run` with the processed and failed talks of every stage, see
+    `Instrumentation`. At the end, the share of the time the workers of every stage were busy is logged to find the
+    stage that needs more workers.
+
+    :param crawler: The crawler, its `max_workers` and `max_downloads` are the workers of the crawl and download stage.
+    :param transcriber: The transcriber. Its pool is not used, every transcribe worker uses `threads_per_worker`
+    torch threads.
+    :param translator: The translator, the translators of the workers are created with the same arguments.
+    :param indexing_pipeline: The indexing pipeline.
+    :param transcription_workers: The number of talks that are transcribed at once.
+    :param translation_workers: The number of talks that are translated at once.
+    :param index_batch_size: The maximum number of talks that are indexed at once.
+    :param queue_size: The number of talks that may wait in front of each stage.
+    """
+
+    def __init__(
+        self,
+        crawler: Crawler,
+        transcriber: Transcriber,
+        translator: Translator,
+        indexing_pipeline: IndexingPipeline,
+        transcription_workers: int = 1,
+        translation_workers: int = 1,
+        index_batch_size: int = 8,
+        queue_size: int = 4,
+    ):
+        super().__init__()
+
+        self.crawler = crawler
+        self.transcriber = transcriber
+        self.translator = translator
+        self.indexing_pipeline = indexing_pipeline
+        self.catalog = translator.catalog
+
+        self._positions = {}
+        self._audio_links = {}
+        self._worker_state = threading.local()
+
+        self.stages = [
+            IngestionStage(
+                "crawl",
+                self._crawl,
+                workers=crawler.max_workers,
+                queue_size=queue_size,
+            ),
+            IngestionStage(
+                "download",
+                self._download,
+                workers=crawler.max_downloads,
+                queue_size=queue_size,
+            ),
+            IngestionStage(
+                "transcribe",
+                self._transcribe,
+                workers=transcription_workers,
+                queue_size=queue_size,
+                initialize_worker=transcriber.initialize_worker,
+            ),
+            IngestionStage(
+                "translate",
+                self._translate,
+                workers=translation_workers,
+                queue_size=queue_size,
+                initialize_worker=self._initialize_translation_worker,
+            ),
+            IngestionStage(
+                "index",
+                self._index,
+                queue_size=max(queue_size, index_batch_size),
+                batch_size=index_batch_size,
+            ),
+        ]
+        for stage, next_stage in zip(self.stages, self.stages[1:]):
+            stage.next_stage = next_stage
+        (
+            self.crawl_stage,
+            self.download_stage,
+            self.transcribe_stage,
+            self.translate_stage,
+            self.index_stage,
+        ) = self.stages
+
+    def _crawl(self, talk_ids: list[str]) -> list[str]:
+        talk_id = talk_ids[0]
+        audio_link = self.crawler.scrape_talk(
+            self._positions[talk_id], self.crawler.talks[talk_id]
+        )
+        if audio_link is None:
+            return []
+
+        self._audio_links[talk_id] = audio_link
+        return [talk_id]
+
+    def _download(self, talk_ids: list[str]) -> list[str]:
+        talk_id = talk_ids[0]
+        if self.crawler.download_audio_of_talk(talk_id, self._audio_links.pop(talk_id)):
+            # The transcription of the previous audio file is outdated
+            self.transcriber.discard_transcription(f"{talk_id}.mp3")
+
+        return [talk_id]
+
+    def _transcribe(self, talk_ids: list[str]) -> list[str]:
+        talk_id = talk_ids[0]
+        self.transcriber.transcribe_file(f"{talk_id}.mp3")
+
+        return [talk_id]
+
+    def _initialize_translation_worker(self) -> None:
+        self._worker_state.translator = Translator(
+            **self.translator.translator_arguments
+        )
+
+    def _translate(self, talk_ids: list[str]) -> list[str]:
+        talk_id = talk_ids[0]
+        language = self.catalog.get_language(talk_id)
+        # Talks of unknown language are not translated, like in `Translator.start()`
+        if language is not None and language != self.translator.target_language:
+            self._worker_state.translator.translate_talk(talk_id, language)
+
+        return [talk_id]
+
+    def _index(self, talk_ids: list[str]) -> list[str]:
+        chunks = self.indexing_pipeline.index_talks(talk_ids)
+        self.indexing_pipeline.build_query_lookup()
+        self.log.info(f"Indexed {len(talk_ids)} talks ({chunks} chunks written)")
+
+        return []
+
+    def _find_unfinished_talks(self) -> dict[IngestionStage, list[str]]:
+        """
+        Looks up the stage every talk in the catalog has to continue at. Translations that were interrupted after the
+        metadata was updated are completed on the way.
+
+        :return: The talks to put into the transcribe, translate and index stage.
+        """
+        untranslated = [
+            talk_id for talk_id, _ in self.translator.find_talks_to_translate()
+        ]
+        transcribed = self.catalog.talks_with_files("metadata", "transcription")
+
+        return {
+            self.transcribe_stage: self.catalog.talks_with_files(
+                "audio", without_stage="transcribed"
+            ),
+            self.translate_stage: untranslated,
+            self.index_stage: sorted(set(transcribed) - set(untranslated)),
+        }
+
+    def _feed(self, stage: IngestionStage, talk_ids: list[str]) -> None:
+        for talk_id in talk_ids:
+            stage.put(talk_id)
+
+    def _feed_crawl_stage(self) -> None:
+        try:
+            self.crawler.find_talks()
+        except requests.RequestException as error:
+            self.log.error(
+                f"Failed to find the talks, only the known talks are ingested: {error}"
+            )
+            return
+
+        for position, talk_id in enumerate(self.crawler.talks, start=1):
+            self._positions[talk_id] = position
+            self.crawl_stage.put(talk_id)
+
+    def run(self) -> None:
+        """
+        Ingests the talks that were interrupted in the last run and all new or changed talks of the GPN archive. The
+        crawl manifest is saved at the end, even if the ingestion was interrupted.
+
+        :return: None
+        """
+        unfinished_talks = self._find_unfinished_talks()
+        self.log.info(
+            "Resuming "
+            + ", ".join(
+                f"{len(talk_ids)} talks at the {stage.name} stage"
+                for stage, talk_ids in unfinished_talks.items()
+            )
+        )
+
+        start = time.perf_counter()
+        try:
+            with tracing.tracer.trace("ingestion.run") as span:
+                for stage in self.stages:
+                    stage.start()
+                # Every stage is fed by its own thread, so a full queue does not hold back the other stages
+                feeders = [
+                    threading.Thread(
+                        target=self._feed, args=(stage, talk_ids), daemon=True
+                    )
+                    for stage, talk_ids in unfinished_talks.items()
+                ]
+                for feeder in feeders:
+                    feeder.start()
+                self._feed_crawl_stage()
+
+                # A stage is stopped once every stage that feeds it is done
+                self.crawl_stage.stop()
+                self.download_stage.stop()
+                for feeder in feeders:
+                    feeder.join()
+                for stage in self.stages[2:]:
+                    stage.stop()
+
+                for stage in self.stages:
+                    span.set_tag(f"{stage.name}_talks", stage.processed)
+                    span.set_tag(f"{stage.name}_failed", stage.failed)
+        finally:
+            self.crawler.manifest.save()
+
+        duration = time.perf_counter() - start
+        for stage in self.stages:
+            self.log.info(
+                f"Stage {stage.name}: {stage.processed} talks processed, {stage.failed} failed, "
+                f"{stage.workers} workers busy {stage.busy_seconds / (stage.workers * duration):.0%} of the time"
+            )
@@ -0,0 +1,177 @@
+import contextlib
+import os
+import threading
+from typing import Any, Iterator, Optional
+
+from haystack import tracing
+from haystack.tracing import Span, Tracer
+
+from source.git_root_finder import GitRootFinder
+from source.json_lines_sink import JsonLinesSink
+from source.logger import LoggerMixin
+from source.metrics_tracer import MetricsTracer
+from source.prometheus_sink import PrometheusSink
+
+
+class MultiSpan(Span):
+    """
+    The spans of the tracers of a `MultiTracer` that belong to the same operation.
+
+    :param spans: The span of every tracer.
+    """
+
+    def __init__(self, spans: list[Span]):
+        self.spans = spans
+
+    def set_tag(self, key: str, value: object) -> None:
+        for span in self.spans:
+            span.set_tag(key, value)
+
+    def set_content_tag(self, key: str, value: object) -> None:
+        for span in self.spans:
+            span.set_content_tag(key, value)
+
+    def raw_span(self) -> object:
+        return [span.raw_span() for span in self.spans]
+
+    def get_correlation_data_for_logs(self) -> dict[str, Any]:
+        correlation_data = {}
+        for span in self.spans:
+            correlation_data |= span.get_correlation_data_for_logs()
+
+        return correlation_data
+
+
+class MultiTracer(Tracer):
+    """
+    Passes every span to multiple tracers, because Haystack only supports one tracer at a time.
+
+    :param tracers: The tracers.
+    """
+
+    def __init__(self, tracers: list[Tracer]):
+        self.tracers = tracers
+
+    @contextlib.contextmanager
+    def trace(
+        self,
+        operation_name: str,
+        tags: Optional[dict[str, Any]] = None,
+        parent_span: Optional[Span] = None,
+    ) -> Iterator[Span]:
+        with contextlib.ExitStack() as stack:
+            spans = []
+            for index, tracer in enumerate(self.tracers):
+                spans.append(
+                    stack.enter_context(
+                        tracer.trace(
+                            operation_name,
+                            tags=tags,
+                            parent_span=(
+                                parent_span.spans[index]
+                                if isinstance(parent_span, MultiSpan)
+                                else None
+                            ),
+                        )
+                    )
+                )
+            yield MultiSpan(spans)
+
+    def current_span(self) -> Optional[Span]:
+        return self.tracers[0].current_span()
+
+
+class Instrumentation(LoggerMixin):
+    """
+    Exports the spans of the pipelines and stages to the configured sinks. The components of the Haystack pipelines
+    are traced by Haystack, the other stages (crawling, transcribing, translating, indexing and answering a query) open
+    their own spans with `haystack.tracing.tracer.trace()` and set their counters as numeric tags on them. Without a
+    sink, Haystack's tracer does nothing and the spans cost next to nothing.
+
+    The sinks are:
+    - "prometheus": Aggregates the durations and counters, served on `http://PROMETHEUS_HOST:PROMETHEUS_PORT/metrics`
+      (default: 127.0.0.1:9464), see `PrometheusSink`.
+    - "jsonl": Appends every span to `INSTRUMENTATION_JSONL_PATH` (default: `data/spans.jsonl`), see `JsonLinesSink`.
+    - "langfuse": Sends the traces to Langfuse with the tracer of `langfuse-haystack`. The client reads
+      `LANGFUSE_SECRET_KEY`, `LANGFUSE_PUBLIC_KEY` and `LANGFUSE_HOST`.
+
+    Tracing is enabled once per process with `enable()`. Worker processes do not serve the Prometheus metrics, so with
+    only the "prometheus" sink their spans are dropped. The spans of the runs in the main process still contain the
+    counters of all workers.
+
+    :param sinks: The names of the sinks. Defaults to the comma-separated names in `INSTRUMENTATION_SINKS` (none by
+    default).
+    """
+
+    SINKS = ("prometheus", "jsonl", "langfuse")
+
+    _lock = threading.Lock()
+    _enabled = False
+
+    def __init__(self, sinks: list[str] = None):
+        super().__init__()
+
+        if sinks is None:
+            sinks = [
+                sink.strip()
+                for sink in os.environ.get("INSTRUMENTATION_SINKS", "").split(",")
+                if sink.strip()
+            ]
+        unknown_sinks = set(sinks) - set(self.SINKS)
+        if unknown_sinks:
+            raise ValueError(
+                f"Unknown instrumentation sinks {sorted(unknown_sinks)}, use {', '.join(self.SINKS)}"
+            )
+        self.sinks = sinks
+
+    @staticmethod
+    def _create_langfuse_tracer() -> Tracer:
+        # Only imported when the sink is used, the client connects to Langfuse on creation
+        from haystack_integrations.tracing.langfuse import LangfuseTracer
+        from langfuse import Langfuse
+
+        return LangfuseTracer(tracer=Langfuse(), name="GPN-Chat")
+
+    def enable(self, serve_metrics: bool = True) -> None:
+        """
+        Enables the tracing with the sinks. Calling it again in the same process does nothing.
+
+        :param serve_metrics: Whether the Prometheus sink is used. Worker processes pass False, only the main process
+        serves the metrics. The spans of a worker process are therefore only exported by the other sinks.
+        :return: None
+        """
+        with Instrumentation._lock:
+            if Instrumentation._enabled or not self.sinks:
+                return
+            Instrumentation._enabled = True
+
+        span_sinks = []
+        if "prometheus" in self.sinks and serve_metrics:
+            prometheus_sink = PrometheusSink()
+            prometheus_sink.serve(
+                host=os.environ.get("PROMETHEUS_HOST", "127.0.0.1"),
+                port=int(os.environ.get("PROMETHEUS_PORT", 9464)),
+            )
+            span_sinks.append(prometheus_sink)
+        if "jsonl" in self.sinks:
+            span_sinks.append(
+                JsonLinesSink(
+                    os.environ.get(
+                        "INSTRUMENTATION_JSONL_PATH",
+                        os.path.join(GitRootFinder.get(), "data", "spans.jsonl"),
+                    )
+                )
+            )
+
+        tracers = []
+        if span_sinks:
+            tracers.append(MetricsTracer(span_sinks))
+        if "langfuse" in self.sinks:
+            tracers.append(self._create_langfuse_tracer())
+        if not tracers:
+            return
+
+        tracing.enable_tracing(
+            tracers[0] if len(tracers) == 1 else MultiTracer(tracers)
+        )
+        self.log.info(f"Tracing with the sinks {', '.join(self.sinks)}")
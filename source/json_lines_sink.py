@@ -0,0 +1,46 @@
+import json
+import os
+import threading
+
+from source.metrics_tracer import MetricsSpan
+
+
+class JsonLinesSink:
+    """
+    Appends every span of the `MetricsTracer` as one JSON line to a file, so single queries and runs can be analyzed
+    afterward. Multiple processes may append to the same file. The file is kept open in append mode.
+
+    :param path: The path of the file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Unbuffered, so every line is written with a single system call
+        self._file = open(path, mode="ab", buffering=0)
+        self._lock = threading.Lock()
+
+    def record(self, span: MetricsSpan) -> None:
+        """
+        :param span: A finished span.
+        :return: None
+        """
+        line = json.dumps(
+            {
+                "trace_id": span.trace_id,
+                "span_id": span.span_id,
+                "parent_id": span.parent.span_id if span.parent else None,
+                "name": span.name,
+                "start": span.start,
+                "duration": span.duration,
+                "error": span.error,
+                "counters": span.counters(),
+                "attributes": span.attributes(),
+            },
+            ensure_ascii=False,
+        )
+        # A single write per line keeps the lines of concurrent processes apart
+        with self._lock:
+            self._file.write(f"{line}\n".encode("utf-8"))
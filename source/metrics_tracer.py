@@ -0,0 +1,105 @@
+import contextlib
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Any, Iterator, Optional
+
+from haystack.tracing import Span, Tracer
+
+
+class MetricsSpan(Span):
+    """
+    A finished or running span of the `MetricsTracer`. Numeric tags that are not set by Haystack itself are the
+    counters of the span, e.g. the number of retrieved documents or downloaded bytes.
+
+    :param name: The name of the span, the name of the component for the components of a pipeline.
+    :param parent: The span this span was started in.
+    """
+
+    def __init__(self, name: str, parent: Optional["MetricsSpan"]):
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.start = time.time()
+        self.duration = None
+        self.error = None
+        self.tags = {}
+
+    def set_tag(self, key: str, value: object) -> None:
+        self.tags[key] = value
+
+    def raw_span(self) -> object:
+        return self
+
+    def get_correlation_data_for_logs(self) -> dict[str, Any]:
+        return {"trace_id": self.trace_id, "span_id": self.span_id}
+
+    def counters(self) -> dict[str, float]:
+        """
+        :return: The numeric tags of the span that are not set by Haystack.
+        """
+        return {
+            key: value
+            for key, value in self.tags.items()
+            if isinstance(value, (int, float))
+            and not isinstance(value, bool)
+            and not key.startswith("haystack.")
+        }
+
+    def attributes(self) -> dict[str, Any]:
+        """
+        :return: The textual and boolean tags of the span that are not set by Haystack.
+        """
+        return {
+            key: value
+            for key, value in self.tags.items()
+            if isinstance(value, (str, bool)) and not key.startswith("haystack.")
+        }
+
+
+class MetricsTracer(Tracer):
+    """
+    A Haystack tracer that times every span and hands the finished spans to its sinks. The components of the Haystack
+    pipelines are traced by Haystack itself, the other stages open their spans with `haystack.tracing.tracer.trace()`.
+
+    Spans are nested by the context they run in, so spans in different threads and asyncio tasks do not mix.
+
+    :param sinks: The sinks, objects with a method `record(span: MetricsSpan)` that is called with every finished span.
+    """
+
+    def __init__(self, sinks: list):
+        self.sinks = sinks
+
+        self._current_span = ContextVar("metrics_span", default=None)
+
+    @contextlib.contextmanager
+    def trace(
+        self,
+        operation_name: str,
+        tags: Optional[dict[str, Any]] = None,
+        parent_span: Optional[Span] = None,
+    ) -> Iterator[Span]:
+        tags = tags or {}
+        if not isinstance(parent_span, MetricsSpan):
+            parent_span = self._current_span.get()
+        span = MetricsSpan(
+            tags.get("haystack.component.name", operation_name), parent_span
+        )
+        span.set_tags(tags)
+
+        token = self._current_span.set(span)
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException as error:
+            span.error = type(error).__name__
+            raise
+        finally:
+            span.duration = time.perf_counter() - start
+            self._current_span.reset(token)
+            for sink in self.sinks:
+                sink.record(span)
+
+    def current_span(self) -> Optional[Span]:
+        return self._current_span.get()
@@ -0,0 +1,149 @@
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from source.histogram import Histogram
+from source.logger import LoggerMixin
+from source.metrics_tracer import MetricsSpan
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class PrometheusSink(LoggerMixin):
+    """
+    Aggregates the spans of the `MetricsTracer` into metrics in the text format of Prometheus:
+
+    - `gpn_chat_span_duration_seconds`: A histogram of the durations per span.
+    - `gpn_chat_span_counter_total`: The sum of every counter per span, e.g. the retrieved documents of all queries.
+    - `gpn_chat_span_errors_total`: The number of failed spans per span.
+
+    `serve()` exposes the metrics on `/metrics` for Prometheus to scrape them.
+    """
+
+    DURATION_BOUNDS = (
+        0.001,
+        0.005,
+        0.01,
+        0.025,
+        0.05,
+        0.1,
+        0.25,
+        0.5,
+        1,
+        2.5,
+        5,
+        10,
+        30,
+        60,
+        300,
+        900,
+    )
+
+    def __init__(self):
+        super().__init__()
+
+        self._lock = threading.Lock()
+        self._durations = {}
+        self._counters = {}
+        self._errors = {}
+
+    def record(self, span: MetricsSpan) -> None:
+        """
+        :param span: A finished span.
+        :return: None
+        """
+        with self._lock:
+            if span.name not in self._durations:
+                self._durations[span.name] = Histogram(self.DURATION_BOUNDS)
+                self._errors[span.name] = 0
+            histogram = self._durations[span.name]
+            for counter, value in span.counters().items():
+                key = (span.name, counter)
+                self._counters[key] = self._counters.get(key, 0) + value
+            if span.error is not None:
+                self._errors[span.name] += 1
+        histogram.observe(span.duration)
+
+    def render(self) -> str:
+        """
+        :return: The metrics in the text format of Prometheus.
+        """
+        with self._lock:
+            durations = dict(self._durations)
+            counters = dict(self._counters)
+            errors = dict(self._errors)
+
+        lines = [
+            "# HELP gpn_chat_span_duration_seconds The duration of the spans.",
+            "# TYPE gpn_chat_span_duration_seconds histogram",
+        ]
+        for name, histogram in sorted(durations.items()):
+            snapshot = histogram.snapshot()
+            span = f'span="{_escape(name)}"'
+            for bound, count in snapshot["buckets"].items():
+                bound = "+Inf" if bound == math.inf else repr(float(bound))
+                lines.append(
+                    f'gpn_chat_span_duration_seconds_bucket{{{span},le="{bound}"}} {count}'
+                )
+            lines.append(
+                f"gpn_chat_span_duration_seconds_sum{{{span}}} {snapshot['sum']}"
+            )
+            lines.append(
+                f"gpn_chat_span_duration_seconds_count{{{span}}} {snapshot['count']}"
+            )
+
+        lines += [
+            "# HELP gpn_chat_span_counter_total The sum of the counters of the spans.",
+            "# TYPE gpn_chat_span_counter_total counter",
+        ]
+        for (name, counter), value in sorted(counters.items()):
+            lines.append(
+                f'gpn_chat_span_counter_total{{span="{_escape(name)}",counter="{_escape(counter)}"}} {value}'
+            )
+
+        lines += [
+            "# HELP gpn_chat_span_errors_total The number of failed spans.",
+            "# TYPE gpn_chat_span_errors_total counter",
+        ]
+        for name, count in sorted(errors.items()):
+            lines.append(
+                f'gpn_chat_span_errors_total{{span="{_escape(name)}"}} {count}'
+            )
+
+        return "\n".join(lines) + "\n"
+
+    def serve(self, host: str, port: int) -> ThreadingHTTPServer:
+        """
+        Serves the metrics on `/metrics` from a background thread.
+
+        :param host: The host to listen on.
+        :param port: The port to listen on.
+        :return: The server, call `shutdown()` on it to stop it.
+        """
+        sink = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+
+                body = sink.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *arguments: object) -> None:
+                sink.log.debug(format % arguments)
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(
+            target=server.serve_forever, name="PrometheusSink", daemon=True
+        ).start()
+        self.log.info(f"Serving the metrics on http://{host}:{port}/metrics")
+
+        return server
@@ -0,0 +1,91 @@
+from typing import Any, Optional
+
+from haystack import Document, component, default_to_dict
+from haystack_integrations.document_stores.qdrant import QdrantDocumentStore
+from haystack_integrations.document_stores.qdrant.converters import (
+    convert_qdrant_point_to_haystack_document,
+)
+from haystack_integrations.document_stores.qdrant.filters import (
+    convert_filters_to_qdrant,
+)
+from qdrant_client.http import models as rest
+
+from source.query_analyzer import talk_ids_of_filters
+
+
+@component
+class QdrantSearchRetriever:
+    """
+    Retrieves the documents that are the most similar to a query embedding from a `QdrantDocumentStore`. Unlike the
+    `QdrantEmbeddingRetriever` it passes search parameters to Qdrant, e.g. the size of the HNSW candidate list (`ef`)
+    and whether the candidates found with quantized vectors are oversampled and rescored with the original vectors.
+
+    Filters on the talks (see `talk_ids_of_filters()`) are passed to Qdrant as an exact match on any of the talk IDs,
+    which uses the keyword payload index of `meta.talk_id`. Haystack converts string values without spaces into a
+    full-text match, so a filter on the talk "Keynote" would also return the talk "Keynote 2". Other filters are
+    converted by Haystack.
+
+    :param document_store: The store to search.
+    :param top_k: The maximum number of documents to return.
+    :param search_params: The search parameters passed to Qdrant with every query, None for Qdrant's defaults.
+    """
+
+    def __init__(
+        self,
+        document_store: QdrantDocumentStore,
+        top_k: int = 10,
+        search_params: Optional[rest.SearchParams] = None,
+    ):
+        self.document_store = document_store
+        self.top_k = top_k
+        self.search_params = search_params
+
+    def to_dict(self) -> dict[str, Any]:
+        return default_to_dict(
+            self,
+            document_store=self.document_store.to_dict(),
+            top_k=self.top_k,
+            search_params=(
+                self.search_params.model_dump(exclude_none=True)
+                if self.search_params
+                else None
+            ),
+        )
+
+    @staticmethod
+    def _convert_filters(filters: Optional[dict[str, Any]]) -> Optional[rest.Filter]:
+        talk_ids = talk_ids_of_filters(filters)
+        if talk_ids is None:
+            return convert_filters_to_qdrant(filters)
+
+        return rest.Filter(
+            must=[
+                rest.FieldCondition(
+                    key="meta.talk_id", match=rest.MatchAny(any=talk_ids)
+                )
+            ]
+        )
+
+    @component.output_types(documents=list[Document])
+    def run(
+        self,
+        query_embedding: list[float],
+        top_k: Optional[int] = None,
+        filters: Optional[dict[str, Any]] = None,
+    ) -> dict[str, list[Document]]:
+        points = self.document_store.client.query_points(
+            collection_name=self.document_store.index,
+            query=query_embedding,
+            query_filter=self._convert_filters(filters),
+            search_params=self.search_params,
+            limit=top_k or self.top_k,
+        ).points
+
+        documents = [
+            convert_qdrant_point_to_haystack_document(
+                point, use_sparse_embeddings=self.document_store.use_sparse_embeddings
+            )
+            for point in points
+        ]
+
+        return {"documents": documents}
@@ -0,0 +1,152 @@
+import json
+import os
+import re
+from typing import Any, Optional
+
+from source.atomic_file_writer import AtomicFileWriter
+from source.corpus_catalog import CorpusCatalog
+from source.git_root_finder import GitRootFinder
+from source.logger import LoggerMixin
+
+GPN_EDITION = re.compile(r"\bgpn\s*-?\s*(\d{1,2})\b", re.IGNORECASE)
+NON_WORD = re.compile(r"\W+")
+# Shorter names and titles would match ordinary words of a question
+MINIMUM_SPEAKER_LENGTH = 4
+MINIMUM_TITLE_LENGTH = 12
+
+
+def _normalize(text: str) -> str:
+    return f" {NON_WORD.sub(' ', text.lower()).strip()} "
+
+
+def talk_ids_of_filters(filters: Optional[dict[str, Any]]) -> Optional[list[str]]:
+    """
+    Lets the document stores answer the filters of the `QueryAnalyzer` by the talk IDs of the chunks.
+
+    :param filters: Haystack filters on the documents.
+    :return: The talks the filters select if they only compare `meta.talk_id` with "==" or "in", None otherwise.
+    """
+    if not filters or filters.get("field") != "meta.talk_id":
+        return None
+    if filters.get("operator") == "==":
+        return [filters["value"]]
+    if filters.get("operator") == "in":
+        return list(filters["value"])
+
+    return None
+
+
+class QueryAnalyzer(LoggerMixin):
+    """
+    Recognizes the GPN editions (e.g. "GPN21"), speaker names and talk titles mentioned in a question and turns them
+    into a filter on the talks, so the retrievers only search the talks the question is about.
+
+    The names are looked up in `data/query_lookup.json`, which `build_lookup()` writes from the metadata of the indexed
+    talks at the end of every indexing run. The lookup is loaded again once the file changed.
+
+    The talks of every kind of mention are combined: "speaker X at GPN21" selects the talks of X at GPN21, two speakers
+    select the talks of both. If no talk fits all mentions, the question is not filtered.
+
+    :param lookup_path: The path of the lookup. Defaults to `data/query_lookup.json`.
+    """
+
+    def __init__(self, lookup_path: str = None):
+        super().__init__()
+
+        if lookup_path is None:
+            lookup_path = os.path.join(GitRootFinder.get(), "data", "query_lookup.json")
+        self.lookup_path = lookup_path
+
+        self._lookup_version = None
+        self._talks_by_gpn = {}
+        self._talks_by_speaker = {}
+        self._talks_by_title = {}
+
+    @staticmethod
+    def build_lookup(
+        catalog: CorpusCatalog, talk_ids: list[str], lookup_path: str = None
+    ) -> None:
+        """
+        Writes the edition, speakers and title of every talk to the lookup.
+
+        :param catalog: The catalog of the corpus.
+        :param talk_ids: The indexed talks.
+        :param lookup_path: The path of the lookup. Defaults to `data/query_lookup.json`.
+        :return: None
+        """
+        if lookup_path is None:
+            lookup_path = os.path.join(GitRootFinder.get(), "data", "query_lookup.json")
+
+        lookup = {}
+        for talk_id in talk_ids:
+            metadata = catalog.get_metadata(talk_id) or {}
+            lookup[talk_id] = {
+                "gpn": metadata.get("gpn"),
+                "speakers": metadata.get("speakers", []),
+                "title": metadata.get("title", talk_id),
+            }
+
+        AtomicFileWriter.write(lookup_path, json.dumps(lookup, ensure_ascii=False))
+
+    def _load_lookup_if_changed(self) -> None:
+        try:
+            stat = os.stat(self.lookup_path)
+        except FileNotFoundError:
+            return
+        if (stat.st_mtime_ns, stat.st_size) == self._lookup_version:
+            return
+
+        with open(self.lookup_path, mode="r", encoding="utf-8") as file:
+            lookup = json.load(file)
+
+        talks_by_gpn, talks_by_speaker, talks_by_title = {}, {}, {}
+        for talk_id, talk in lookup.items():
+            if talk["gpn"]:
+                talks_by_gpn.setdefault(talk["gpn"].lower(), set()).add(talk_id)
+            for speaker in talk["speakers"]:
+                if len(speaker) >= MINIMUM_SPEAKER_LENGTH:
+                    talks_by_speaker.setdefault(_normalize(speaker), set()).add(talk_id)
+            if len(talk["title"]) >= MINIMUM_TITLE_LENGTH:
+                talks_by_title.setdefault(_normalize(talk["title"]), set()).add(talk_id)
+
+        # Replacing the dictionaries at once keeps concurrent calls of analyze() consistent
+        self._talks_by_gpn = talks_by_gpn
+        self._talks_by_speaker = talks_by_speaker
+        self._talks_by_title = talks_by_title
+        self._lookup_version = (stat.st_mtime_ns, stat.st_size)
+        self.log.debug(f"Loaded the lookup of {len(lookup)} talks")
+
+    def analyze(self, query: str) -> Optional[dict[str, Any]]:
+        """
+        :param query: The question of the user.
+        :return: A Haystack filter on `meta.talk_id` or None if the question mentions no edition, speaker or title.
+        """
+        self._load_lookup_if_changed()
+
+        normalized_query = _normalize(query)
+        mentioned_talks = []
+        gpn_talks = set()
+        for edition in GPN_EDITION.findall(query):
+            gpn_talks |= self._talks_by_gpn.get(f"gpn{edition}", set())
+        speaker_talks = set()
+        for speaker, talk_ids in self._talks_by_speaker.items():
+            if speaker in normalized_query:
+                speaker_talks |= talk_ids
+        title_talks = set()
+        for title, talk_ids in self._talks_by_title.items():
+            if title in normalized_query:
+                title_talks |= talk_ids
+
+        for talks in (gpn_talks, speaker_talks, title_talks):
+            if talks:
+                mentioned_talks.append(talks)
+        if not mentioned_talks:
+            return None
+
+        talk_ids = set.intersection(*mentioned_talks)
+        if not talk_ids:
+            self.log.debug("No talk fits all mentions of the question, not filtering")
+            return None
+
+        self.log.info(f"Restricting the search to {len(talk_ids)} talks")
+        return {"field": "meta.talk_id", "operator": "in", "value": sorted(talk_ids)}
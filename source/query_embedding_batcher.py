@@ -0,0 +1,137 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from haystack import Document
+from haystack.components.embedders import SentenceTransformersDocumentEmbedder
+
+from source.histogram import Histogram
+from source.logger import LoggerMixin
+
+
+class QueryEmbeddingBatcher(LoggerMixin):
+    """
+    Embeds queries that arrive at the same time in one forward pass of the model. Embedding a single short query on the
+    CPU is dominated by the overhead per call, so under load batching increases the throughput considerably.
+
+    `run()` can be called from multiple threads. The first waiting query opens a window of `window` seconds in which
+    further queries are collected, up to `max_batch_size` queries. A worker thread then embeds all of them with the
+    wrapped embedder and hands every caller its embedding. The batch sizes and the time the queries waited for their
+    batch are counted in histograms, which are logged every `report_interval` seconds, so the window can be tuned
+    between throughput and added latency.
+
+    It can be used in place of a `SentenceTransformersTextEmbedder`.
+
+    :param embedder: The embedder that embeds the batches. Its batch size should be at least `max_batch_size`.
+    :param window: The amount of seconds the first query of a batch waits for further queries.
+    :param max_batch_size: The maximum number of queries embedded at once.
+    :param report_interval: The amount of seconds between two log messages with the histograms.
+    """
+
+    BATCH_SIZE_BOUNDS = (1, 2, 4, 8, 16, 32, 64, 128)
+    QUEUE_WAIT_BOUNDS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25)
+
+    def __init__(
+        self,
+        embedder: SentenceTransformersDocumentEmbedder,
+        window: float = 0.005,
+        max_batch_size: int = 32,
+        report_interval: float = 60,
+    ):
+        super().__init__()
+
+        self.embedder = embedder
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.report_interval = report_interval
+
+        self.batch_sizes = Histogram(self.BATCH_SIZE_BOUNDS)
+        self.queue_waits = Histogram(self.QUEUE_WAIT_BOUNDS)
+
+        self._queries = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._last_report = time.monotonic()
+
+    def warm_up(self) -> None:
+        """
+        Loads the model and starts the worker thread.
+
+        :return: None
+        """
+        with self._lock:
+            if self._worker is not None:
+                return
+
+            self.embedder.warm_up()
+            self._worker = threading.Thread(
+                target=self._embed_batches, name="QueryEmbeddingBatcher", daemon=True
+            )
+            self._worker.start()
+
+    def run(self, text: str) -> dict[str, list[float]]:
+        """
+        :param text: The query to embed.
+        :return: The embedding of the query.
+        """
+        self.warm_up()
+
+        future = Future()
+        self._queries.put((text, time.perf_counter(), future))
+
+        return {"embedding": future.result()}
+
+    def _collect_batch(self) -> list[tuple[str, float, Future]]:
+        """
+        Waits for a query and collects the queries that arrive within the window after it.
+
+        :return: The queries of the batch with the time they were queued and their futures.
+        """
+        batch = [self._queries.get()]
+        deadline = batch[0][1] + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining > 0:
+                    batch.append(self._queries.get(timeout=remaining))
+                else:
+                    # Queries that are already waiting join the batch even after the window closed
+                    batch.append(self._queries.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _embed_batches(self) -> None:
+        while True:
+            batch = self._collect_batch()
+
+            start = time.perf_counter()
+            for _, queued_at, _ in batch:
+                self.queue_waits.observe(start - queued_at)
+            self.batch_sizes.observe(len(batch))
+
+            try:
+                documents = self.embedder.run(
+                    documents=[Document(content=text) for text, _, _ in batch]
+                )["documents"]
+            except Exception as error:
+                for _, _, future in batch:
+                    future.set_exception(error)
+                continue
+
+            for (_, _, future), document in zip(batch, documents):
+                future.set_result(document.embedding)
+
+            self._report_if_due()
+
+    def _report_if_due(self) -> None:
+        if time.monotonic() - self._last_report < self.report_interval:
+            return
+
+        self._last_report = time.monotonic()
+        self.log.info(
+            f"Batch sizes: {self.batch_sizes.summary()}; "
+            f"queue waits: {self.queue_waits.summary(unit='s')}"
+        )
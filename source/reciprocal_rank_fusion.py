@@ -0,0 +1,49 @@
+from haystack import Document, component
+
+
+@component
+class ReciprocalRankFusion:
+    """
+    Fuses the results of the dense and the sparse retriever. Every document scores `weight / (k + rank)` in each list
+    it appears in, so documents that are ranked high by both retrievers come first. The scores of the retrievers
+    themselves are not comparable and are ignored.
+
+    :param dense_weight: The weight of the ranks of the dense retriever.
+    :param sparse_weight: The weight of the ranks of the sparse retriever.
+    :param top_k: The number of fused documents to return.
+    :param k: Dampens the influence of the top ranks, 60 is the value of the original paper.
+    """
+
+    def __init__(
+        self,
+        dense_weight: float = 1.0,
+        sparse_weight: float = 1.0,
+        top_k: int = 10,
+        k: int = 60,
+    ):
+        self.dense_weight = dense_weight
+        self.sparse_weight = sparse_weight
+        self.top_k = top_k
+        self.k = k
+
+    @component.output_types(documents=list[Document])
+    def run(
+        self, dense_documents: list[Document], sparse_documents: list[Document]
+    ) -> dict[str, list[Document]]:
+        scores = {}
+        documents = {}
+        for weight, ranked_documents in (
+            (self.dense_weight, dense_documents),
+            (self.sparse_weight, sparse_documents),
+        ):
+            for rank, document in enumerate(ranked_documents, start=1):
+                scores[document.id] = scores.get(document.id, 0.0) + weight / (
+                    self.k + rank
+                )
+                documents.setdefault(document.id, document)
+
+        best_ids = sorted(scores, key=scores.get, reverse=True)[: self.top_k]
+        for document_id in best_ids:
+            documents[document_id].score = scores[document_id]
+
+        return {"documents": [documents[document_id] for document_id in best_ids]}
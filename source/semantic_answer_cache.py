@@ -0,0 +1,169 @@
+import os
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+from haystack import Document
+
+from source.git_root_finder import GitRootFinder
+from source.logger import LoggerMixin
+
+
+class SemanticAnswerCache(LoggerMixin):
+    """
+    Keeps the answers to recent questions in memory together with the embeddings of the questions and the documents
+    the answers are based on. A question whose embedding is at least as similar as `similarity_threshold` (cosine
+    similarity) to the embedding of a cached question gets the cached answer, so rephrased questions do not run the
+    retrieval and the LLM again. An answer is only shared between questions with the same filters, e.g. a question
+    about a talk at GPN21 never gets the answer to the same question about GPN22.
+
+    Answers expire after `ttl` seconds and the oldest answer is evicted once more than `max_size` answers are cached.
+    The indexing pipeline rewrites `data/index_state.json` whenever the index changes, so all answers are dropped once
+    that file changes.
+
+    All methods are thread safe.
+
+    :param similarity_threshold: The minimum cosine similarity of two questions to share an answer.
+    :param ttl: The amount of seconds an answer is kept.
+    :param max_size: The maximum number of cached answers.
+    :param index_state_path: The file whose changes invalidate the cache. Defaults to `data/index_state.json`.
+    """
+
+    def __init__(
+        self,
+        similarity_threshold: float = 0.95,
+        ttl: float = 3600,
+        max_size: int = 256,
+        index_state_path: str = None,
+    ):
+        super().__init__()
+
+        if index_state_path is None:
+            index_state_path = os.path.join(
+                GitRootFinder.get(), "data", "index_state.json"
+            )
+        self.index_state_path = index_state_path
+        self.similarity_threshold = similarity_threshold
+        self.ttl = ttl
+        self.max_size = max_size
+
+        self._lock = threading.Lock()
+        self._index_version = self._get_index_version()
+        self._clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._answers)
+
+    def _clear(self) -> None:
+        self._embeddings = np.empty((0, 0), dtype=np.float32)
+        self._answers = []
+        self._filters = []
+        self._created_at = []
+
+    def _get_index_version(self) -> Optional[tuple[int, int]]:
+        """
+        :return: The modification time and size of the index state, None if the index was never built.
+        """
+        try:
+            stat = os.stat(self.index_state_path)
+        except FileNotFoundError:
+            return None
+
+        return stat.st_mtime_ns, stat.st_size
+
+    def _drop_stale_answers(self) -> None:
+        """
+        Drops all answers if the index changed and the expired answers otherwise. Must be called with the lock held.
+
+        :return: None
+        """
+        index_version = self._get_index_version()
+        if index_version != self._index_version:
+            if self._answers:
+                self.log.info("The index changed, dropping all cached answers")
+            self._index_version = index_version
+            self._clear()
+            return
+
+        # The answers are ordered by their creation, so the expired ones are at the start
+        now = time.monotonic()
+        expired = 0
+        while (
+            expired < len(self._answers) and now - self._created_at[expired] > self.ttl
+        ):
+            expired += 1
+        if expired:
+            self._remove_oldest(expired)
+
+    def _remove_oldest(self, count: int) -> None:
+        self._embeddings = self._embeddings[count:]
+        self._answers = self._answers[count:]
+        self._filters = self._filters[count:]
+        self._created_at = self._created_at[count:]
+
+    @staticmethod
+    def _normalize(embedding: list[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1)
+
+    def get(
+        self, embedding: list[float], filters: Optional[dict] = None
+    ) -> Optional[tuple[str, list[Document]]]:
+        """
+        :param embedding: The embedding of a question.
+        :param filters: The filters the documents of the question are retrieved with.
+        :return: The answer and the source documents of the most similar cached question with the same filters or None
+        if no such question is similar enough.
+        """
+        query = self._normalize(embedding)
+        with self._lock:
+            self._drop_stale_answers()
+            if not self._answers:
+                return None
+
+            similarities = self._embeddings @ query
+            similarities[
+                [cached_filters != filters for cached_filters in self._filters]
+            ] = -np.inf
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.similarity_threshold:
+                return None
+
+            self.log.debug(
+                f"Found a cached answer with a similarity of {similarities[best]:.3f}"
+            )
+            return self._answers[best]
+
+    def put(
+        self,
+        embedding: list[float],
+        answer: str,
+        sources: list[Document],
+        filters: Optional[dict] = None,
+    ) -> None:
+        """
+        Caches the answer to a question.
+
+        :param embedding: The embedding of the question.
+        :param answer: The generated answer.
+        :param sources: The documents the answer is based on.
+        :param filters: The filters the documents were retrieved with.
+        :return: None
+        """
+        if self.max_size <= 0:
+            return
+
+        vector = self._normalize(embedding)
+        with self._lock:
+            self._drop_stale_answers()
+            if not self._answers:
+                self._embeddings = np.empty((0, len(vector)), dtype=np.float32)
+
+            self._embeddings = np.vstack([self._embeddings, vector])
+            self._answers.append((answer, sources))
+            self._filters.append(filters)
+            self._created_at.append(time.monotonic())
+            if len(self._answers) > self.max_size:
+                self._remove_oldest(len(self._answers) - self.max_size)
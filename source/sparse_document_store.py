@@ -0,0 +1,233 @@
+import json
+import os
+import re
+import sqlite3
+from contextlib import closing, contextmanager
+from typing import Any, Iterator, Optional
+
+from haystack import Document, default_from_dict, default_to_dict
+from haystack.document_stores.errors import DuplicateDocumentError
+from haystack.document_stores.types import DuplicatePolicy
+from haystack.utils.filters import document_matches_filter
+
+from source.git_root_finder import GitRootFinder
+from source.logger import LoggerMixin
+from source.query_analyzer import talk_ids_of_filters
+
+# The words of a query, everything else (e.g. punctuation) would be interpreted by the FTS5 query syntax
+QUERY_TERM = re.compile(r"\w+")
+
+
+class SparseDocumentStore(LoggerMixin):
+    """
+    A BM25 index over the chunks, stored in a SQLite database with a FTS5 full-text index. It finds exact terms like
+    names of speakers, projects and acronyms, which dense embeddings tend to miss.
+
+    The chunks are stored in a regular table (with their talk, so the chunks of a talk can be found quickly) that
+    serves as the external content of the FTS5 index. Triggers keep the index in sync with the table.
+
+    :param index_path: The path of the database. Defaults to `data/sparse_index.sqlite`.
+    :param recreate_index: Whether to delete all chunks of an existing index.
+    """
+
+    def __init__(self, index_path: str = None, recreate_index: bool = False):
+        super().__init__()
+
+        if index_path is None:
+            index_path = os.path.join(
+                GitRootFinder.get(), "data", "sparse_index.sqlite"
+            )
+        self.index_path = index_path
+
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS chunks (
+                    rowid INTEGER PRIMARY KEY,
+                    id TEXT NOT NULL UNIQUE,
+                    talk_id TEXT,
+                    content TEXT,
+                    meta TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS chunks_by_talk ON chunks (talk_id);
+                CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5 (
+                    content, content='chunks', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2'
+                );
+                CREATE TRIGGER IF NOT EXISTS chunks_inserted AFTER INSERT ON chunks BEGIN
+                    INSERT INTO chunks_fts (rowid, content) VALUES (new.rowid, new.content);
+                END;
+                CREATE TRIGGER IF NOT EXISTS chunks_deleted AFTER DELETE ON chunks BEGIN
+                    INSERT INTO chunks_fts (chunks_fts, rowid, content) VALUES ('delete', old.rowid, old.content);
+                END;
+                """
+            )
+            if recreate_index:
+                connection.execute("DELETE FROM chunks")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """
+        Opens a connection and commits the transaction when the block is left without an error.
+        """
+        with closing(sqlite3.connect(self.index_path, timeout=60)) as connection:
+            with connection:
+                yield connection
+
+    @staticmethod
+    def _to_document(
+        document_id: str, content: str, meta: str, score: float = None
+    ) -> Document:
+        return Document(
+            id=document_id, content=content, meta=json.loads(meta), score=score
+        )
+
+    def count_documents(self) -> int:
+        with self._connect() as connection:
+            return connection.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def filter_documents(
+        self, filters: Optional[dict[str, Any]] = None
+    ) -> list[Document]:
+        """
+        :param filters: Haystack filters on the documents. A filter on `meta.talk_id` with "==" or "in" is answered
+        with the index of the talks.
+        :return: All documents matching the filters.
+        """
+        with self._connect() as connection:
+            talk_ids = talk_ids_of_filters(filters)
+            if talk_ids is not None:
+                placeholders = ", ".join("?" * len(talk_ids))
+                rows = connection.execute(
+                    f"SELECT id, content, meta FROM chunks WHERE talk_id IN ({placeholders})",
+                    talk_ids,
+                )
+                return [self._to_document(*row) for row in rows]
+
+            documents = [
+                self._to_document(*row)
+                for row in connection.execute("SELECT id, content, meta FROM chunks")
+            ]
+
+        if not filters:
+            return documents
+
+        return [
+            document
+            for document in documents
+            if document_matches_filter(filters, document)
+        ]
+
+    def write_documents(
+        self, documents: list[Document], policy: DuplicatePolicy = DuplicatePolicy.NONE
+    ) -> int:
+        """
+        :param documents: The documents to index.
+        :param policy: How to handle documents whose ID already exists. `NONE` behaves like `FAIL`.
+        :return: The number of written documents.
+        """
+        with self._connect() as connection:
+            existing_ids = {
+                document_id
+                for (document_id,) in connection.execute("SELECT id FROM chunks")
+            }
+            if policy == DuplicatePolicy.SKIP:
+                documents = [
+                    document
+                    for document in documents
+                    if document.id not in existing_ids
+                ]
+            elif policy != DuplicatePolicy.OVERWRITE:
+                duplicate_ids = [
+                    document.id for document in documents if document.id in existing_ids
+                ]
+                if duplicate_ids:
+                    raise DuplicateDocumentError(
+                        f"Documents with the IDs {duplicate_ids} already exist"
+                    )
+
+            # Deleting the old rows explicitly keeps the full-text index in sync
+            connection.executemany(
+                "DELETE FROM chunks WHERE id = ?",
+                [(document.id,) for document in documents],
+            )
+            connection.executemany(
+                "INSERT INTO chunks (id, talk_id, content, meta) VALUES (?, ?, ?, ?)",
+                [
+                    (
+                        document.id,
+                        document.meta.get("talk_id"),
+                        document.content,
+                        json.dumps(document.meta, ensure_ascii=False),
+                    )
+                    for document in documents
+                ],
+            )
+
+        return len(documents)
+
+    def delete_documents(self, document_ids: list[str]) -> None:
+        """
+        :param document_ids: The IDs of the documents to delete.
+        :return: None
+        """
+        with self._connect() as connection:
+            connection.executemany(
+                "DELETE FROM chunks WHERE id = ?",
+                [(document_id,) for document_id in document_ids],
+            )
+
+    def query_by_bm25(
+        self, query: str, top_k: int = 10, filters: Optional[dict[str, Any]] = None
+    ) -> list[Document]:
+        """
+        Finds the chunks that match the words of the query best according to BM25. A chunk has to contain at least one
+        of the words.
+
+        :param query: The query in natural language.
+        :param top_k: The maximum number of documents to return.
+        :param filters: Haystack filters the documents have to match. Filters on `meta.talk_id` are applied in the
+        database, all others to every matching chunk afterward.
+        :return: The best matching documents with their score, the best first.
+        """
+        terms = QUERY_TERM.findall(query)
+        if not terms:
+            return []
+
+        fts_query = " OR ".join(f'"{term}"' for term in terms)
+        talk_ids = talk_ids_of_filters(filters)
+        talk_condition = ""
+        parameters = [fts_query]
+        if talk_ids is not None:
+            talk_condition = f"AND chunks.talk_id IN ({', '.join('?' * len(talk_ids))})"
+            parameters += talk_ids
+        # Other filters can only be checked on the documents, so no chunk may be cut off before
+        limit = top_k if talk_ids is not None or not filters else -1
+
+        with self._connect() as connection:
+            rows = connection.execute(
+                f"""
+                SELECT chunks.id, chunks.content, chunks.meta, -bm25(chunks_fts) FROM chunks_fts
+                JOIN chunks ON chunks.rowid = chunks_fts.rowid
+                WHERE chunks_fts MATCH ? {talk_condition} ORDER BY bm25(chunks_fts) LIMIT ?
+                """,
+                parameters + [limit],
+            )
+            documents = [self._to_document(*row) for row in rows]
+
+        if limit == -1:
+            documents = [
+                document
+                for document in documents
+                if document_matches_filter(filters, document)
+            ][:top_k]
+
+        return documents
+
+    def to_dict(self) -> dict[str, Any]:
+        return default_to_dict(self, index_path=self.index_path)
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "SparseDocumentStore":
+        return default_from_dict(cls, data)
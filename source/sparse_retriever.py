@@ -0,0 +1,44 @@
+from typing import Any, Optional
+
+from haystack import Document, component, default_from_dict, default_to_dict
+
+from source.sparse_document_store import SparseDocumentStore
+
+
+@component
+class SparseRetriever:
+    """
+    Retrieves the chunks that match the words of a query best according to BM25 from a `SparseDocumentStore`.
+
+    :param document_store: The store to search.
+    :param top_k: The maximum number of documents to return.
+    """
+
+    def __init__(self, document_store: SparseDocumentStore, top_k: int = 10):
+        self.document_store = document_store
+        self.top_k = top_k
+
+    def to_dict(self) -> dict[str, Any]:
+        return default_to_dict(
+            self, document_store=self.document_store.to_dict(), top_k=self.top_k
+        )
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "SparseRetriever":
+        data["init_parameters"]["document_store"] = SparseDocumentStore.from_dict(
+            data["init_parameters"]["document_store"]
+        )
+        return default_from_dict(cls, data)
+
+    @component.output_types(documents=list[Document])
+    def run(
+        self,
+        query: str,
+        top_k: Optional[int] = None,
+        filters: Optional[dict[str, Any]] = None,
+    ) -> dict[str, list[Document]]:
+        documents = self.document_store.query_by_bm25(
+            query=query, top_k=top_k or self.top_k, filters=filters
+        )
+
+        return {"documents": documents}
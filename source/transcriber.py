@@ -1,13 +1,70 @@
 import multiprocessing
 import os
-from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from shutil import which
+from typing import Optional
 
+import numpy as np
+import torch
 import whisper
 from dotenv import load_dotenv
+from haystack import tracing
 
+from source.audio_segmenter import AudioSegmenter
+from source.corpus_catalog import CorpusCatalog
 from source.git_root_finder import GitRootFinder
+from source.instrumentation import Instrumentation
 from source.logger import LoggerMixin
+from source.transcription_checkpoint import TranscriptionCheckpoint
+
+# Every worker of the pool (thread or process) keeps its own model in here, so it is only loaded once per worker
+_worker_state = threading.local()
+
+
+def _initialize_worker(model_name: str, device: str, threads_per_worker: int) -> None:
+    """
+    Initializes a worker of the transcription pool: Limits the number of threads torch may use, so that the workers do
+    not oversubscribe the CPU cores, and loads the Whisper model.
+
+    :param model_name: The name of the Whisper model.
+    :param device: The device to load the model on ("cpu" or "cuda").
+    :param threads_per_worker: The number of threads torch may use in this worker.
+    :return: None
+    """
+    torch.set_num_threads(threads_per_worker)
+    _worker_state.model = whisper.load_model(model_name, device=device)
+    Instrumentation().enable(serve_metrics=False)
+
+
+def _get_worker_model() -> whisper.Whisper:
+    """
+    :return: The Whisper model of the current worker.
+    """
+    return _worker_state.model
+
+
+def _transcribe_audio(audio: np.ndarray, offset: float, fp16: bool) -> list[dict]:
+    """
+    Transcribes a segment of an audio file with the model of the current worker.
+
+    :param audio: A segment of audio as returned by `whisper.load_audio()`.
+    :param offset: The position of the audio within the talk in seconds. It is added to the timestamps.
+    :param fp16: Whether to run the model in half precision, which is only supported on GPUs.
+    :return: The transcribed segments with their text, start, end and language.
+    """
+    result = _get_worker_model().transcribe(audio, fp16=fp16)
+
+    return [
+        {
+            "text": segment["text"],
+            "start": round(offset + segment["start"], 2),
+            "end": round(offset + segment["end"], 2),
+            "language": result["language"],
+        }
+        for segment in result["segments"]
+    ]
 
 
 class Transcriber(LoggerMixin):
@@ -18,13 +75,36 @@ class Transcriber(LoggerMixin):
     Whisper models.
     :param max_cores: The maximum number of CPU cores to use for the transcription process.
     :param overwrite: A flag indicating whether existing transcriptions should be overwritten.
+    :param device: The device to run the model on ("cpu" or "cuda"). Defaults to "cuda" if it is available.
+    :param pool: Whether the workers are processes ("process") or threads ("thread"). Processes do not contend for
+    the GIL, threads share the memory of one process.
+    :param threads_per_worker: The number of threads torch may use in each worker. The number of workers is
+    `max_cores // threads_per_worker`.
+    :param segment_length: If set, each talk is cut into segments of roughly this many seconds at silent positions.
+    The segments of a talk are transcribed in parallel and stitched back together in order. Otherwise, each talk is
+    transcribed by a single worker and only different talks are transcribed in parallel.
+
+    While a talk is transcribed, the transcribed segments (text, start, end and language) are streamed to a JSONL
+    sidecar in `data/transcription_segments/`. A talk that was interrupted is resumed after the last completed
+    segment, unless its audio file changed since. The text file in `data/transcriptions/` is derived from the sidecar
+    once the talk is finished and is registered in the `CorpusCatalog`.
+
+    Every talk is traced as the span `transcriber.transcribe_file` and the whole run as `transcriber.run`, both with
+    the transcribed audio seconds, see `Instrumentation`.
     """
 
+    # A single worker transcribes its talk in chunks of this many seconds, each chunk is a checkpoint
+    CHECKPOINT_LENGTH = 120.0
+
     def __init__(
         self,
         transcriber_model_name: str = "base",
         max_cores: int = None,
         overwrite: bool = False,
+        device: str = None,
+        pool: str = "process",
+        threads_per_worker: int = 1,
+        segment_length: float = None,
     ):
         super().__init__()
 
@@ -33,6 +113,9 @@ class Transcriber(LoggerMixin):
         self.transcriber_model_name = transcriber_model_name
         self.log.debug(f'Using model "{self.transcriber_model_name}" for transcription')
 
+        self.overwrite = overwrite
+        self.catalog = CorpusCatalog()
+
         self._check_for_ffmpeg()
         self._find_audio_files()
 
@@ -41,7 +124,20 @@ class Transcriber(LoggerMixin):
         else:
             self.max_cores = max_cores
 
-        self.overwrite = overwrite
+        if device is None:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.device = device
+
+        if pool not in ("process", "thread"):
+            raise ValueError(f'Unknown pool "{pool}", use "process" or "thread"')
+        self.pool = pool
+        self.threads_per_worker = threads_per_worker
+        self.number_of_workers = max(1, self.max_cores // threads_per_worker)
+
+        self.parallel_segments = segment_length is not None
+        self.segmenter = AudioSegmenter(
+            segment_length=segment_length or self.CHECKPOINT_LENGTH
+        )
 
     @staticmethod
     def _check_for_ffmpeg() -> None:
@@ -55,7 +151,7 @@ class Transcriber(LoggerMixin):
 
     def _find_audio_files(self) -> None:
         """
-        This method is used to find audio files in a specific directory and set the input and output directories for audio processing.
+        This method is used to look up the audio files that are not transcribed yet in the corpus catalog and set the input and output directories for audio processing.
 
         :return: None
         """
@@ -64,41 +160,204 @@ class Transcriber(LoggerMixin):
         self.transcription_output_directory = os.path.join(
             data_directory, "transcriptions"
         )
+        self.checkpoint_directory = os.path.join(
+            data_directory, "transcription_segments"
+        )
 
-        if not os.path.exists(self.transcription_output_directory):
-            os.makedirs(self.transcription_output_directory)
+        os.makedirs(self.transcription_output_directory, exist_ok=True)
+        os.makedirs(self.checkpoint_directory, exist_ok=True)
 
-        self.all_audio_files = sorted(os.listdir(self.audio_input_directory))
+        # Only completely downloaded audio files are in the catalog
+        self.all_audio_files = [
+            f"{talk_id}.mp3"
+            for talk_id in self.catalog.talks_with_files(
+                "audio", without_stage=None if self.overwrite else "transcribed"
+            )
+        ]
         self.number_of_audio_files = len(self.all_audio_files)
         self.log.debug(
             f"Found audio files ({self.number_of_audio_files}): {self.all_audio_files}"
         )
 
-    def transcribe_file(self, filename: str) -> None:
+    def _get_output_file_path(self, filename: str) -> str:
         """
-        Transcribes an audio file and saves the transcription to a text file.
-
-        :param filename: The name of the audio file to transcribe.
-        :return: None
+        :param filename: The name of an audio file.
+        :return: The path of the transcription of the audio file.
         """
-        input_file_path = os.path.join(self.audio_input_directory, filename)
         output_file_name = filename.replace(".mp3", ".txt")
-        output_file_path = os.path.join(
-            self.transcription_output_directory, output_file_name
+        return os.path.join(self.transcription_output_directory, output_file_name)
+
+    def _get_checkpoint(self, filename: str) -> TranscriptionCheckpoint:
+        """
+        :param filename: The name of an audio file.
+        :return: The checkpoint of the transcription of the audio file.
+        """
+        checkpoint_file_name = filename.replace(".mp3", ".jsonl")
+        return TranscriptionCheckpoint(
+            os.path.join(self.checkpoint_directory, checkpoint_file_name),
+            os.path.join(self.audio_input_directory, filename),
         )
-        if os.path.exists(output_file_path) and not self.overwrite:
-            self.log.debug("Transcription already exists, skipping file...")
-            return
 
-        model = whisper.load_model(self.transcriber_model_name, device="cuda")
+    def _prepare(
+        self, filename: str, checkpoint: TranscriptionCheckpoint
+    ) -> Optional[list[tuple[float, np.ndarray]]]:
+        """
+        Determines which parts of an audio file still have to be transcribed.
+
+        :param filename: The name of the audio file.
+        :param checkpoint: The checkpoint of the transcription of the audio file.
+        :return: The segments of the audio that are not transcribed yet, each as a tuple of its start in seconds and
+        its audio. None if the file does not have to be transcribed.
+        """
+        output_file_path = self._get_output_file_path(filename)
+        if os.path.exists(output_file_path):
+            if not self.overwrite:
+                self.log.debug("Transcription already exists, skipping file...")
+                return None
+            checkpoint.reset()
+
+        audio = whisper.load_audio(os.path.join(self.audio_input_directory, filename))
+
+        resume_position = checkpoint.resume_position()
+        if resume_position:
+            self.log.info(f'Resuming "{filename}" at {resume_position:.0f}s')
+        resume_sample = int(resume_position * whisper.audio.SAMPLE_RATE)
 
-        self.log.info(f'Starting transcribing "{filename}"')
-        transcription = model.transcribe(input_file_path)["text"]
+        return [
+            (resume_position + offset, audio_segment)
+            for offset, audio_segment in self.segmenter.split(audio[resume_sample:])
+        ]
 
-        with open(output_file_path, "w", encoding="utf-8") as text_file:
-            text_file.write(transcription)
+    def discard_transcription(self, filename: str) -> None:
+        """
+        Removes the transcription and the checkpoint of an audio file and marks the talk as not transcribed in the
+        catalog, so the file is transcribed from scratch, e.g. after it was downloaded again.
+
+        :param filename: The name of the audio file.
+        :return: None
+        """
+        output_file_path = self._get_output_file_path(filename)
+        if os.path.exists(output_file_path):
+            os.remove(output_file_path)
+        self._get_checkpoint(filename).reset()
+        self.catalog.discard_transcription(filename.removesuffix(".mp3"))
+
+    def _finish(self, filename: str, checkpoint: TranscriptionCheckpoint) -> None:
+        checkpoint.write_transcription(self._get_output_file_path(filename))
+        self.catalog.register_transcription(filename.removesuffix(".mp3"))
         self.log.info(f'Finished transcribing "{filename}"')
 
+    @staticmethod
+    def _end_of(offset: float, audio_segment: np.ndarray) -> float:
+        return round(offset + len(audio_segment) / whisper.audio.SAMPLE_RATE, 2)
+
+    @staticmethod
+    def _audio_seconds(audio_segments: list[tuple[float, np.ndarray]]) -> float:
+        return sum(
+            len(audio_segment) / whisper.audio.SAMPLE_RATE
+            for _, audio_segment in audio_segments
+        )
+
+    def initialize_worker(self) -> None:
+        """
+        Loads the model into the current thread, so it can call `transcribe_file()` outside of the pool of workers.
+
+        :return: None
+        """
+        _initialize_worker(
+            self.transcriber_model_name, self.device, self.threads_per_worker
+        )
+
+    def transcribe_file(self, filename: str) -> float:
+        """
+        Transcribes an audio file chunk by chunk and saves the transcription to a text file. This runs inside a worker.
+
+        :param filename: The name of the audio file to transcribe.
+        :return: The amount of seconds of audio that were transcribed.
+        """
+        with tracing.tracer.trace("transcriber.transcribe_file") as span:
+            checkpoint = self._get_checkpoint(filename)
+            audio_segments = self._prepare(filename, checkpoint)
+            if audio_segments is None:
+                return 0.0
+
+            self.log.info(f'Starting transcribing "{filename}"')
+            for offset, audio_segment in audio_segments:
+                segments = _transcribe_audio(
+                    audio_segment, offset, self.device == "cuda"
+                )
+                checkpoint.append(segments, self._end_of(offset, audio_segment))
+
+            self._finish(filename, checkpoint)
+            audio_seconds = self._audio_seconds(audio_segments)
+            span.set_tag("segments", len(audio_segments))
+            span.set_tag("audio_seconds", audio_seconds)
+
+        return audio_seconds
+
+    def transcribe_file_in_segments(self, filename: str, executor: Executor) -> float:
+        """
+        Cuts an audio file into segments at silent positions, transcribes the segments in parallel on the workers and
+        saves the stitched transcription to a text file. The segments are written to the checkpoint in order as soon as
+        they are available.
+
+        :param filename: The name of the audio file to transcribe.
+        :param executor: The pool of workers.
+        :return: The amount of seconds of audio that were transcribed.
+        """
+        with tracing.tracer.trace("transcriber.transcribe_file") as span:
+            checkpoint = self._get_checkpoint(filename)
+            audio_segments = self._prepare(filename, checkpoint)
+            if audio_segments is None:
+                return 0.0
+
+            self.log.info(
+                f'Starting transcribing "{filename}" in {len(audio_segments)} segments'
+            )
+            transcribed_segments = executor.map(
+                _transcribe_audio,
+                [audio_segment for _, audio_segment in audio_segments],
+                [offset for offset, _ in audio_segments],
+                [self.device == "cuda"] * len(audio_segments),
+            )
+            for (offset, audio_segment), segments in zip(
+                audio_segments, transcribed_segments
+            ):
+                checkpoint.append(segments, self._end_of(offset, audio_segment))
+
+            self._finish(filename, checkpoint)
+            audio_seconds = self._audio_seconds(audio_segments)
+            span.set_tag("segments", len(audio_segments))
+            span.set_tag("audio_seconds", audio_seconds)
+
+        return audio_seconds
+
+    def _create_executor(self) -> Executor:
+        """
+        Creates the pool of workers. Each worker loads the model once when it is started and keeps it.
+
+        :return: The pool of workers.
+        """
+        initializer_arguments = (
+            self.transcriber_model_name,
+            self.device,
+            self.threads_per_worker,
+        )
+        if self.pool == "thread":
+            return ThreadPoolExecutor(
+                max_workers=self.number_of_workers,
+                initializer=_initialize_worker,
+                initargs=initializer_arguments,
+            )
+
+        # CUDA can not be used in forked processes
+        return ProcessPoolExecutor(
+            max_workers=self.number_of_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_initialize_worker,
+            initargs=initializer_arguments,
+        )
+
     def start(self) -> None:
         """
         Starts the transcription process for audio files using multiple CPU cores. This may take a while.
@@ -106,11 +365,30 @@ class Transcriber(LoggerMixin):
         :return: None
         """
         self.log.info(
-            f"Starting to transcribe the {self.number_of_audio_files} audio files using {self.max_cores} workers, this may take a while..."
+            f"Starting to transcribe the {self.number_of_audio_files} audio files using {self.number_of_workers} {self.pool} workers with {self.threads_per_worker} threads each on {self.device}, this may take a while..."
         )
 
-        with ThreadPoolExecutor(max_workers=self.max_cores) as executor:
-            list(executor.map(self.transcribe_file, self.all_audio_files))
+        start = time.perf_counter()
+        with tracing.tracer.trace(
+            "transcriber.run"
+        ) as span, self._create_executor() as executor:
+            if self.parallel_segments:
+                audio_seconds = sum(
+                    self.transcribe_file_in_segments(filename, executor)
+                    for filename in self.all_audio_files
+                )
+            else:
+                audio_seconds = sum(
+                    executor.map(self.transcribe_file, self.all_audio_files)
+                )
+            span.set_tag("files", self.number_of_audio_files)
+            span.set_tag("audio_seconds", audio_seconds)
+
+        duration = time.perf_counter() - start
+        self.log.info(
+            f"Transcribed {audio_seconds:.0f}s of audio in {duration:.0f}s "
+            f"({audio_seconds / duration:.1f} audio seconds per second)"
+        )
 
 
 if __name__ == "__main__":
@@ -1,45 +1,45 @@
-import json
-import os.path
+from typing import Optional
 
 from haystack import Document, component
 
+from source.corpus_catalog import CorpusCatalog
+
 
 @component
 class TranscriptionAndMetadataToDocument:
+    """
+    Loads the transcriptions together with their metadata as documents. The talks and their metadata are looked up in
+    the `CorpusCatalog`, so a talk without a transcription or metadata is never paired with the files of another talk.
+
+    :param catalog: The catalog of the corpus.
+    """
+
+    def __init__(self, catalog: CorpusCatalog):
+        self.catalog = catalog
+
+    def list_talks(self) -> list[str]:
+        """
+        :return: The sorted IDs of all talks that have a transcription and metadata.
+        """
+        return self.catalog.talks_with_files("metadata", "transcription")
+
     @component.output_types(documents=list[Document])
-    def run(self, data_directory: str) -> dict[str, list[Document]]:
-        documents = []
+    def run(self, talk_ids: Optional[list[str]] = None) -> dict[str, list[Document]]:
+        """
+        :param talk_ids: The talks to load. Defaults to all talks, see `list_talks()`.
+        :return: One document per talk.
+        """
+        if talk_ids is None:
+            talk_ids = self.list_talks()
 
-        transcriptions_directory = os.path.join(data_directory, "transcriptions")
-        metadata_directory = os.path.join(data_directory, "metadata")
-
-        transcription_files = [
-            os.path.join(transcriptions_directory, filename)
-            for filename in os.listdir(transcriptions_directory)
-        ]
-        metadata_files = [
-            os.path.join(metadata_directory, filename)
-            for filename in os.listdir(metadata_directory)
-        ]
-
-        metadata_transcription_pairs = list(
-            zip(
-                sorted(transcription_files),
-                sorted(metadata_files),
-            )
-        )
-
-        for transcription_file_name, metadata_file_name in metadata_transcription_pairs:
+        documents = []
+        for talk_id in talk_ids:
             with open(
-                transcription_file_name, "r", encoding="utf-8"
-            ) as transcription_file, open(
-                metadata_file_name, "r", encoding="utf-8"
-            ) as metadata_file:
-                documents.append(
-                    Document(
-                        content=transcription_file.read(),
-                        meta=json.loads(metadata_file.read()),
-                    )
-                )
+                self.catalog.path_of(talk_id, "transcription"), "r", encoding="utf-8"
+            ) as transcription_file:
+                meta = self.catalog.get_metadata(talk_id)
+                # The ID of the talk identifies the talk across runs
+                meta["talk_id"] = talk_id
+                documents.append(Document(content=transcription_file.read(), meta=meta))
 
         return {"documents": documents}
@@ -0,0 +1,137 @@
+import json
+import os
+
+from source.atomic_file_writer import AtomicFileWriter
+from source.corpus_catalog import CorpusCatalog
+from source.logger import LoggerMixin
+
+
+class TranscriptionCheckpoint(LoggerMixin):
+    """
+    A JSONL sidecar of a transcription in progress. The first line records the size and the checksum of the audio
+    file. Each following line is a transcribed segment with its text, start, end and language as well as `chunk_end`,
+    the position in seconds up to which the audio was transcribed when the segment was written. A chunk without
+    speech is recorded by a line that only contains its `chunk_end`, so it is not transcribed again on resume.
+
+    The segments of a chunk of audio are appended and synced to disk as soon as the chunk is transcribed, so a crash
+    only loses the chunk that was in progress. The final text file is derived from the sidecar. A sidecar of another
+    version of the audio file is discarded.
+
+    :param checkpoint_file_path: The path of the JSONL file.
+    :param audio_file_path: The path of the audio file that is transcribed.
+    """
+
+    def __init__(self, checkpoint_file_path: str, audio_file_path: str):
+        super().__init__()
+
+        self.checkpoint_file_path = checkpoint_file_path
+        self.audio_file_path = audio_file_path
+
+    def _describe_audio(self) -> dict:
+        """
+        :return: The first line of the sidecar, which identifies the version of the audio file.
+        """
+        return {
+            "audio_size": os.path.getsize(self.audio_file_path),
+            "audio_sha256": CorpusCatalog.hash_file(self.audio_file_path),
+        }
+
+    def _load_lines(self) -> list[dict]:
+        """
+        Loads the lines that were written so far. A line that was only partially written when the process died is
+        removed from the file.
+
+        :return: The lines of the sidecar in order.
+        """
+        if not os.path.exists(self.checkpoint_file_path):
+            return []
+
+        lines = []
+        valid_length = 0
+        with open(self.checkpoint_file_path, mode="rb") as file:
+            for line in file:
+                try:
+                    lines.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+                if not line.endswith(b"\n"):
+                    lines.pop()
+                    break
+                valid_length += len(line)
+
+        if valid_length < os.path.getsize(self.checkpoint_file_path):
+            self.log.warning(
+                f"Removing an incomplete line from {self.checkpoint_file_path}"
+            )
+            with open(self.checkpoint_file_path, mode="r+b") as file:
+                file.truncate(valid_length)
+
+        return lines
+
+    def _write_lines(self, lines: list[dict]) -> None:
+        with open(self.checkpoint_file_path, mode="a", encoding="utf-8") as file:
+            file.write(
+                "".join(json.dumps(line, ensure_ascii=False) + "\n" for line in lines)
+            )
+            file.flush()
+            os.fsync(file.fileno())
+
+    def load(self) -> list[dict]:
+        """
+        :return: The segments that were transcribed so far in order.
+        """
+        return [line for line in self._load_lines() if "text" in line]
+
+    def resume_position(self) -> float:
+        """
+        Starts a new sidecar if there is none or if it belongs to another version of the audio file.
+
+        :return: The position in seconds up to which the audio was transcribed completely.
+        """
+        lines = self._load_lines()
+        audio = self._describe_audio()
+        if lines and lines[0] != audio:
+            self.log.info(
+                f"Discarding {self.checkpoint_file_path}, the audio file changed"
+            )
+            self.reset()
+            lines = []
+        if not lines:
+            self._write_lines([audio])
+            return 0.0
+
+        return lines[-1].get("chunk_end", 0.0)
+
+    def append(self, segments: list[dict], chunk_end: float) -> None:
+        """
+        Appends the transcribed segments of a chunk of audio and syncs them to disk. `resume_position()` has to be
+        called first.
+
+        :param segments: The transcribed segments of the chunk, may be empty.
+        :param chunk_end: The position in seconds where the chunk ends.
+        :return: None
+        """
+        self._write_lines(
+            [segment | {"chunk_end": chunk_end} for segment in segments]
+            or [{"chunk_end": chunk_end}]
+        )
+
+    def reset(self) -> None:
+        """
+        Removes the sidecar to start the transcription from scratch.
+
+        :return: None
+        """
+        if os.path.exists(self.checkpoint_file_path):
+            os.remove(self.checkpoint_file_path)
+
+    def write_transcription(self, output_file_path: str) -> None:
+        """
+        Joins the transcribed segments and writes them to the text file. The file is replaced atomically, so it either
+        does not exist or contains the whole transcription.
+
+        :param output_file_path: The path of the transcription.
+        :return: None
+        """
+        transcription = "".join(segment["text"] for segment in self.load()).strip()
+        AtomicFileWriter.write(output_file_path, transcription)
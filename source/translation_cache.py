@@ -0,0 +1,150 @@
+import hashlib
+import os
+import sqlite3
+import unicodedata
+from contextlib import closing, contextmanager
+from typing import Iterator
+
+from source.git_root_finder import GitRootFinder
+from source.logger import LoggerMixin
+
+# SQLite limits the number of variables in a single statement
+LOOKUP_CHUNK_SIZE = 500
+
+
+class TranslationCache(LoggerMixin):
+    """
+    A persistent cache of translated sentences, stored in a SQLite database.
+
+    Translations are keyed by the name of the translation model, the source language and a hash of the normalized
+    sentence. Sentences are normalized by applying the Unicode NFC normalization and collapsing whitespace, so that
+    sentences which only differ in whitespace share one entry.
+
+    A connection is opened per operation, so the cache can be used from multiple threads and processes.
+
+    :param cache_path: The path of the database. Defaults to `data/translation_cache.sqlite`.
+    """
+
+    def __init__(self, cache_path: str = None):
+        super().__init__()
+
+        if cache_path is None:
+            cache_path = os.path.join(
+                GitRootFinder.get(), "data", "translation_cache.sqlite"
+            )
+        self.cache_path = cache_path
+
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS translations (
+                    model_name TEXT NOT NULL,
+                    source_language TEXT NOT NULL,
+                    sentence_hash TEXT NOT NULL,
+                    translation TEXT NOT NULL,
+                    PRIMARY KEY (model_name, source_language, sentence_hash)
+                ) WITHOUT ROWID
+                """
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """
+        Opens a connection and commits the transaction when the block is left without an error.
+        """
+        with closing(sqlite3.connect(self.cache_path, timeout=60)) as connection:
+            with connection:
+                yield connection
+
+    @staticmethod
+    def hash_sentence(sentence: str) -> str:
+        """
+        :param sentence: A sentence.
+        :return: The hash of the normalized sentence.
+        """
+        normalized = " ".join(unicodedata.normalize("NFC", sentence).split())
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+    def get_many(
+        self, model_name: str, source_language: str, sentences: list[str]
+    ) -> dict[int, str]:
+        """
+        Looks up the translations of multiple sentences.
+
+        :param model_name: The name of the translation model.
+        :param source_language: The language of the sentences.
+        :param sentences: The sentences to look up.
+        :return: The cached translations, keyed by the index of their sentence.
+        """
+        hashes = [self.hash_sentence(sentence) for sentence in sentences]
+
+        translations_by_hash = {}
+        with self._connect() as connection:
+            for start in range(0, len(hashes), LOOKUP_CHUNK_SIZE):
+                end = start + LOOKUP_CHUNK_SIZE
+                chunk = hashes[start:end]
+                placeholders = ", ".join("?" * len(chunk))
+                rows = connection.execute(
+                    f"""
+                    SELECT sentence_hash, translation FROM translations
+                    WHERE model_name = ? AND source_language = ? AND sentence_hash IN ({placeholders})
+                    """,
+                    (model_name, source_language, *chunk),
+                )
+                translations_by_hash |= dict(rows)
+
+        translations = {
+            index: translations_by_hash[sentence_hash]
+            for index, sentence_hash in enumerate(hashes)
+            if sentence_hash in translations_by_hash
+        }
+        self.hits += len(translations)
+        self.misses += len(sentences) - len(translations)
+
+        return translations
+
+    def put_many(
+        self,
+        model_name: str,
+        source_language: str,
+        sentences: list[str],
+        translations: list[str],
+    ) -> None:
+        """
+        Stores the translations of multiple sentences.
+
+        :param model_name: The name of the translation model.
+        :param source_language: The language of the sentences.
+        :param sentences: The translated sentences.
+        :param translations: The translations of the sentences in the same order.
+        :return: None
+        """
+        with self._connect() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?)",
+                [
+                    (
+                        model_name,
+                        source_language,
+                        self.hash_sentence(sentence),
+                        translation,
+                    )
+                    for sentence, translation in zip(sentences, translations)
+                ],
+            )
+
+    def statistics(self) -> dict[str, float]:
+        """
+        :return: The number of hits and misses since the cache was created and the resulting hit rate.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
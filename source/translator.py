@@ -1,52 +1,269 @@
 import json
+import multiprocessing
 import os
+import re
+from concurrent.futures import ProcessPoolExecutor
 
+import torch
+from haystack import tracing
 from transformers import MarianMTModel, MarianTokenizer
 
+from source.atomic_file_writer import AtomicFileWriter
+from source.corpus_catalog import CorpusCatalog
 from source.git_root_finder import GitRootFinder
+from source.instrumentation import Instrumentation
 from source.logger import LoggerMixin
+from source.translation_cache import TranslationCache
+
+# A sentence ends with ".", "!" or "?" followed by whitespace
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+
+
+def split_into_sentences(text: str) -> list[str]:
+    """
+    Splits a text into sentences. Unlike `text.split(".")` this keeps the punctuation and does not produce empty
+    sentences.
+
+    :param text: The text to split.
+    :return: The sentences of the text in order.
+    """
+    return [
+        sentence.strip()
+        for sentence in SENTENCE_BOUNDARY.split(text)
+        if sentence.strip()
+    ]
+
+
+# Every worker process of the pool keeps its own translator (and thereby its own models) in here
+_worker_translator = None
+
+
+def _initialize_worker(translator_arguments: dict, threads_per_worker: int) -> None:
+    """
+    Initializes a worker of the translation pool by limiting the number of threads torch may use and creating the
+    translator of the worker.
+
+    :param translator_arguments: The arguments to create the translator with.
+    :param threads_per_worker: The number of threads torch may use in this worker.
+    :return: None
+    """
+    global _worker_translator
+    torch.set_num_threads(threads_per_worker)
+    _worker_translator = Translator(**translator_arguments)
+    Instrumentation().enable(serve_metrics=False)
+
+
+def _translate_talk_in_worker(talk_id: str, language: str) -> dict:
+    """
+    Translates a talk with the translator of the current worker.
+
+    :param talk_id: The ID of the talk.
+    :param language: The language of the talk.
+    :return: The hits and misses of the translation cache while translating the talk.
+    """
+    statistics_before = _worker_translator.cache_statistics()
+    _worker_translator.translate_talk(talk_id, language)
+    statistics_after = _worker_translator.cache_statistics()
+
+    return {
+        key: statistics_after[key] - statistics_before[key]
+        for key in ("hits", "misses")
+    }
 
 
 class Translator(LoggerMixin):
     """
     The `Translator` class is responsible for translating text from one language to another.
     Start the translation process by calling the `start()` method.
+
+    Texts are translated in batches: The sentences of a text are sorted by their length and grouped into batches of at
+    most `max_batch_size` sentences and `max_batch_tokens` (padded) tokens. Each batch is translated with a single call
+    of the model.
+
+    Translated sentences are stored in a persistent `TranslationCache`. Sentences found in the cache are not passed to
+    the model and a model is only loaded once a sentence of its source language is not in the cache.
+
+    The talks to translate and their languages are looked up in the `CorpusCatalog`.
+
+    Every text is traced as the span `translator.translate_text` with the number of sentences and how many of them came
+    from the cache, every talk as `translator.translate_talk` and the whole run as `translator.run`, see
+    `Instrumentation`.
+
+    :param target_language: The ISO 639 code of the language to translate to.
+    :param max_batch_size: The maximum number of sentences that are translated at once.
+    :param max_batch_tokens: The maximum number of tokens in a batch, including padding.
+    :param use_cache: Whether to look up and store translations in the translation cache.
+    :param max_workers: The number of worker processes that translate talks in parallel. Each worker loads its own
+    models. Use 1 to translate in the current process.
+    :param threads_per_worker: The number of threads torch may use in each worker process.
     """
 
-    def __init__(self, target_language: str = "de"):
+    def __init__(
+        self,
+        target_language: str = "de",
+        max_batch_size: int = 32,
+        max_batch_tokens: int = 4096,
+        use_cache: bool = True,
+        max_workers: int = 1,
+        threads_per_worker: int = 1,
+    ):
         super().__init__()
 
+        self.translator_arguments = {
+            "target_language": target_language,
+            "max_batch_size": max_batch_size,
+            "max_batch_tokens": max_batch_tokens,
+            "use_cache": use_cache,
+        }
+        self.max_workers = max_workers
+        self.threads_per_worker = threads_per_worker
+
         self.target_language = target_language
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+
+        self.cache = TranslationCache() if use_cache else None
+        # The models are loaded lazily, keyed by their source language
+        self._models = {}
 
-        self.log.debug(
-            "Loading translation models. If this is your first time using this target language, this may take a few seconds..."
+        self.catalog = CorpusCatalog()
+        data_directory = os.path.join(GitRootFinder.get(), "data")
+        # Finished translations wait in here until their metadata is marked as translated
+        self.pending_translation_directory = os.path.join(
+            data_directory, "pending_translations"
         )
 
-        # It does not make sense to load a model for translating english into english
-        # (There is no model for this as well, why should there be?)
-        if target_language != "en":
-            model_name_source_english = f"Helsinki-NLP/opus-mt-en-{target_language}"
-            self.log.debug(f"Loading model {model_name_source_english}")
-            self.translation_model_source_english = MarianMTModel.from_pretrained(
-                model_name_source_english
+    def get_model_name(self, source_language: str) -> str:
+        """
+        :param source_language: The language of the text to be translated.
+        :return: The name of the model that translates from the source language into the target language.
+        """
+        return f"Helsinki-NLP/opus-mt-{source_language}-{self.target_language}"
+
+    def _get_model(self, source_language: str) -> tuple[MarianTokenizer, MarianMTModel]:
+        """
+        Loads the model for the source language on first use.
+
+        :param source_language: The language of the text to be translated.
+        :return: The tokenizer and the model that translate from the source language into the target language.
+        """
+        if source_language not in self._models:
+            model_name = self.get_model_name(source_language)
+            self.log.debug(
+                f"Loading model {model_name}. If this is your first time using this target language, this may take a few seconds..."
             )
-            self.tokenizer_source_english = MarianTokenizer.from_pretrained(
-                model_name_source_english
+            self._models[source_language] = (
+                MarianTokenizer.from_pretrained(model_name),
+                MarianMTModel.from_pretrained(model_name),
             )
 
-        if target_language != "de":
-            model_name_source_german = f"Helsinki-NLP/opus-mt-de-{target_language}"
-            self.log.debug(f"Loading model {model_name_source_german}")
-            self.translation_model_source_german = MarianMTModel.from_pretrained(
-                model_name_source_german
+        return self._models[source_language]
+
+    def translate_batch(self, sentences: list[str], source_language: str) -> list[str]:
+        """
+        Translates multiple sentences with a single call of the model.
+
+        :param sentences: The sentences to be translated.
+        :param source_language: The language of the sentences.
+        :return: The translated sentences in the same order.
+        """
+        tokenizer, translation_model = self._get_model(source_language)
+
+        inputs = tokenizer(
+            sentences, return_tensors="pt", padding=True, truncation=True
+        )
+        with torch.inference_mode():
+            translated = translation_model.generate(**inputs)
+
+        return tokenizer.batch_decode(translated, skip_special_tokens=True)
+
+    @staticmethod
+    def _split_long_sentences(
+        sentences: list[str], tokenizer: MarianTokenizer
+    ) -> tuple[list[str], list[int], list[int]]:
+        """
+        Splits sentences that exceed the input limit of the model into parts of roughly equal numbers of words.
+        Whisper sometimes produces very long sentences without punctuation, which would otherwise be truncated.
+
+        :param sentences: The sentences of a text.
+        :param tokenizer: The tokenizer of the model.
+        :return: A tuple of the parts, their numbers of tokens and the indices of the sentences they belong to.
+        """
+        max_tokens = tokenizer.model_max_length
+        parts = []
+        owners = []
+        for index, (sentence, length) in enumerate(
+            zip(sentences, map(len, tokenizer(sentences)["input_ids"]))
+        ):
+            if length <= max_tokens:
+                parts.append(sentence)
+                owners.append(index)
+                continue
+
+            words = sentence.split()
+            number_of_parts = -(-length // max_tokens) * 2
+            part_size = -(-len(words) // number_of_parts)
+            for start in range(0, len(words), part_size):
+                end = start + part_size
+                parts.append(" ".join(words[start:end]))
+                owners.append(index)
+
+        return parts, list(map(len, tokenizer(parts)["input_ids"])), owners
+
+    def _create_batches(self, lengths: list[int]) -> list[list[int]]:
+        """
+        Groups sentences into batches. The sentences are sorted by their length, so that little padding is needed.
+
+        :param lengths: The numbers of tokens of the sentences.
+        :return: The batches as lists of indices of the sentences.
+        """
+        batches = []
+        batch = []
+        for index in sorted(range(len(lengths)), key=lambda index: lengths[index]):
+            # The batch is padded to its longest sentence, which is the current one
+            padded_tokens = lengths[index] * (len(batch) + 1)
+            if batch and (
+                len(batch) >= self.max_batch_size
+                or padded_tokens > self.max_batch_tokens
+            ):
+                batches.append(batch)
+                batch = []
+            batch.append(index)
+        if batch:
+            batches.append(batch)
+
+        return batches
+
+    def _translate_sentences(
+        self, sentences: list[str], source_language: str
+    ) -> list[str]:
+        """
+        Translates sentences with the model in length-sorted batches.
+
+        :param sentences: The sentences to be translated.
+        :param source_language: The language of the sentences.
+        :return: The translated sentences in the same order.
+        """
+        tokenizer, _ = self._get_model(source_language)
+        parts, lengths, owners = self._split_long_sentences(sentences, tokenizer)
+
+        translated_parts = [""] * len(parts)
+        batches = self._create_batches(lengths)
+        for batch_number, batch in enumerate(batches, start=1):
+            self.log.debug(
+                f"Translating batch {batch_number} of {len(batches)} ({len(batch)} sentences)"
             )
-            self.tokenizer_source_german = MarianTokenizer.from_pretrained(
-                model_name_source_german
+            translations = self.translate_batch(
+                [parts[index] for index in batch], source_language
             )
+            for index, translation in zip(batch, translations):
+                translated_parts[index] = translation
 
-        data_directory = os.path.join(GitRootFinder.get(), "data")
-        self.metadata_directory = os.path.join(data_directory, "metadata")
-        self.transcription_directory = os.path.join(data_directory, "transcriptions")
+        translated_sentences = [[] for _ in sentences]
+        for owner, translated_part in zip(owners, translated_parts):
+            translated_sentences[owner].append(translated_part)
+
+        return [" ".join(parts) for parts in translated_sentences]
 
     def translate_text(self, text_to_translate: str, source_language: str) -> str:
         """
@@ -61,75 +278,166 @@ class Translator(LoggerMixin):
             translated_text = translator.translate_text("Hello", "en")
             print(translated_text)  # Output: "Hallo"
         """
-        if source_language == "en":
-            tokenizer = self.tokenizer_source_english
-            translation_model = self.translation_model_source_english
-        else:
-            tokenizer = self.tokenizer_source_german
-            translation_model = self.translation_model_source_german
+        sentences = split_into_sentences(text_to_translate)
+        if not sentences:
+            return ""
 
-        inputs = tokenizer([text_to_translate], return_tensors="pt", padding=True)
-        translated = translation_model.generate(**inputs)
-        translated_text = tokenizer.decode(translated[0], skip_special_tokens=True)
+        with tracing.tracer.trace("translator.translate_text") as span:
+            model_name = self.get_model_name(source_language)
+            translated_sentences = (
+                self.cache.get_many(model_name, source_language, sentences)
+                if self.cache
+                else {}
+            )
+            span.set_tag("sentences", len(sentences))
+            span.set_tag("cached_sentences", len(translated_sentences))
+            span.set_tag("characters", len(text_to_translate))
 
-        return translated_text
+            missing_indices = [
+                index
+                for index in range(len(sentences))
+                if index not in translated_sentences
+            ]
+            if missing_indices:
+                missing_sentences = [sentences[index] for index in missing_indices]
+                translations = self._translate_sentences(
+                    missing_sentences, source_language
+                )
+                translated_sentences |= dict(zip(missing_indices, translations))
 
-    def start(self) -> None:
+                if self.cache:
+                    self.cache.put_many(
+                        model_name, source_language, missing_sentences, translations
+                    )
+
+        return " ".join(translated_sentences[index] for index in range(len(sentences)))
+
+    def cache_statistics(self) -> dict[str, float]:
         """
-        This method is used to start the translation process for metadata files.
+        :return: The statistics of the translation cache, all zero if the cache is disabled.
+        """
+        if not self.cache:
+            return {"hits": 0, "misses": 0, "hit_rate": 0.0}
+
+        return self.cache.statistics()
+
+    def _get_paths(self, talk_id: str) -> tuple[str, str, str]:
+        """
+        :param talk_id: The ID of a talk.
+        :return: The paths of the metadata, the transcription and the pending translation of the talk.
+        """
+        return (
+            self.catalog.path_of(talk_id, "metadata"),
+            self.catalog.path_of(talk_id, "transcription"),
+            os.path.join(self.pending_translation_directory, f"{talk_id}.txt"),
+        )
 
+    def _complete_translation(self, talk_id: str) -> None:
+        """
+        Replaces the transcription of a talk with its pending translation and records it in the catalog.
+
+        :param talk_id: The ID of the talk.
         :return: None
         """
-        for metadata_file_name in os.listdir(self.metadata_directory):
-            with open(
-                os.path.join(self.metadata_directory, metadata_file_name),
-                mode="r+",
-                encoding="utf-8",
-            ) as file:
-                metadata = json.load(file)
-                language = metadata["language"]
-
-                if language == self.target_language:
-                    self.log.debug(
-                        f"{metadata_file_name} has the correct language, skipping it..."
-                    )
-                    continue
+        _, transcription_path, pending_path = self._get_paths(talk_id)
+        os.replace(pending_path, transcription_path)
+        self.catalog.register_transcription(talk_id)
+        self.catalog.mark_stage(talk_id, "translated")
 
-                transcription_file_name = metadata_file_name.replace(".json", ".txt")
-                transcription_file_path = os.path.join(
-                    self.transcription_directory, transcription_file_name
-                )
+    def translate_talk(self, talk_id: str, language: str) -> None:
+        """
+        Translates the transcription of a talk and marks the talk as translated.
+
+        A killed run must never leave a transcription behind that is marked as translated but is not, so the files are
+        replaced in three atomic steps:
+        1. The translation is written to `data/pending_translations/`.
+        2. The language in the metadata and in the catalog is set to the target language.
+        3. The pending translation replaces the transcription.
+        If the run is killed after step 2, `start()` finishes step 3 in the next run.
+
+        :param talk_id: The ID of the talk.
+        :param language: The language of the talk.
+        :return: None
+        """
+        with tracing.tracer.trace("translator.translate_talk"):
+            metadata_path, transcription_path, pending_path = self._get_paths(talk_id)
+            self.log.info(
+                f"Translating {os.path.basename(transcription_path)} from {language} to {self.target_language}"
+            )
+
+            with open(transcription_path, mode="r", encoding="utf-8") as file:
+                translated_text = self.translate_text(file.read(), language)
+            AtomicFileWriter.write(pending_path, translated_text)
+
+            metadata = self.catalog.get_metadata(talk_id)
+            metadata["language"] = self.target_language
+            AtomicFileWriter.write(
+                metadata_path, json.dumps(metadata, indent=4, ensure_ascii=False)
+            )
+            self.catalog.set_language(talk_id, self.target_language)
+
+            self._complete_translation(talk_id)
+            self.log.debug(f"Translated text written back to {transcription_path}")
+
+    def find_talks_to_translate(self) -> list[tuple[str, str]]:
+        """
+        Finds the talks whose transcription is not in the target language yet. Translations that were interrupted
+        after the metadata was updated are completed on the way.
 
-                if not os.path.exists(transcription_file_path):
+        :return: The IDs and languages of the talks, the longest transcription first.
+        """
+        if os.path.isdir(self.pending_translation_directory):
+            for filename in os.listdir(self.pending_translation_directory):
+                talk_id = filename.removesuffix(".txt")
+                if self.catalog.get_language(talk_id) == self.target_language:
                     self.log.info(
-                        f"No transcription file does exist for talk {metadata_file_name}, skipping it..."
+                        f"Completing the interrupted translation of {talk_id}"
                     )
-                    continue
+                    self._complete_translation(talk_id)
 
-                self.log.info(
-                    f"Translating {transcription_file_name} from {language} to {self.target_language}"
-                )
-                with open(
-                    transcription_file_path, mode="r+", encoding="utf-8"
-                ) as transcription_file:
-                    transcription = transcription_file.read()
-                    translated_text = ""
-                    for sentence in transcription.split("."):
-                        translated_text += self.translate_text(sentence, language)
-                        translated_text += ". "
-
-                    transcription_file.seek(0)
-                    transcription_file.truncate()
-                    transcription_file.write(translated_text)
-
-                    self.log.debug(
-                        f"Translated text written back to {transcription_file_path}"
-                    )
+        # Starting with the longest talks keeps the workers from waiting for a long talk at the end
+        return self.catalog.talks_not_in_language(self.target_language)
+
+    def start(self) -> None:
+        """
+        This method is used to start the translation process for metadata files.
+
+        :return: None
+        """
+        jobs = self.find_talks_to_translate()
+        self.log.info(f"Translating {len(jobs)} talks using {self.max_workers} workers")
+
+        hits = 0
+        misses = 0
+        with tracing.tracer.trace("translator.run") as span:
+            if self.max_workers == 1:
+                for talk_id, language in jobs:
+                    self.translate_talk(talk_id, language)
+                hits = self.cache_statistics()["hits"]
+                misses = self.cache_statistics()["misses"]
+            else:
+                with ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_initialize_worker,
+                    initargs=(self.translator_arguments, self.threads_per_worker),
+                ) as executor:
+                    for statistics in executor.map(
+                        _translate_talk_in_worker,
+                        [talk_id for talk_id, _ in jobs],
+                        [language for _, language in jobs],
+                    ):
+                        hits += statistics["hits"]
+                        misses += statistics["misses"]
+            span.set_tag("talks", len(jobs))
+            span.set_tag("cache_hits", hits)
+            span.set_tag("cache_misses", misses)
 
-                file.seek(0)
-                file.truncate()
-                metadata["language"] = self.target_language
-                file.write(json.dumps(metadata, indent=4, ensure_ascii=False))
+        if self.cache:
+            lookups = hits + misses
+            self.log.info(
+                f"Translation cache: {hits} hits, {misses} misses ({hits / lookups if lookups else 0:.0%} hit rate)"
+            )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,247 @@
+import os
+from typing import Optional, Union
+
+from haystack_integrations.document_stores.qdrant import QdrantDocumentStore
+from qdrant_client.http import models as rest
+
+from source.flat_document_store import FlatDocumentStore
+from source.flat_embedding_retriever import FlatEmbeddingRetriever
+from source.git_root_finder import GitRootFinder
+from source.logger import LoggerMixin
+from source.qdrant_search_retriever import QdrantSearchRetriever
+
+
+class VectorBackend(LoggerMixin):
+    """
+    Creates the document store and the matching retriever of the configured vector backend:
+
+    - "qdrant": The Qdrant server at `QDRANT_URL` (default: http://localhost:6333), started with docker compose.
+    - "qdrant-local": Qdrant in local mode, stored in `data/qdrant_local/`. It needs no server, but only one process
+      may open it at a time.
+    - "flat": A `FlatDocumentStore` in `data/flat_index/`, which searches a memory-mapped array of the embeddings in
+      the current process.
+
+    The backend is selected with the `VECTOR_BACKEND` environment variable (e.g. in the `.env` file) unless it is
+    passed explicitly.
+
+    The Qdrant server can keep a quantized copy of the vectors in memory, which is searched first: "scalar" stores
+    every dimension as int8 (4x smaller), "binary" stores only its sign (32x smaller). The best `top_k * oversampling`
+    candidates are then rescored with the original vectors. Like the HNSW parameters, these settings are read from
+    environment variables unless they are passed explicitly. Unset HNSW parameters keep the defaults of Qdrant. The
+    embedded backends always search exactly and ignore them.
+
+    :param backend: The name of the backend. Defaults to the value of `VECTOR_BACKEND` or "qdrant".
+    :param embedding_dim: The dimension of the embeddings.
+    :param index: The name of the collection.
+    :param quantization: "none", "scalar" or "binary". Defaults to `QDRANT_QUANTIZATION` or "none".
+    :param hnsw_m: The number of edges per node of the HNSW graph. Defaults to `QDRANT_HNSW_M`.
+    :param hnsw_ef_construct: The size of the candidate list while building the HNSW graph. Defaults to
+    `QDRANT_HNSW_EF_CONSTRUCT`.
+    :param hnsw_ef: The size of the candidate list while searching. Defaults to `QDRANT_HNSW_EF`.
+    :param oversampling: How many times `top_k` candidates are fetched with the quantized vectors. Defaults to
+    `QDRANT_OVERSAMPLING`.
+    :param rescore: Whether the candidates are rescored with the original vectors. Defaults to `QDRANT_RESCORE` or
+    true.
+    """
+
+    BACKENDS = ("qdrant", "qdrant-local", "flat")
+    # The metadata of the chunks that is used in filters, local Qdrant ignores payload indexes
+    PAYLOAD_INDEX_FIELDS = ("talk_id",)
+    QUANTIZATIONS = ("none", "scalar", "binary")
+
+    def __init__(
+        self,
+        backend: str = None,
+        embedding_dim: int = 384,
+        index: str = "gpn-chat",
+        quantization: str = None,
+        hnsw_m: int = None,
+        hnsw_ef_construct: int = None,
+        hnsw_ef: int = None,
+        oversampling: float = None,
+        rescore: bool = None,
+    ):
+        super().__init__()
+
+        if backend is None:
+            backend = os.environ.get("VECTOR_BACKEND", "qdrant")
+        if backend not in self.BACKENDS:
+            raise ValueError(
+                f'Unknown vector backend "{backend}", use one of {self.BACKENDS}'
+            )
+        self.backend = backend
+        self.embedding_dim = embedding_dim
+        self.index = index
+        self.log.debug(f'Using the vector backend "{self.backend}"')
+
+        if quantization is None:
+            quantization = os.environ.get("QDRANT_QUANTIZATION", "none")
+        if quantization not in self.QUANTIZATIONS:
+            raise ValueError(
+                f'Unknown quantization "{quantization}", use one of {self.QUANTIZATIONS}'
+            )
+        self.quantization = quantization
+
+        self.hnsw_m = hnsw_m or self._get_number("QDRANT_HNSW_M", int)
+        self.hnsw_ef_construct = hnsw_ef_construct or self._get_number(
+            "QDRANT_HNSW_EF_CONSTRUCT", int
+        )
+        self.hnsw_ef = hnsw_ef or self._get_number("QDRANT_HNSW_EF", int)
+        self.oversampling = oversampling or self._get_number(
+            "QDRANT_OVERSAMPLING", float
+        )
+        if rescore is None:
+            rescore = os.environ.get("QDRANT_RESCORE", "true").lower() != "false"
+        self.rescore = rescore
+
+    @staticmethod
+    def _get_number(variable: str, number_type: type) -> Optional[Union[int, float]]:
+        """
+        :param variable: The name of an environment variable.
+        :param number_type: The type to convert the value to.
+        :return: The value of the environment variable or None if it is not set.
+        """
+        value = os.environ.get(variable)
+        return number_type(value) if value else None
+
+    def hnsw_configuration(self) -> Optional[rest.HnswConfigDiff]:
+        """
+        :return: The configured HNSW parameters of the collection or None if Qdrant's defaults are used.
+        """
+        if self.hnsw_m is None and self.hnsw_ef_construct is None:
+            return None
+
+        return rest.HnswConfigDiff(m=self.hnsw_m, ef_construct=self.hnsw_ef_construct)
+
+    def quantization_configuration(
+        self,
+    ) -> Optional[Union[rest.ScalarQuantization, rest.BinaryQuantization]]:
+        """
+        :return: The quantization of the collection or None if the vectors are not quantized.
+        """
+        if self.quantization == "scalar":
+            return rest.ScalarQuantization(
+                scalar=rest.ScalarQuantizationConfig(
+                    type=rest.ScalarType.INT8, quantile=0.99, always_ram=True
+                )
+            )
+        if self.quantization == "binary":
+            return rest.BinaryQuantization(
+                binary=rest.BinaryQuantizationConfig(always_ram=True)
+            )
+
+        return None
+
+    def search_parameters(self) -> Optional[rest.SearchParams]:
+        """
+        :return: The parameters of a search or None if Qdrant's defaults are used.
+        """
+        quantization = None
+        if self.quantization != "none":
+            quantization = rest.QuantizationSearchParams(
+                rescore=self.rescore, oversampling=self.oversampling
+            )
+        if self.hnsw_ef is None and quantization is None:
+            return None
+
+        return rest.SearchParams(hnsw_ef=self.hnsw_ef, quantization=quantization)
+
+    def payload_indexes(self) -> Optional[list[dict]]:
+        """
+        :return: The keyword indexes of the metadata fields of the Qdrant server, None for the other backends.
+        """
+        if self.backend != "qdrant":
+            return None
+
+        return [
+            {
+                "field_name": f"meta.{field}",
+                "field_schema": rest.PayloadSchemaType.KEYWORD,
+            }
+            for field in self.PAYLOAD_INDEX_FIELDS
+        ]
+
+    def create_document_store(
+        self, recreate_index: bool = False, return_embedding: bool = False
+    ) -> Union[QdrantDocumentStore, FlatDocumentStore]:
+        """
+        :param recreate_index: Whether to delete all documents of an existing index.
+        :param return_embedding: Whether retrieved documents contain their embedding. Only supported by Qdrant.
+        :return: The document store of the backend.
+        """
+        data_directory = os.path.join(GitRootFinder.get(), "data")
+        if self.backend == "flat":
+            return FlatDocumentStore(
+                directory=os.path.join(data_directory, "flat_index"),
+                embedding_dim=self.embedding_dim,
+                recreate_index=recreate_index,
+            )
+
+        if self.backend == "qdrant-local":
+            location = {"path": os.path.join(data_directory, "qdrant_local")}
+        else:
+            location = {
+                "location": os.environ.get("QDRANT_URL", "http://localhost:6333")
+            }
+
+        return QdrantDocumentStore(
+            **location,
+            recreate_index=recreate_index,
+            return_embedding=return_embedding,
+            wait_result_from_api=True,
+            embedding_dim=self.embedding_dim,
+            index=self.index,
+            use_sparse_embeddings=False,
+            sparse_idf=True,
+            hnsw_config=self.hnsw_configuration(),
+            quantization_config=self.quantization_configuration(),
+            payload_fields_to_index=self.payload_indexes(),
+        )
+
+    def apply_collection_configuration(
+        self, document_store: Union[QdrantDocumentStore, FlatDocumentStore]
+    ) -> None:
+        """
+        Applies the HNSW parameters, the quantization and the payload indexes to an existing collection of the Qdrant
+        server. A new collection is already created with them. Qdrant rebuilds the index in the background.
+
+        :param document_store: A document store created by `create_document_store()`.
+        :return: None
+        """
+        if self.backend != "qdrant":
+            return
+
+        self.log.info(
+            f"Configuring the collection with {self.quantization} quantization and {self.hnsw_configuration()}"
+        )
+        document_store.client.update_collection(
+            collection_name=self.index,
+            hnsw_config=self.hnsw_configuration(),
+            quantization_config=self.quantization_configuration()
+            or rest.Disabled.DISABLED,
+        )
+        # Creating an index that already exists does nothing
+        for payload_index in self.payload_indexes():
+            document_store.client.create_payload_index(
+                collection_name=self.index, **payload_index
+            )
+
+    def create_retriever(
+        self,
+        document_store: Union[QdrantDocumentStore, FlatDocumentStore],
+        top_k: int = 10,
+    ) -> Union[QdrantSearchRetriever, FlatEmbeddingRetriever]:
+        """
+        :param document_store: A document store created by `create_document_store()`.
+        :param top_k: The maximum number of documents to retrieve.
+        :return: The embedding retriever for the document store.
+        """
+        if isinstance(document_store, FlatDocumentStore):
+            return FlatEmbeddingRetriever(document_store=document_store, top_k=top_k)
+
+        # Also without search parameters, because it filters the talks by exact matches
+        return QdrantSearchRetriever(
+            document_store=document_store,
+            top_k=top_k,
+            search_params=self.search_parameters(),
+        )
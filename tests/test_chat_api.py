@@ -0,0 +1,172 @@
+import asyncio
+import contextlib
+import json
+import threading
+from typing import AsyncIterator, Callable, Optional
+
+from aiohttp import ClientSession, web
+from haystack import Document
+from haystack.dataclasses import ChatMessage, StreamingChunk
+from haystack_integrations.components.generators.ollama import OllamaChatGenerator
+
+from benchmarks.fake_ollama_server import FakeOllamaServer
+from source.chat_api import ChatAPI
+
+
+class OllamaPipeline:
+    """
+    Answers every query with the LLM like the `GPNChatPipeline`, but without retrieval. The source of the answer is a
+    document with the query.
+
+    :param url: The URL of the Ollama server.
+    """
+
+    def __init__(self, url: str):
+        self.llm = OllamaChatGenerator(
+            model="fake",
+            url=f"{url}/api/chat",
+            timeout=10,
+            streaming_callback=self._stream_chunk,
+        )
+        # The generator only takes a callback on creation, every query runs in its own thread
+        self._call = threading.local()
+
+    def _stream_chunk(self, chunk: StreamingChunk) -> None:
+        if self._call.streaming_callback is not None:
+            self._call.streaming_callback(chunk)
+
+    def run_with_sources(
+        self,
+        query: str,
+        streaming_callback: Optional[Callable[[StreamingChunk], None]] = None,
+    ) -> tuple[str, list[Document]]:
+        self._call.streaming_callback = streaming_callback
+        reply = self.llm.run(messages=[ChatMessage.from_user(query)])["replies"][0]
+
+        return reply.content, [Document(content=query, meta={"talk_id": "talk"})]
+
+
+@contextlib.asynccontextmanager
+async def serve_chat_api(
+    time_to_first_token: float = 0.01, **chat_api_arguments: float
+) -> AsyncIterator[str]:
+    """
+    Serves the chat API in front of a `FakeOllamaServer` that answers with 5 tokens.
+
+    :param time_to_first_token: The amount of seconds until the fake server sends the first token.
+    :param chat_api_arguments: The arguments of the `ChatAPI`.
+    :return: The URL of the chat API.
+    """
+    # Both are created in the running loop, their semaphores bind to it on Python 3.9
+    ollama_runner = await FakeOllamaServer(
+        answer_tokens=5, time_to_first_token=time_to_first_token, tokens_per_second=500
+    ).start()
+    ollama_url = f"http://127.0.0.1:{ollama_runner.addresses[0][1]}"
+    chat_api = ChatAPI(OllamaPipeline(ollama_url), **chat_api_arguments)
+    chat_api_runner = web.AppRunner(chat_api.application())
+    await chat_api_runner.setup()
+    await web.TCPSite(chat_api_runner, "127.0.0.1", 0).start()
+    try:
+        yield f"http://127.0.0.1:{chat_api_runner.addresses[0][1]}"
+    finally:
+        await chat_api_runner.cleanup()
+        await ollama_runner.cleanup()
+
+
+def parse_events(body: str) -> list[tuple[str, object]]:
+    """
+    :param body: The body of a server-sent events response.
+    :return: The name and the data of every event.
+    """
+    events = []
+    for message in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in message.split("\n"))
+        events.append((fields["event"], json.loads(fields["data"])))
+
+    return events
+
+
+def test_chat_returns_answer_and_sources() -> None:
+    async def scenario() -> None:
+        async with serve_chat_api() as url, ClientSession() as session:
+            response = await session.post(f"{url}/chat", json={"query": "Zigbee?"})
+            assert response.status == 200
+            body = await response.json()
+
+        assert body["answer"] == "token0 token1 token2 token3 token4 "
+        assert [source["content"] for source in body["sources"]] == ["Zigbee?"]
+        assert body["sources"][0]["meta"] == {"talk_id": "talk"}
+
+    asyncio.run(scenario())
+
+
+def test_chat_rejects_request_without_query() -> None:
+    async def scenario() -> None:
+        async with serve_chat_api() as url, ClientSession() as session:
+            response = await session.post(f"{url}/chat", json={"question": "Zigbee?"})
+            assert response.status == 400
+
+    asyncio.run(scenario())
+
+
+def test_chat_stream_sends_tokens_then_sources_then_done() -> None:
+    async def scenario() -> None:
+        async with serve_chat_api() as url, ClientSession() as session:
+            response = await session.post(
+                f"{url}/chat/stream", json={"query": "Zigbee?"}
+            )
+            assert response.status == 200
+            assert response.headers["Content-Type"] == "text/event-stream"
+            events = parse_events(await response.text())
+
+        # Ollama ends the answer with an empty chunk
+        tokens = events[:-2]
+        assert [name for name, _ in events] == ["token"] * len(tokens) + [
+            "sources",
+            "done",
+        ]
+        assert "".join(data["content"] for _, data in tokens) == (
+            "token0 token1 token2 token3 token4 "
+        )
+        assert [source["content"] for source in events[-2][1]] == ["Zigbee?"]
+        assert events[-1][1] == {"answer": "token0 token1 token2 token3 token4 "}
+
+    asyncio.run(scenario())
+
+
+def test_chat_rejects_requests_when_the_queue_is_full() -> None:
+    async def scenario() -> None:
+        async with serve_chat_api(
+            time_to_first_token=0.5, max_concurrency=1, max_waiting=1
+        ) as url, ClientSession() as session:
+
+            async def ask() -> int:
+                response = await session.post(f"{url}/chat", json={"query": "Zigbee?"})
+                return response.status
+
+            statuses = await asyncio.gather(*(ask() for _ in range(3)))
+            health = await (await session.get(f"{url}/health")).json()
+
+        # One request runs, one waits and the third one is rejected right away
+        assert sorted(statuses) == [200, 200, 503]
+        assert health == {"running": 0, "waiting": 0}
+
+    asyncio.run(scenario())
+
+
+def test_chat_times_out() -> None:
+    async def scenario() -> None:
+        async with serve_chat_api(
+            time_to_first_token=1, request_timeout=0.2
+        ) as url, ClientSession() as session:
+            response = await session.post(f"{url}/chat", json={"query": "Zigbee?"})
+            assert response.status == 504
+
+            response = await session.post(
+                f"{url}/chat/stream", json={"query": "Zigbee?"}
+            )
+            events = parse_events(await response.text())
+
+        assert events == [("error", {"message": "The answer took too long"})]
+
+    asyncio.run(scenario())
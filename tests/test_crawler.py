@@ -0,0 +1,159 @@
+import asyncio
+import hashlib
+import os
+import threading
+from typing import Iterator
+
+import pytest
+from aiohttp import web
+from git import Repo
+
+from source.crawler import Crawler
+
+AUDIO = bytes(range(256)) * 4096
+TALK = "Zigbee hacking"
+
+
+class AudioServer:
+    """
+    Serves an audio file like the server of the GPN archive: It sends an ETag, answers a request with a matching
+    `If-None-Match` with 304 and a range request with 206, unless its `If-Range` does not match the ETag. The headers
+    and the status of every request are recorded.
+
+    :param content: The content of the file.
+    """
+
+    def __init__(self, content: bytes):
+        self.content = content
+        self.etag = f'"{hashlib.sha256(content).hexdigest()[:16]}"'
+        self.requests = []
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._runner = None
+
+    async def _serve(self, request: web.Request) -> web.Response:
+        headers = {"ETag": self.etag, "Accept-Ranges": "bytes"}
+        if request.headers.get("If-None-Match") == self.etag:
+            response = web.Response(status=304, headers=headers)
+        elif "Range" in request.headers and (
+            request.headers.get("If-Range", self.etag) == self.etag
+        ):
+            start = int(request.headers["Range"].removeprefix("bytes=").rstrip("-"))
+            headers["Content-Range"] = (
+                f"bytes {start}-{len(self.content) - 1}/{len(self.content)}"
+            )
+            response = web.Response(
+                status=206, body=self.content[start:], headers=headers
+            )
+        else:
+            # A range of another version of the file is answered with the whole file
+            response = web.Response(body=self.content, headers=headers)
+
+        self.requests.append((dict(request.headers), response.status))
+        return response
+
+    async def _start(self) -> web.AppRunner:
+        application = web.Application()
+        application.add_routes([web.get("/audio.mp3", self._serve)])
+        runner = web.AppRunner(application)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", 0).start()
+
+        return runner
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._runner.addresses[0][1]}/audio.mp3"
+
+    def start(self) -> None:
+        self._thread.start()
+        self._runner = asyncio.run_coroutine_threadsafe(
+            self._start(), self._loop
+        ).result()
+
+    def stop(self) -> None:
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+@pytest.fixture
+def workspace(tmp_path: str, monkeypatch: pytest.MonkeyPatch) -> str:
+    """
+    :return: A git repository in a temporary directory as the working directory, so the crawler writes its data there.
+    """
+    Repo.init(tmp_path)
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(os.path.join(tmp_path, "data", "audio"))
+
+    return str(tmp_path)
+
+
+@pytest.fixture
+def audio_server() -> Iterator[AudioServer]:
+    server = AudioServer(AUDIO)
+    server.start()
+    yield server
+    server.stop()
+
+
+def read_audio(workspace: str) -> bytes:
+    with open(
+        os.path.join(workspace, "data", "audio", f"{TALK}.mp3"), mode="rb"
+    ) as file:
+        return file.read()
+
+
+def test_unchanged_audio_is_not_downloaded_again(
+    workspace: str, audio_server: AudioServer
+) -> None:
+    crawler = Crawler()
+    assert crawler.download_audio_of_talk(TALK, audio_server.url)
+    assert not crawler.download_audio_of_talk(TALK, audio_server.url)
+
+    (_, first_status), (second_headers, second_status) = audio_server.requests
+    assert first_status == 200
+    assert second_headers["If-None-Match"] == audio_server.etag
+    assert second_status == 304
+    assert read_audio(workspace) == AUDIO
+
+
+def test_partial_download_is_resumed(workspace: str, audio_server: AudioServer) -> None:
+    crawler = Crawler()
+    partial_path = os.path.join(workspace, "data", "audio", f"{TALK}.mp3.part")
+    with open(partial_path, mode="wb") as file:
+        file.write(AUDIO[:1000])
+    crawler.manifest.update_talk(
+        TALK, "audio", url=audio_server.url, etag=audio_server.etag, complete=False
+    )
+
+    assert crawler.download_audio_of_talk(TALK, audio_server.url)
+
+    ((headers, status),) = audio_server.requests
+    assert headers["Range"] == "bytes=1000-"
+    assert headers["If-Range"] == audio_server.etag
+    assert status == 206
+    assert read_audio(workspace) == AUDIO
+    assert not os.path.exists(partial_path)
+    assert crawler.manifest.get_talk(TALK)["audio"]["complete"]
+
+
+def test_partial_download_of_a_changed_file_starts_over(
+    workspace: str, audio_server: AudioServer
+) -> None:
+    crawler = Crawler()
+    with open(
+        os.path.join(workspace, "data", "audio", f"{TALK}.mp3.part"), mode="wb"
+    ) as file:
+        file.write(b"outdated")
+    crawler.manifest.update_talk(
+        TALK, "audio", url=audio_server.url, etag='"outdated"', complete=False
+    )
+
+    assert crawler.download_audio_of_talk(TALK, audio_server.url)
+
+    ((headers, status),) = audio_server.requests
+    assert headers["If-Range"] == '"outdated"'
+    assert status == 200
+    assert read_audio(workspace) == AUDIO